@@ -0,0 +1,185 @@
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Sequence
+from loguru import logger
+from fake_llm import FakeModelConfig, install_fake_model
+from metrics import PhaseStats
+
+# Hydra overrides selecting each story
+STORIES: Dict[str, List[str]] = {
+    "Facade": ["story=Facade_story", "character=character_state_Facade", "user=user_state_Facade"],
+    "Wonderland": ["story=Wonderland_story", "character=character_state_Wonderland", "user=user_state_Wonderland"],
+}
+
+# Player responses, used in turn by every session
+USER_RESPONSES = (
+    "I think you two should talk about what is really going on.",
+    "That sounds hard. How long have you felt this way?",
+    "Let's change the subject, how was your trip?",
+    "I'm not taking sides here.",
+)
+
+
+@dataclass
+class BenchmarkResult:
+    """Throughput and overhead of one story at one number of concurrent sessions"""
+    story: str
+    sessions: int
+    turns: int = 0
+    wall_seconds: float = 0.0
+    turns_per_second: float = 0.0
+    cpu_ms_per_turn: float = 0.0
+    memory_kb_per_session: float = 0.0
+    p50_ms: float = 0.0
+    p99_ms: float = 0.0
+    error: Optional[str] = None
+
+    def row(self) -> str:
+        """One line of the result table"""
+        if self.error:
+            return f"{self.story:12} {self.sessions:>7}  FAILED: {self.error}"
+        return (
+            f"{self.story:12} {self.sessions:>7} {self.turns:>8} {self.turns_per_second:>10.1f} "
+            f"{self.cpu_ms_per_turn:>10.3f} {self.memory_kb_per_session:>10.1f} {self.p50_ms:>9.2f} {self.p99_ms:>9.2f}"
+        )
+
+
+TABLE_HEADER = f"{'story':12} {'sessions':>7} {'turns':>8} {'turns/s':>10} {'cpu ms/t':>10} {'KB/sess':>10} {'p50 ms':>9} {'p99 ms':>9}"
+
+
+async def _play(engine, turns: int, latencies: PhaseStats) -> None:
+    for turn in range(turns):
+        started = time.perf_counter()
+        await engine.process_user_input(USER_RESPONSES[turn % len(USER_RESPONSES)])
+        latencies.add(time.perf_counter() - started)
+
+
+async def run_benchmark(story: str, sessions: int, turns: int = 3, speculative: bool = False, fused_turn: bool = False) -> BenchmarkResult:
+    """
+    Start sessions of a story concurrently and play a few turns in each.
+
+    Session creation and the opening conversation are measured for memory
+    only; throughput, CPU time and latency are measured over the turns.
+
+    Args:
+        story: Name of the story in STORIES
+        sessions: Number of concurrent sessions
+        turns: Turns played in each session
+        speculative: Whether engines run speculative turns
+        fused_turn: Whether engines run fused turns
+
+    Returns:
+        The BenchmarkResult, with `error` set if the story could not be played
+    """
+    from game_engine import GameEngine
+    from story_template import load_story_template
+
+    result = BenchmarkResult(story=story, sessions=sessions)
+    try:
+        template = load_story_template(STORIES[story])
+    except Exception as e:
+        result.error = f"cannot load story: {' '.join(str(e).split())[:200]}"
+        return result
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    try:
+        engines = [
+            GameEngine(print_output=False, speculative=speculative, fused_turn=fused_turn, template=template)
+            for _ in range(sessions)
+        ]
+        await asyncio.gather(*(engine.start_story() for engine in engines))
+        result.memory_kb_per_session = (tracemalloc.get_traced_memory()[0] - baseline) / sessions / 1024
+    except Exception as e:
+        result.error = f"cannot start story: {e}"
+        return result
+    finally:
+        tracemalloc.stop()
+
+    latencies = PhaseStats(sample_size=sessions * turns)
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    await asyncio.gather(*(_play(engine, turns, latencies) for engine in engines))
+    result.wall_seconds = time.perf_counter() - wall_started
+    cpu_seconds = time.process_time() - cpu_started
+
+    result.turns = latencies.count
+    result.turns_per_second = result.turns / result.wall_seconds
+    result.cpu_ms_per_turn = cpu_seconds / result.turns * 1000
+    result.p50_ms = latencies.percentile(50) * 1000
+    result.p99_ms = latencies.percentile(99) * 1000
+    return result
+
+
+def compare_to_baseline(results: Sequence[BenchmarkResult], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    Find the results whose CPU time per turn regressed against a saved baseline.
+
+    Args:
+        results: The new results
+        baseline: Results saved by an earlier run with --save
+        tolerance: Allowed relative increase, e.g. 0.25 for 25%
+
+    Returns:
+        A description of every regression
+    """
+    previous = {(entry["story"], entry["sessions"]): entry for entry in baseline}
+    regressions = []
+    for result in results:
+        entry = previous.get((result.story, result.sessions))
+        if result.error or entry is None or entry.get("error"):
+            continue
+        limit = entry["cpu_ms_per_turn"] * (1 + tolerance)
+        if result.cpu_ms_per_turn > limit:
+            regressions.append(
+                f"{result.story} x{result.sessions}: {result.cpu_ms_per_turn:.3f} cpu ms/turn "
+                f"(baseline {entry['cpu_ms_per_turn']:.3f})"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure the non-LLM overhead of game turns with a local fake model")
+    parser.add_argument("--stories", nargs="+", default=list(STORIES), choices=list(STORIES))
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 100, 10000], help="Concurrent session counts")
+    parser.add_argument("--turns", type=int, default=3, help="Turns played per session")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every fake LLM request takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random seconds of up to this much per request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument("--fused-turn", action="store_true")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--save", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Fail if CPU time per turn regressed against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression against the baseline")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    install_fake_model(FakeModelConfig(latency=args.latency, jitter=args.jitter, seed=args.seed))
+
+    async def main() -> List[BenchmarkResult]:
+        results = []
+        print(TABLE_HEADER)
+        for story in args.stories:
+            for sessions in args.sessions:
+                result = await run_benchmark(story, sessions, args.turns, args.speculative, args.fused_turn)
+                print(result.row(), flush=True)
+                results.append(result)
+        return results
+
+    results = asyncio.run(main())
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
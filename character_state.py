@@ -1,8 +1,7 @@
-Hellofrom dataclasses import dataclass, field
-from typing import Dict, Optional, List, Any
-from hydra.core.config_store import ConfigStore
-from omegaconf import DictConfig, OmegaConf
-import hydra
+from dataclasses import dataclass, field
+from typing import Dict, Optional, List, Any, Tuple, Iterator, Union
+from collections.abc import MutableMapping
+from bisect import bisect_right
 import re
 from loguru import logger
 
@@ -15,6 +14,69 @@ class StateRules:
         """String representation of StateRules"""
         return f"StateRules(ranges={self.ranges})"
 
+@dataclass(frozen=True)
+class RuleIndex:
+    """Rule ranges of a state, sorted by their lower bound for bisect lookup"""
+    starts: Tuple[int, ...] = ()
+    ends: Tuple[int, ...] = ()
+    prompts: Tuple[str, ...] = ()
+    
+    @classmethod
+    def from_rules(cls, state_name: str, rules: Dict[str, str], min_value: Optional[int] = None, max_value: Optional[int] = None) -> "RuleIndex":
+        """
+        Parse rules like {"0-30": "...", "31-60": "..."} into an interval index.
+        
+        Args:
+            state_name: Name of the state, for error messages
+            rules: Rule prompts by range ("<min>-<max>") or single value ("<value>")
+            min_value: Minimum value of the state, to report values without a rule
+            max_value: Maximum value of the state, to report values without a rule
+            
+        Returns:
+            The RuleIndex
+            
+        Raises:
+            ValueError: If a range is malformed or two ranges overlap
+        """
+        intervals = []
+        for rule_condition, rule_prompt in (rules or {}).items():
+            rule_str = str(rule_condition)
+            try:
+                if "-" not in rule_str:
+                    low = high = int(rule_str)
+                else:
+                    low = int(rule_str.split("-")[0])
+                    high = int(rule_str.split("-")[1])
+            except ValueError:
+                raise ValueError(f"Invalid rule range '{rule_str}' for state {state_name}")
+            if low > high:
+                raise ValueError(f"Invalid rule range '{rule_str}' for state {state_name}")
+            intervals.append((low, high, rule_prompt))
+        intervals.sort(key=lambda interval: interval[0])
+        
+        for (low, high, _), (next_low, next_high, _) in zip(intervals, intervals[1:]):
+            if next_low <= high:
+                raise ValueError(f"Rule ranges {low}-{high} and {next_low}-{next_high} of state {state_name} overlap")
+            if next_low > high + 1:
+                logger.warning(f"No rule for values {high + 1}-{next_low - 1} of state {state_name}")
+        if intervals and min_value is not None and intervals[0][0] > min_value:
+            logger.warning(f"No rule for values {min_value}-{intervals[0][0] - 1} of state {state_name}")
+        if intervals and max_value is not None and intervals[-1][1] < max_value:
+            logger.warning(f"No rule for values {intervals[-1][1] + 1}-{max_value} of state {state_name}")
+        
+        return cls(
+            starts=tuple(low for low, _, _ in intervals),
+            ends=tuple(high for _, high, _ in intervals),
+            prompts=tuple(prompt for _, _, prompt in intervals)
+        )
+    
+    def lookup(self, value) -> Optional[str]:
+        """Get the rule prompt for a value, or None if no range contains it"""
+        index = bisect_right(self.starts, value) - 1
+        if index >= 0 and value <= self.ends[index]:
+            return self.prompts[index]
+        return None
+
 @dataclass
 class StateConfig:
     """Configuration for a single state"""
@@ -25,6 +87,12 @@ class StateConfig:
     default: int
     no_analyse:bool = field(default=False)
     rules: Dict[str, str] = field(default_factory=dict)
+    # rules parsed for lookup, built from rules when not given
+    rule_index: Optional[RuleIndex] = field(default=None, repr=False, compare=False)
+    
+    def __post_init__(self):
+        if self.rule_index is None:
+            self.rule_index = RuleIndex.from_rules(self.name, self.rules, self.min, self.max)
     
     def __str__(self) -> str:
         """String representation of StateConfig"""
@@ -42,53 +110,135 @@ def __str__(self) -> str:
 
 
 
+@dataclass(frozen=True)
+class CharacterSchema:
+    """
+    Immutable layout of a set of states (names, bounds, defaults and rules),
+    shared by every CharacterState built from the same config.
+    """
+    config: CharacterStateConfig
+    names: Tuple[str, ...]
+    # Position of each state in the values of a CharacterState
+    index: Dict[str, int]
+    defaults: Tuple[Any, ...]
+    mins: Tuple[Any, ...]
+    maxs: Tuple[Any, ...]
+    rule_indexes: Tuple[RuleIndex, ...]
+    no_analyse_name: Tuple[str, ...]
+    
+    @classmethod
+    def from_config(cls, config: CharacterStateConfig) -> "CharacterSchema":
+        """Build the schema of a CharacterStateConfig"""
+        states = list(config.states.values())
+        names = tuple(config.states.keys())
+        return cls(
+            config=config,
+            names=names,
+            index={name: position for position, name in enumerate(names)},
+            defaults=tuple(state.default for state in states),
+            mins=tuple(state.min for state in states),
+            maxs=tuple(state.max for state in states),
+            rule_indexes=tuple(state.rule_index for state in states),
+            no_analyse_name=tuple(name for name, state in config.states.items() if state.no_analyse)
+        )
+
+
+class StateValues(MutableMapping):
+    """Dict-like view of the values of a CharacterState, keyed by state name"""
+    __slots__ = ("_state",)
+    
+    def __init__(self, state: "CharacterState"):
+        self._state = state
+    
+    def __getitem__(self, key):
+        return self._state._values[self._state.schema.index[key]]
+    
+    def __setitem__(self, key, value):
+        self._state._values[self._state.schema.index[key]] = value
+        self._state._rules_cache = None
+    
+    def __delitem__(self, key):
+        raise TypeError("States cannot be removed from a CharacterState")
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._state.schema.names)
+    
+    def __len__(self) -> int:
+        return len(self._state.schema.names)
+    
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
 class CharacterState:
-    def __init__(self, config: CharacterStateConfig):
-        self.config = config
-        self.state_names = self.config.states.keys()
-        self.state_dicts = self.config.states
-        self.state_values = {}
-        self.no_analyse_name = [key for key,value in self.state_dicts.items() if value.no_analyse]
-        for key,value in self.state_dicts.items():
-            self.state_values[key] = value.default
+    """
+    Current values of a set of states.
+    Only the values are stored per instance; names, bounds and rules live in
+    the CharacterSchema shared by all instances built from the same config.
+    """
+    __slots__ = ("schema", "_values", "_rules_cache", "name")
+    
+    def __init__(self, config: Union[CharacterStateConfig, CharacterSchema]):
+        self.schema = config if isinstance(config, CharacterSchema) else CharacterSchema.from_config(config)
+        self._values: List[Any] = list(self.schema.defaults)
+        # Result of get_rules, cleared whenever a value changes
+        self._rules_cache: Optional[Dict[str, str]] = None
+
+    @property
+    def config(self) -> CharacterStateConfig:
+        return self.schema.config
+
+    @property
+    def state_names(self):
+        return self.schema.config.states.keys()
+
+    @property
+    def state_dicts(self) -> Dict[str, StateConfig]:
+        return self.schema.config.states
+
+    @property
+    def no_analyse_name(self) -> Tuple[str, ...]:
+        return self.schema.no_analyse_name
+
+    @property
+    def state_values(self) -> StateValues:
+        return StateValues(self)
 
     def set_name(self,name:str):
         self.name = name
 
     def _get_state_value(self,state_name):
-        return self.state_values[state_name]
+        return self._values[self.schema.index[state_name]]
 
     def update_state(self,**kwards) -> None:
         """Update character state values, ensuring they stay within min/max bounds"""
+        schema = self.schema
         for state_name,state_value_delta in kwards.items():
-            assert state_name in self.state_names, f"{state_name} not exists in {self.state_names}"
-            new_value = self._get_state_value(state_name) + state_value_delta
-            if new_value < self.state_dicts[state_name].min:
-                new_value =  self.state_dicts[state_name].min
-            elif new_value > self.state_dicts[state_name].max:
-                new_value = self.state_dicts[state_name].max
-            self.state_values[state_name] = new_value
+            assert state_name in schema.index, f"{state_name} not exists in {self.state_names}"
+            position = schema.index[state_name]
+            new_value = self._values[position] + state_value_delta
+            if new_value < schema.mins[position]:
+                new_value = schema.mins[position]
+            elif new_value > schema.maxs[position]:
+                new_value = schema.maxs[position]
+            self._values[position] = new_value
+            self._rules_cache = None
             logger.info(f"update {state_name} to {new_value}")
 
-    def _check_rules(self,curr_value:int,rule_str:str):
-        if "-" not in rule_str:
-            return curr_value == int(rule_str)
-        min = int(rule_str.split("-")[0])
-        max = int(rule_str.split("-")[1])
-        return min<= curr_value <= max
-
     def get_rules(self):
-        rule_results = {}
-        for state_name in self.state_names:
-            current_value = self.state_values[state_name]
-            rules = self.state_dicts[state_name].rules
-            for rule_condition,rule_prompt in rules.items():
-                if self._check_rules(current_value,rule_condition):
+        """Get the rule prompt of every state whose current value has one"""
+        if self._rules_cache is None:
+            rule_results = {}
+            for state_name, rule_index, value in zip(self.schema.names, self.schema.rule_indexes, self._values):
+                rule_prompt = rule_index.lookup(value)
+                if rule_prompt is not None:
                     rule_results[state_name] = rule_prompt
-        return rule_results
+            self._rules_cache = rule_results
+        return dict(self._rules_cache)
 
 
-def build_character_state(cfg:dict) -> CharacterState:
+def build_character_schema(cfg:dict) -> CharacterSchema:
+    """Build the schema shared by the character states of a config"""
     character_state_dict = cfg.character
     character_state_names = character_state_dict.keys()
 
@@ -103,11 +253,10 @@ def build_character_state(cfg:dict) -> CharacterState:
                     default=character_state_dict[character_state_name]['default'],
                     rules=character_state_dict[character_state_name]['rules'])
         character_state_config.states[character_state_name] = state_config
-    cs = CharacterState(character_state_config)
-    
-    return cs
+    return CharacterSchema.from_config(character_state_config)
 
-def build_user_state(cfg:dict) -> CharacterState:
+def build_user_schema(cfg:dict) -> CharacterSchema:
+    """Build the schema of the user state of a config"""
     character_state_dict = cfg.user
     character_state_names = character_state_dict.keys()
 
@@ -123,7 +272,15 @@ def build_user_state(cfg:dict) -> CharacterState:
                     rules=character_state_dict[character_state_name]['rules'],
                     no_analyse=character_state_dict[character_state_name].get('no_analyse',False))
         character_state_config.states[character_state_name] = state_config
-    cs = CharacterState(character_state_config)
+    return CharacterSchema.from_config(character_state_config)
+
+def build_character_state(cfg:dict, schema: Optional[CharacterSchema] = None) -> CharacterState:
+    cs = CharacterState(schema or build_character_schema(cfg))
+    
+    return cs
+
+def build_user_state(cfg:dict, schema: Optional[CharacterSchema] = None) -> CharacterState:
+    cs = CharacterState(schema or build_user_schema(cfg))
     cs.set_name == 'user'
     return cs
     
@@ -1,7 +1,11 @@
 from pydantic_LLM import LLMInterface
 from character_state import CharacterState
 from story_state import StoryState
-from typing import Dict, List, Optional, Any, Type
+from prompt_builder import CONVERSATION_INSTRUCTIONS, PROMPT_LAYOUT_CACHE_FRIENDLY, PROMPT_LAYOUT_DEFAULT, get_static_fragments
+from prompt_assembler import AssembledPrompt, PromptAssembler, PromptSection
+from metrics import record_local_analysis, span
+from local_analyzer import USER_ENTITY, AnalysisLog, LocalStateClassifier, analysis_changes
+from typing import Dict, List, Optional, Any, Type, Tuple
 from pydantic import BaseModel, Field, create_model
 from loguru import logger
 
@@ -33,19 +37,45 @@ class ConversationAnalyzer:
     then updates character and user states based on the analysis.
     """
     
-    def __init__(self, story_state: StoryState):
+    def __init__(
+        self,
+        story_state: StoryState,
+        assembler: Optional[PromptAssembler] = None,
+        layout: str = PROMPT_LAYOUT_DEFAULT,
+        local_classifier: Optional[LocalStateClassifier] = None,
+        confidence_threshold: Optional[float] = None,
+        analysis_log: Optional[AnalysisLog] = None
+    ):
         """
         Initialize the ConversationAnalyzer with story state.
         
         Args:
             story_state: The current state of the story, containing character states and user state
+            assembler: Prompt assembler enforcing the prompt token budget, defaults to no budget
+            layout: Prompt layout, "default" or "cache_friendly"
+            local_classifier: Classifier predicting routine state changes without an LLM call
+            confidence_threshold: Minimum confidence of the local prediction, below it the LLM is called;
+                defaults to the threshold calibrated when the classifier was trained
+            analysis_log: Log receiving every LLM analysis as training data for the local classifier
         """
         self.story_state = story_state
+        self.layout = layout
+        self.local_classifier = local_classifier
+        self.confidence_threshold = confidence_threshold
+        self.analysis_log = analysis_log
+        self.assembler = assembler or PromptAssembler()
+        self.last_prompt: Optional[AssembledPrompt] = None
+        
+        # Story and character backgrounds, shared with the conversation prompt builder
+        self.fragments = get_static_fragments(story_state)
         
         # Dynamically create state change models based on actual state names
         self.character_state_names = self._get_character_state_names()
         self.user_state_names = self._get_user_state_names()
         
+        # Remember the schema the models below were built for
+        self.schema_key = self.schema_key_for(story_state)
+        
         # Create dynamic models for character and user state changes
         self.CharacterStateChanges = create_state_changes_model(self.character_state_names, "Character ")
         self.UserStateChanges = create_state_changes_model(self.user_state_names, "User ")
@@ -73,7 +103,57 @@ class ConversationAnalyzer:
         self.ConversationAnalysisOutput = create_model("DynamicConversationAnalysisOutput", **output_fields)
         
         # Initialize the LLM interface with the dynamic output model
-        self.llm = LLMInterface(self.ConversationAnalysisOutput)
+        self.llm = LLMInterface(self.ConversationAnalysisOutput, task="analysis")
+        
+        # The fused turn model and its LLM interface are only built when used
+        self.FusedTurnOutput = None
+        self.fused_llm = None
+    
+    @staticmethod
+    def schema_key_for(story_state: StoryState) -> Tuple:
+        """
+        Compute the key identifying the characters and state schemas of a story state.
+        
+        Two story states with the same key produce identical analysis output models,
+        so an analyzer built for one can be reused for the other.
+        
+        Args:
+            story_state: The story state to compute the key for
+            
+        Returns:
+            A hashable tuple of character IDs, character state names and analysed user state names
+        """
+        character_key = tuple(
+            (char_id, tuple(char_state.state_values.keys()))
+            for char_id, char_state in story_state.character_states.items()
+        )
+        user_key = None
+        if story_state.user_state:
+            user_state = story_state.user_state
+            user_key = tuple(name for name in user_state.state_values.keys() if name not in user_state.no_analyse_name)
+        return (character_key, user_key)
+    
+    def matches(self, story_state: StoryState) -> bool:
+        """
+        Check whether this analyzer can be reused for the given story state.
+        
+        Args:
+            story_state: The story state to check against
+            
+        Returns:
+            True if the analyzer was built for the same story state and schema
+        """
+        return story_state is self.story_state and self.schema_key == self.schema_key_for(story_state)
+    
+    def _character_name(self, char_id: str) -> str:
+        """Name of a character as shown in analysis prompts, defaulting to its ID"""
+        fragment = self.fragments.characters.get(char_id)
+        return char_id if fragment is None or fragment.name is None else fragment.name
+    
+    def _character_background(self, char_id: str) -> str:
+        """Background of a character, empty if the story does not describe it"""
+        fragment = self.fragments.characters.get(char_id)
+        return fragment.background if fragment else ""
     
     def _get_character_state_names(self) -> List[str]:
         """
@@ -104,116 +184,228 @@ class ConversationAnalyzer:
         return [name for name in list(self.story_state.user_state.state_values.keys()) if name not in self.story_state.user_state.no_analyse_name]
         
     
-    def _build_analysis_prompt(self, dialogue: List[str], user_response: str) -> str:
+    def _character_states_text(self, char_state: CharacterState) -> str:
         """
-        Build a prompt for the LLM to analyze the conversation.
+        Format the current values of a character's states with their ranges.
         
         Args:
-            dialogue: List of dialogue lines from the conversation
-            user_response: The user's response to the conversation
+            char_state: The character state
             
         Returns:
-            A formatted prompt string for the LLM
+            One line per state
         """
-        # Get character names and backgrounds
-        character_backgrounds = self.story_state.get_character_background()
+        text = ""
+        for state_name, state_value in char_state.state_values.items():
+            # Get min and max values for this state
+            state_config = char_state.state_dicts.get(state_name)
+            min_val = state_config.min if state_config else 0
+            max_val = state_config.max if state_config else 100
+            
+            text += f"- {state_name}: {state_value} ({min_val}-{max_val})\n"
+        return text
+    
+    def _user_states_text(self) -> str:
+        """
+        Format the current values of the user's states with their ranges.
+        
+        Returns:
+            One line per state, with the meaning of player_role spelled out
+        """
+        user_state = self.story_state.user_state
+        text = ""
+        
+        # Add all user states
+        for state_name, state_value in user_state.state_values.items():
+            # Get min and max values for this state
+            state_config = user_state.state_dicts.get(state_name)
+            min_val = state_config.min if state_config else 0
+            max_val = state_config.max if state_config else 100
+            
+            # Add special description for player_role if it exists
+            if state_name == "player_role":
+                # Get character names for the description
+                char_ids = list(self.story_state.character_states.keys())
+                if len(char_ids) >= 2:
+                    char1_name = self._character_name(char_ids[0])
+                    char2_name = self._character_name(char_ids[1])
+                    text += f"- {state_name}: {state_value} ({min_val}-{max_val}, where {min_val} is allied with {char2_name}, {(min_val + max_val) // 2} is neutral, {max_val} is allied with {char1_name})\n"
+                else:
+                    text += f"- {state_name}: {state_value} ({min_val}-{max_val})\n"
+            else:
+                text += f"- {state_name}: {state_value} ({min_val}-{max_val})\n"
+        return text
+    
+    def _analysis_instructions(self) -> str:
+        """
+        Build the analysis instructions, which only depend on the state names.
+        
+        Returns:
+            The instructions text
+        """
+        instructions = """
+Based on the conversation and the user's response, analyze how the states of the characters and user should change.
+For each state, provide a delta value (positive or negative) and reasoning.
+
+Consider:
+"""
+        
+        # Add considerations based on character states
+        for state_name in self.character_state_names:
+            instructions += f"- How the dialogue affects {state_name} between characters\n"
         
+        # Add considerations for user states
+        for state_name in self.user_state_names:
+            if state_name == "player_role":
+                instructions += f"- Whether the user is taking sides or remaining neutral\n"
+            else:
+                instructions += f"- How the user's response affects {state_name}\n"
+        
+        instructions += """
+Provide delta values that are reasonable (typically between -15 and +15) and proportional to the significance of the interaction.
+"""
+        return instructions
+    
+    def _current_situation(self) -> str:
+        """Description of the current story node"""
+        current_node = self.story_state.get_current_node()
+        return current_node.description if current_node else "Unknown situation"
+    
+    def _conversation_section(self, dialogue: List[str], user_response: str) -> PromptSection:
+        """Prompt section with the conversation to analyze and the user's response"""
         # Format dialogue
         dialogue_text = "\n".join(dialogue)
-        
+        return PromptSection("conversation", f"""
+# Recent Conversation
+{dialogue_text}
+
+# User's Response
+{user_response}
+""")
+    
+    def _default_sections(self, dialogue: List[str], user_response: str) -> List[PromptSection]:
+        """
+        Build the analysis prompt sections in the default layout, with each
+        character's background next to its current states.
+        """
         # Start building the prompt
-        prompt = f"""
+        sections = [
+            PromptSection("instructions_intro", """
 You are an AI assistant analyzing a conversation in an interactive narrative game.
 
 # Story Context
-{self.story_state.get_story_background()}
+"""),
+            PromptSection("story_background", self.fragments.story_background, priority=2),
+            PromptSection("current_situation", f"""
 
 # Current Situation
-{self.story_state.get_current_node().description if self.story_state.get_current_node() else "Unknown situation"}
+{self._current_situation()}
 
 # Characters
-"""
+"""),
+        ]
         
         # Add information for each character
         for char_id, char_state in self.story_state.character_states.items():
-            char_name = character_backgrounds.get(char_id, {}).get("name", char_id)
-            char_background = character_backgrounds.get(char_id, {}).get("background", "")
+            char_name = self._character_name(char_id)
+            char_background = self._character_background(char_id)
             
-            prompt += f"""
+            sections.append(PromptSection(
+                f"character_background.{char_id}",
+                char_background,
+                priority=2,
+                header=f"""
 ## {char_name}
-{char_background}
+""",
+                footer="""
 
 Current States:
-"""
-            
-            # Add all states for this character
-            for state_name, state_value in char_state.state_values.items():
-                # Get min and max values for this state
-                state_config = char_state.state_dicts.get(state_name)
-                min_val = state_config.min if state_config else 0
-                max_val = state_config.max if state_config else 100
-                
-                prompt += f"- {state_name}: {state_value} ({min_val}-{max_val})\n"
+""" + self._character_states_text(char_state)
+            ))
         
         # Add user state information
+        user_text = ""
         if self.story_state.user_state:
-            user_state = self.story_state.user_state
-            
-            prompt += f"""
+            user_text = """
 # User
 Current States:
-"""
-            
-            # Add all user states
-            for state_name, state_value in user_state.state_values.items():
-                # Get min and max values for this state
-                state_config = user_state.state_dicts.get(state_name)
-                min_val = state_config.min if state_config else 0
-                max_val = state_config.max if state_config else 100
-                
-                # Add special description for player_role if it exists
-                if state_name == "player_role":
-                    # Get character names for the description
-                    char_ids = list(self.story_state.character_states.keys())
-                    if len(char_ids) >= 2:
-                        char1_name = character_backgrounds.get(char_ids[0], {}).get("name", char_ids[0])
-                        char2_name = character_backgrounds.get(char_ids[1], {}).get("name", char_ids[1])
-                        prompt += f"- {state_name}: {state_value} ({min_val}-{max_val}, where {min_val} is allied with {char2_name}, {(min_val + max_val) // 2} is neutral, {max_val} is allied with {char1_name})\n"
-                    else:
-                        prompt += f"- {state_name}: {state_value} ({min_val}-{max_val})\n"
-                else:
-                    prompt += f"- {state_name}: {state_value} ({min_val}-{max_val})\n"
+""" + self._user_states_text()
+        sections.append(PromptSection("user_state", user_text))
         
-        # Add conversation and user response
-        prompt += f"""
-# Recent Conversation
-{dialogue_text}
-
-# User's Response
-{user_response}
-
-Based on the conversation and the user's response, analyze how the states of the characters and user should change.
-For each state, provide a delta value (positive or negative) and reasoning.
-
-Consider:
-"""
+        # Add conversation, user response and instructions
+        sections.append(self._conversation_section(dialogue, user_response))
+        sections.append(PromptSection("instructions", self._analysis_instructions()))
+        return sections
+    
+    def _cache_friendly_sections(self, dialogue: List[str], user_response: str) -> List[PromptSection]:
+        """
+        Build the analysis prompt sections ordered from most static to most
+        dynamic: instructions and backgrounds first, then the current node,
+        the state values and the conversation.
+        """
+        sections = [
+            PromptSection("instructions", """
+You are an AI assistant analyzing a conversation in an interactive narrative game.
+""" + self._analysis_instructions() + """
+# Story Context
+""", static=True),
+            PromptSection("story_background", self.fragments.story_background, priority=2, footer="\n\n# Characters\n", static=True),
+        ]
         
-        # Add considerations based on character states
-        for state_name in self.character_state_names:
-            prompt += f"- How the dialogue affects {state_name} between characters\n"
+        for char_id in self.story_state.character_states:
+            sections.append(PromptSection(
+                f"character_background.{char_id}",
+                self._character_background(char_id),
+                priority=2,
+                header=f"## {self._character_name(char_id)}\n",
+                footer="\n\n",
+                static=True
+            ))
         
-        # Add considerations for user states
-        for state_name in self.user_state_names:
-            if state_name == "player_role":
-                prompt += f"- Whether the user is taking sides or remaining neutral\n"
-            else:
-                prompt += f"- How the user's response affects {state_name}\n"
+        sections.append(PromptSection("current_situation", f"# Current Situation\n{self._current_situation()}\n"))
         
-        prompt += """
-Provide delta values that are reasonable (typically between -15 and +15) and proportional to the significance of the interaction.
-"""
+        states_text = ""
+        for char_id, char_state in self.story_state.character_states.items():
+            char_name = self._character_name(char_id)
+            states_text += f"\n## {char_name} Current States\n" + self._character_states_text(char_state)
+        sections.append(PromptSection("character_states", states_text))
         
-        return prompt
+        if self.story_state.user_state:
+            sections.append(PromptSection("user_state", "\n# User\nCurrent States:\n" + self._user_states_text()))
+        
+        sections.append(self._conversation_section(dialogue, user_response))
+        return sections
+    
+    def build_analysis_prompt(self, dialogue: List[str], user_response: str) -> AssembledPrompt:
+        """
+        Assemble the prompt for the LLM to analyze the conversation within the prompt token budget.
+        
+        Args:
+            dialogue: List of dialogue lines from the conversation
+            user_response: The user's response to the conversation
+            
+        Returns:
+            The AssembledPrompt with its per-section token counts
+        """
+        if self.layout == PROMPT_LAYOUT_CACHE_FRIENDLY:
+            sections = self._cache_friendly_sections(dialogue, user_response)
+        else:
+            sections = self._default_sections(dialogue, user_response)
+        
+        self.last_prompt = self.assembler.assemble(sections)
+        return self.last_prompt
+    
+    def _build_analysis_prompt(self, dialogue: List[str], user_response: str) -> str:
+        """
+        Build a prompt for the LLM to analyze the conversation.
+        
+        Args:
+            dialogue: List of dialogue lines from the conversation
+            user_response: The user's response to the conversation
+            
+        Returns:
+            A formatted prompt string for the LLM
+        """
+        return self.build_analysis_prompt(dialogue, user_response).text
     
     async def analyze_conversation(self, dialogue: List[str], user_response: str) -> Any:
         """
@@ -226,18 +418,188 @@ Provide delta values that are reasonable (typically between -15 and +15) and pro
         Returns:
             ConversationAnalysisOutput containing state changes
         """
+        # Routine turns are predicted locally when the classifier is confident enough
+        analysis = self.predict_locally(dialogue, user_response)
+        if analysis is not None:
+            return analysis
+        
         # Build the prompt
-        prompt = self._build_analysis_prompt(dialogue, user_response)
+        with span("analysis_prompt"):
+            prompt = self.build_analysis_prompt(dialogue, user_response)
         
         # Call the LLM
         try:
-            response = await self.llm.generate_response(prompt, None)
+            with span("analysis_llm"):
+                response = await self.llm.generate_response(prompt.text, None, cache_prefix=prompt.static_prefix)
             analysis = response.data
             logger.info(f"Conversation analysis complete: {analysis.summary}")
-            return analysis
         except Exception as e:
             logger.error(f"Error analyzing conversation: {str(e)}")
             raise
+        
+        await self._log_analysis(dialogue, user_response, analysis)
+        return analysis
+    
+    def predict_locally(self, dialogue: List[str], user_response: str) -> Optional[Any]:
+        """
+        Predict the analysis of a routine turn without an LLM call, if a local classifier is set.
+        
+        Args:
+            dialogue: List of dialogue lines from the conversation
+            user_response: The user's response to the conversation
+            
+        Returns:
+            ConversationAnalysisOutput with the predicted state changes, or None if there
+            is no local classifier or its prediction is not confident enough
+        """
+        if self.local_classifier is None:
+            return None
+        with span("analysis_local"):
+            analysis = self._local_analysis(dialogue, user_response)
+        record_local_analysis("llm" if analysis is None else "local")
+        if analysis is not None:
+            logger.info(f"Conversation analysis complete: {analysis.summary}")
+        return analysis
+    
+    async def _log_analysis(self, dialogue: List[str], user_response: str, analysis: Any) -> None:
+        """Append the state changes of an LLM analysis to the analysis log, if there is one"""
+        if self.analysis_log is not None:
+            changes = analysis_changes(analysis, self.story_state.character_states, self.character_state_names, self.user_state_names)
+            await self.analysis_log.awrite(dialogue, user_response, changes)
+    
+    def _local_targets(self) -> List[Tuple[str, str]]:
+        """The (entity, state name) pairs an analysis covers"""
+        targets = [
+            (char_id, state_name)
+            for char_id in self.story_state.character_states
+            for state_name in self.character_state_names
+        ]
+        if self.story_state.user_state:
+            targets.extend((USER_ENTITY, state_name) for state_name in self.user_state_names)
+        return targets
+    
+    def _local_analysis(self, dialogue: List[str], user_response: str) -> Optional[Any]:
+        """
+        Predict the analysis of a turn with the local classifier.
+        
+        Args:
+            dialogue: List of dialogue lines from the conversation
+            user_response: The user's response to the conversation
+            
+        Returns:
+            ConversationAnalysisOutput with the predicted state changes, or None
+            if the prediction is not confident enough
+        """
+        threshold = self.confidence_threshold if self.confidence_threshold is not None else self.local_classifier.threshold
+        if threshold is None:
+            logger.debug("Local analyzer has no calibrated confidence threshold, using the LLM")
+            return None
+        prediction = self.local_classifier.predict(dialogue, user_response, self._local_targets())
+        if prediction.confidence < threshold:
+            logger.debug(f"Local analysis confidence {prediction.confidence:.2f} below {threshold:.2f}, using the LLM")
+            return None
+        
+        reasoning = f"Predicted by the local analyzer (confidence {prediction.confidence:.2f})"
+        
+        def state_changes(model: Type[BaseModel], entity: str) -> BaseModel:
+            return model(**{
+                state_name: StateChange(value=delta, reasoning=reasoning)
+                for state_name, delta in prediction.changes.get(entity, {}).items()
+                if delta
+            })
+        
+        fields = {"summary": "Routine turn, state changes predicted locally"}
+        for char_id in self.story_state.character_states:
+            fields[f"{char_id}_changes"] = state_changes(self.CharacterStateChanges, char_id)
+        fields["user_changes"] = state_changes(self.UserStateChanges, USER_ENTITY)
+        return self.ConversationAnalysisOutput(**fields)
+    
+    def _get_fused_llm(self, conversation_model: Type[BaseModel]) -> LLMInterface:
+        """
+        Get the LLM interface for fused turns, building the combined output model on first use.
+        
+        The combined model extends the analysis output with the fields of the
+        conversation output model, so a single response carries both.
+        
+        Args:
+            conversation_model: The Pydantic model of a generated conversation
+            
+        Returns:
+            LLMInterface producing the combined output
+        """
+        if self.fused_llm is None:
+            conversation_fields = {
+                name: (field_info.annotation, field_info)
+                for name, field_info in conversation_model.model_fields.items()
+            }
+            self.FusedTurnOutput = create_model(
+                "DynamicFusedTurnOutput",
+                __base__=self.ConversationAnalysisOutput,
+                **conversation_fields
+            )
+            # The fused output includes the next conversation, so it needs the generation models
+            self.fused_llm = LLMInterface(self.FusedTurnOutput, task="generation", lane="analysis")
+        return self.fused_llm
+    
+    def _build_fused_prompt(self, dialogue: List[str], user_response: str, history: Optional[str] = None) -> str:
+        """
+        Build a prompt asking for the state analysis and the next conversation at once.
+        
+        Args:
+            dialogue: List of dialogue lines from the conversation
+            user_response: The user's response to the conversation
+            history: Conversation history before this exchange
+            
+        Returns:
+            A formatted prompt string for the LLM
+        """
+        analysis_prompt = self.build_analysis_prompt(dialogue, user_response)
+        prompt = analysis_prompt.text + f"""
+# Earlier History
+{history}
+
+After analyzing the state changes, continue the story from the user's response.
+The characters' states after applying your state changes should shape the next conversation.
+{CONVERSATION_INSTRUCTIONS}
+Finally, give a brief summary of the current situation in one to two sentences.
+"""
+        return prompt
+    
+    async def analyze_fused_turn(
+        self,
+        dialogue: List[str],
+        user_response: str,
+        conversation_model: Type[BaseModel],
+        history: Optional[str] = None
+    ) -> Any:
+        """
+        Analyze a conversation and generate the next conversation in a single LLM request.
+        
+        Args:
+            dialogue: List of dialogue lines from the conversation
+            user_response: The user's response to the conversation
+            conversation_model: The Pydantic model of a generated conversation
+            history: Conversation history before this exchange
+            
+        Returns:
+            FusedTurnOutput containing the state changes and the next conversation
+        """
+        llm = self._get_fused_llm(conversation_model)
+        with span("fused_prompt"):
+            prompt = self._build_fused_prompt(dialogue, user_response, history)
+        
+        try:
+            with span("fused_llm"):
+                response = await llm.generate_response(prompt, None, cache_prefix=self.last_prompt.static_prefix)
+            output = response.data
+            logger.info(f"Fused turn analysis complete: {output.summary}")
+        except Exception as e:
+            logger.error(f"Error in fused turn: {str(e)}")
+            raise
+        
+        # The fused output extends the analysis output, so its state changes are logged the same way
+        await self._log_analysis(dialogue, user_response, output)
+        return output
     
     def apply_state_changes(self, analysis: Any) -> None:
         """
@@ -286,7 +648,8 @@ Provide delta values that are reasonable (typically between -15 and +15) and pro
 async def analyze_conversation_and_update_states(
     dialogue: List[str], 
     user_response: str, 
-    story_state: StoryState
+    story_state: StoryState,
+    analyzer: Optional[ConversationAnalyzer] = None
 ) -> Dict[str, Any]:
     """
     Analyze a conversation and update character and user states.
@@ -295,26 +658,44 @@ async def analyze_conversation_and_update_states(
         dialogue: List of dialogue lines from the conversation
         user_response: The user's response to the conversation
         story_state: The current story state
+        analyzer: Optional analyzer to reuse. A new one is built if it is None
+            or was built for a different story state or schema
         
     Returns:
         Dictionary containing analysis results and updated states
     """
-    analyzer = ConversationAnalyzer(story_state)
+    if analyzer is None or not analyzer.matches(story_state):
+        analyzer = ConversationAnalyzer(story_state)
     analysis = await analyzer.analyze_conversation(dialogue, user_response)
-    analyzer.apply_state_changes(analysis)
+    with span("state_apply"):
+        analyzer.apply_state_changes(analysis)
+    
+    return build_analysis_result(analysis, story_state)
+
+def build_analysis_result(analysis: Any, story_state: StoryState) -> Dict[str, Any]:
+    """
+    Build the result dictionary of an applied analysis.
     
+    Args:
+        analysis: The analysis output that was applied
+        story_state: The current story state
+        
+    Returns:
+        Dictionary containing analysis results and updated states
+    """
     # Return a dictionary with analysis results and updated states
     result = {
-        "analysis": analysis.dict(),
+        "analysis": analysis.model_dump(),
+        # Snapshots, the state values keep changing on later turns
         "updated_states": {
-            char_id: state.state_values 
+            char_id: dict(state.state_values)
             for char_id, state in story_state.character_states.items()
         }
     }
     
     # Add user state if available
     if story_state.user_state:
-        result["updated_states"]["user"] = story_state.user_state.state_values
+        result["updated_states"]["user"] = dict(story_state.user_state.state_values)
     
     return result
 
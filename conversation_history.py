@@ -0,0 +1,128 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from loguru import logger
+from prompt_assembler import estimate_tokens
+
+
+@dataclass
+class HistoryTurn:
+    """One exchange: the characters' dialogue and the user's response to it"""
+    dialogue: List[str]
+    user_response: str
+    situation_summary: str = ""
+
+    def lines(self) -> List[str]:
+        """History lines of this turn, in the order they were spoken"""
+        return list(self.dialogue) + [f"You: {self.user_response}"]
+
+
+@dataclass
+class ConversationHistory:
+    """
+    Bounded conversation history.
+    Keeps a sliding window of the most recent turns verbatim and a rolling
+    summary of older turns, built from the situation summaries that came
+    with each generated conversation.
+    """
+    max_turns: int = 6
+    max_summaries: int = 10
+    turns: List[HistoryTurn] = field(default_factory=list)
+    summaries: List[str] = field(default_factory=list)
+    total_turns: int = 0
+
+    def add_turn(self, dialogue: List[str], user_response: str, situation_summary: str = "") -> None:
+        """
+        Add a turn, moving the oldest turns into the rolling summary once the window is full.
+
+        Args:
+            dialogue: The dialogue lines the user responded to
+            user_response: The user's response
+            situation_summary: The situation summary generated with the dialogue
+        """
+        self.turns.append(HistoryTurn(list(dialogue), user_response, situation_summary))
+        self.total_turns += 1
+        while len(self.turns) > self.max_turns:
+            self._summarise(self.turns.pop(0))
+
+    def _summarise(self, turn: HistoryTurn) -> None:
+        if turn.situation_summary:
+            self.summaries.append(turn.situation_summary)
+        if len(self.summaries) > self.max_summaries:
+            del self.summaries[:len(self.summaries) - self.max_summaries]
+
+    def lines(self) -> List[str]:
+        """History lines of the turns in the window"""
+        return [line for turn in self.turns for line in turn.lines()]
+
+    def __len__(self) -> int:
+        return self.total_turns
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Contents of the history, without its configured bounds"""
+        return {
+            "turns": [[turn.dialogue, turn.user_response, turn.situation_summary] for turn in self.turns],
+            "summaries": list(self.summaries),
+            "total": self.total_turns,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], max_turns: int = 6, max_summaries: int = 10) -> "ConversationHistory":
+        """
+        Rebuild a history from to_dict output.
+
+        Args:
+            data: The output of to_dict
+            max_turns: Number of recent turns kept verbatim
+            max_summaries: Number of older turn summaries kept
+
+        Returns:
+            The ConversationHistory
+        """
+        history = cls(max_turns=max_turns, max_summaries=max_summaries, summaries=list(data.get("summaries", [])))
+        for dialogue, user_response, situation_summary in data.get("turns", []):
+            history.add_turn(dialogue, user_response, situation_summary)
+        history.total_turns = data.get("total", history.total_turns)
+        return history
+
+    def _render_parts(self, summaries: List[str], turns: List[HistoryTurn]) -> str:
+        parts = []
+        if summaries:
+            parts.append("Earlier: " + " ".join(summaries))
+        parts.extend(line for turn in turns for line in turn.lines())
+        return "\n".join(parts)
+
+    def render(self, max_tokens: Optional[int] = None, count_tokens: Callable[[str], int] = estimate_tokens) -> Optional[str]:
+        """
+        Render the history for a prompt, optionally within a token budget.
+
+        When the full history does not fit, the oldest turns in the window are
+        replaced by their summaries first, then the oldest summaries are dropped.
+
+        Args:
+            max_tokens: Token budget for the rendered history, or None for no limit
+            count_tokens: Function counting the tokens of a text
+
+        Returns:
+            The rendered history, or None if there is no history
+        """
+        if not self.turns and not self.summaries:
+            return None
+
+        summaries = list(self.summaries)
+        turns = list(self.turns)
+        text = self._render_parts(summaries, turns)
+        if max_tokens is None:
+            return text
+
+        while count_tokens(text) > max_tokens and (turns or summaries):
+            if turns:
+                turn = turns.pop(0)
+                if turn.situation_summary:
+                    summaries.append(turn.situation_summary)
+            else:
+                summaries.pop(0)
+            text = self._render_parts(summaries, turns)
+
+        if len(turns) < len(self.turns):
+            logger.debug(f"History trimmed to {len(turns)} recent turns to fit {max_tokens} tokens")
+        return text or None
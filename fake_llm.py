@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import random
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional
+from pydantic_LLM import ANY_MODEL, LLMClientRegistry, get_client_registry
+
+if TYPE_CHECKING:
+    from pydantic_ai.messages import ModelMessage, ModelResponse
+    from pydantic_ai.models.function import AgentInfo, DeltaToolCalls, FunctionModel
+
+# Characters per streamed chunk of the structured output
+STREAM_CHUNK_SIZE = 16
+
+
+@dataclass
+class FakeModelConfig:
+    """Behaviour of the local fake model"""
+    # Seconds every request takes, plus a uniform random jitter of up to `jitter` seconds
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Seed of the generated values; the same seed and prompt give the same output
+    seed: int = 0
+    # Number of dialogue lines of a generated conversation
+    dialogue_lines: int = 4
+    # Range of the integer values, e.g. the state change deltas of an analysis
+    min_int: int = -10
+    max_int: int = 10
+
+
+class SchemaFiller:
+    """Builds a valid value for a JSON schema from a seeded random generator"""
+
+    def __init__(self, config: FakeModelConfig, rng: random.Random, definitions: Dict[str, Any]):
+        self.config = config
+        self.rng = rng
+        self.definitions = definitions
+
+    def fill(self, schema: Dict[str, Any], name: str = "") -> Any:
+        """
+        Build a value for a schema.
+
+        Args:
+            schema: The JSON schema, possibly a $ref into the definitions
+            name: Name of the property the value is for, used to shape strings
+
+        Returns:
+            A JSON value valid for the schema
+        """
+        if "$ref" in schema:
+            return self.fill(self.definitions[schema["$ref"].rsplit("/", 1)[-1]], name)
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                options = [option for option in schema[key] if option.get("type") != "null"]
+                return self.fill(options[0], name) if options else None
+        if "allOf" in schema:
+            return self.fill(schema["allOf"][0], name)
+
+        kind = schema.get("type")
+        if kind == "object":
+            return {key: self.fill(value, key) for key, value in schema.get("properties", {}).items()}
+        if kind == "array":
+            count = max(schema.get("minItems", 0), self.config.dialogue_lines)
+            return [self._item(schema.get("items", {}), name, index) for index in range(count)]
+        if kind == "integer":
+            low = max(schema.get("minimum", self.config.min_int), self.config.min_int)
+            high = min(schema.get("maximum", self.config.max_int), self.config.max_int)
+            return self.rng.randint(low, max(low, high))
+        if kind == "number":
+            return round(self.rng.uniform(self.config.min_int, self.config.max_int), 2)
+        if kind == "boolean":
+            return self.rng.random() < 0.5
+        if kind == "string":
+            return self._sentence(name)
+        return None
+
+    def _item(self, schema: Dict[str, Any], name: str, index: int) -> Any:
+        if schema.get("type") == "string" and name == "dialogue":
+            return f"Speaker{index % 2 + 1}: {self._sentence(name)}"
+        return self.fill(schema, name)
+
+    def _sentence(self, name: str) -> str:
+        return f"Generated {name.replace('_', ' ') or 'text'} #{self.rng.randrange(10_000)}."
+
+
+def _seeded_rng(config: FakeModelConfig, messages: List["ModelMessage"]) -> random.Random:
+    """Random generator seeded by the config seed and the text of the prompt"""
+    digest = hashlib.sha256(str(config.seed).encode("utf-8"))
+    for message in messages:
+        for part in message.parts:
+            content = getattr(part, "content", None)
+            if isinstance(content, str):
+                digest.update(content.encode("utf-8"))
+    return random.Random(digest.digest())
+
+
+def build_fake_model(config: Optional[FakeModelConfig] = None) -> "FunctionModel":
+    """
+    Build a local model that answers every structured output request with a
+    valid, deterministic value after a configurable delay, without any network access.
+
+    Args:
+        config: Latency, seed and value ranges, defaults to FakeModelConfig()
+
+    Returns:
+        A pydantic_ai FunctionModel supporting plain and streamed runs
+    """
+    from pydantic_ai.messages import ModelResponse, ToolCallPart
+    from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+
+    config = config or FakeModelConfig()
+
+    def build_output(messages: List["ModelMessage"], info: "AgentInfo") -> tuple:
+        rng = _seeded_rng(config, messages)
+        tool = info.result_tools[0]
+        schema = tool.parameters_json_schema
+        value = SchemaFiller(config, rng, schema.get("$defs", {})).fill(schema)
+        return tool.name, value, config.latency + rng.uniform(0, config.jitter)
+
+    async def respond(messages: List["ModelMessage"], info: "AgentInfo") -> "ModelResponse":
+        tool_name, value, delay = build_output(messages, info)
+        if delay:
+            await asyncio.sleep(delay)
+        return ModelResponse(parts=[ToolCallPart(tool_name, value)])
+
+    async def stream(messages: List["ModelMessage"], info: "AgentInfo") -> AsyncIterator["DeltaToolCalls"]:
+        tool_name, value, delay = build_output(messages, info)
+        text = json.dumps(value)
+        chunks = range(0, len(text), STREAM_CHUNK_SIZE)
+        for index, start in enumerate(chunks):
+            if delay:
+                await asyncio.sleep(delay / len(chunks))
+            yield {0: DeltaToolCall(name=tool_name if index == 0 else None, json_args=text[start:start + STREAM_CHUNK_SIZE])}
+
+    return FunctionModel(respond, stream_function=stream, model_name="fake")
+
+
+def install_fake_model(
+    config: Optional[FakeModelConfig] = None,
+    model_names: Optional[List[str]] = None,
+    registry: Optional[LLMClientRegistry] = None,
+) -> "FunctionModel":
+    """
+    Serve model names with the fake model, so engines created afterwards never call OpenRouter.
+
+    Args:
+        config: Behaviour of the fake model
+        model_names: Model names to replace, defaults to every model of every route
+        registry: Client registry to install into, defaults to the process-wide registry
+
+    Returns:
+        The installed fake model
+    """
+    model = build_fake_model(config)
+    registry = registry or get_client_registry()
+    for model_name in model_names or [ANY_MODEL]:
+        registry.register_model(model_name, model)
+    return model
@@ -1,12 +1,20 @@
-from pydantic_LLM import LLMInterface
-from hydra import initialize, compose
-from character_state import build_character_state, build_user_state
-from story_state import build_story_state
-from prompt_builder import build_prompt_builder
-from conversation_analyse import analyze_conversation_and_update_states
-from typing import Dict, List, Optional, Any, TypeVar, Generic
+from pydantic_LLM import LLMInterface, ClientPoolConfig, configure_client_registry
+from llm_cache import configure_response_cache
+from llm_scheduler import SchedulerConfig, configure_scheduler
+from model_routing import RoutingConfig, configure_model_routing, get_model_routing
+from story_template import StoryTemplate, load_story_template
+from session_store import SNAPSHOT_VERSION, decode_snapshot, encode_snapshot
+from prompt_builder import build_prompt_builder, PROMPT_LAYOUT_DEFAULT
+from conversation_history import ConversationHistory
+from prompt_assembler import AssembledPrompt, build_prompt_assembler
+from conversation_analyse import ConversationAnalyzer, analyze_conversation_and_update_states, build_analysis_result
+from local_analyzer import get_analysis_log, load_local_classifier
+from metrics import TurnStats, span
+from typing import Dict, List, Optional, Any, TypeVar, Generic, AsyncIterator, NamedTuple, Union
 from pydantic import BaseModel, Field
 from loguru import logger
+import asyncio
+from contextlib import aclosing
 
 
 class ConversationOutput(BaseModel):
@@ -15,60 +23,98 @@ class ConversationOutput(BaseModel):
     situation_summary: str = Field(description="A brief summary of the current situation in one to two sentences")
 
 
+class ConversationChunk(NamedTuple):
+    """A piece of a streamed conversation: a dialogue line or the final situation summary"""
+    kind: str
+    text: str
+
+
 class GameEngine:
     """
     Main game engine that manages the story flow, character states,
     conversation generation, and state updates based on user input.
     """
     
-    def __init__(self, character_ids=None):
+    def __init__(self, character_ids=None, print_output: bool = True, speculative: bool = False, fused_turn: bool = False,
+                 template: Optional[StoryTemplate] = None):
         """
         Initialize the game engine with configuration
         
         Args:
             character_ids: Optional list of character IDs to use. If None, defaults to ["character1", "character2"]
+            print_output: Whether generated dialogue is printed to stdout
+            speculative: Whether to generate the next conversation while the analysis is still running
+            fused_turn: Whether to get the analysis and the next conversation from a single LLM request
+            template: The story to play, defaults to the template of the default Hydra config
         """
         # Default character IDs if not provided
         self.character_ids = character_ids or ["character1", "character2"]
+        self.print_output = print_output
+        self.speculative = speculative
+        self.speculation_stats = {"hits": 0, "misses": 0}
+        self.fused_turn = fused_turn
+        self.fused_stats = {"accepted": 0, "regenerated": 0}
+        # Phase timings, token counts and retries of this session's turns
+        self.stats = TurnStats()
         
-        # Initialize Hydra
-        with initialize(version_base="1.1", config_path="config"):
-            # Compose the configuration
-            self.cfg = compose(config_name="config")
-            
-            # Build character states
-            self.character_states = {}
-            for char_id in self.character_ids:
-                self.character_states[char_id] = build_character_state(self.cfg)
-            
-            # Build user state
-            self.user_state = build_user_state(self.cfg)
-            
-            # Build story state
-            self.story_state = build_story_state(self.cfg)
-            
-            # Set the character and user states for the story
-            for char_id, char_state in self.character_states.items():
-                self.story_state.set_character_state(char_id, char_state)
-            
-            self.story_state.set_user_state(self.user_state)
-            
-            # Initialize LLM interface
-            self.llm = LLMInterface(ConversationOutput)
-            
-            # Build the prompt builder
-            self.prompt_builder = build_prompt_builder(self.story_state)
-            
-            # Initialize conversation history
-            self.conversation_history = []
-            self.current_dialogue = []
+        # The story config is loaded once per process; a session only builds its mutable state
+        self.template = template or load_story_template()
+        self.cfg = self.template.cfg
+        # Snapshots refer to the story config by this hash
+        self.story_hash = self.template.story_hash
+        
+        # Build the story state with fresh character and user states
+        self.story_state = self.template.new_story_state(self.character_ids)
+        self.character_states = dict(self.story_state.character_states)
+        self.user_state = self.story_state.user_state
+        
+        # Apply the shared connection pool, response cache, scheduler and model routing settings and initialize LLM interface
+        llm_cfg = self.cfg.get("llm") or {}
+        configure_client_registry(ClientPoolConfig.from_config(llm_cfg))
+        configure_response_cache(llm_cfg.get("cache"))
+        configure_scheduler(SchedulerConfig.from_config(llm_cfg.get("scheduler")))
+        configure_model_routing(RoutingConfig.from_config(llm_cfg))
+        self.llm = LLMInterface(ConversationOutput, task="generation")
+        
+        # The conversation analyzer is built on first use and reused across turns
+        self.analyzer = None
+        
+        # Optional local analyzer for routine turns, and the log of LLM analyses it is trained on
+        analysis_cfg = self.cfg.get("analysis", {}) or {}
+        local_model = analysis_cfg.get("local_model")
+        log_path = analysis_cfg.get("log_path")
+        self.local_classifier = load_local_classifier(local_model) if local_model else None
+        self.local_confidence = analysis_cfg.get("confidence_threshold")
+        self.analysis_log = get_analysis_log(log_path) if log_path else None
+        
+        # Build the prompt builder, keeping prompts within the token budget of every model of the route
+        history_cfg = self.cfg.get("history", {}) or {}
+        prompt_cfg = self.cfg.get("prompt", {}) or {}
+        self.prompt_layout = prompt_cfg.get("layout", PROMPT_LAYOUT_DEFAULT)
+        self.prompt_assembler = build_prompt_assembler(prompt_cfg, self.llm.route.models)
+        self.analysis_assembler = build_prompt_assembler(prompt_cfg, get_model_routing().route("analysis").models)
+        self.prompt_builder = build_prompt_builder(
+            self.story_state,
+            history_cfg.get("max_tokens"),
+            self.prompt_assembler,
+            self.prompt_layout
+        )
+        
+        # Initialize conversation history
+        self.conversation_history = ConversationHistory(
+            max_turns=history_cfg.get("max_turns", 6),
+            max_summaries=history_cfg.get("max_summaries", 10)
+        )
+        self.current_dialogue = []
+        self.situation_summary = ""
     
-    async def start_story(self, start_node: str = "arrival"):
+    async def start_story(self, start_node: str = "arrival", opening: Optional[ConversationOutput] = None):
         """
         Start the story at the specified node.
         
         Args:
             start_node: The node ID to start the story at
+            opening: A pre-generated opening conversation for the start node, generated if not given
         """
         # Start the story
         success = self.story_state.start_story(start_node)
@@ -77,38 +123,233 @@ class GameEngine:
             return False
         
         # Generate initial conversation
-        await self.generate_conversation()
+        if opening is not None:
+            self._accept_conversation(opening)
+        else:
+            with span("start", self.stats):
+                await self.generate_conversation()
         
         return True
     
-    async def generate_conversation(self):
+    async def stream_start_story(self, start_node: str = "arrival", opening: Optional[ConversationOutput] = None) -> AsyncIterator[ConversationChunk]:
         """
-        Generate a conversation based on the current story state.
+        Start the story at the specified node and stream the initial conversation.
+        
+        Args:
+            start_node: The node ID to start the story at
+            opening: A pre-generated opening conversation for the start node, generated if not given
+            
+        Yields:
+            ConversationChunk items of the initial conversation
         """
-        # Build the prompt
-        prompt = self.prompt_builder.generate_conversation_prompt(
-            history="\n".join(self.conversation_history) if self.conversation_history else None
-        )
+        success = self.story_state.start_story(start_node)
+        if not success:
+            logger.error(f"Failed to start story at node: {start_node}")
+            return
         
-        # Generate the conversation
-        try:
-            result = await self.llm.generate_response(prompt, None)
-            conversation = result.data
+        if opening is None:
+            with span("start", self.stats):
+                async with aclosing(self.stream_conversation()) as chunks:
+                    async for chunk in chunks:
+                        yield chunk
+            return
+        
+        for text in opening.dialogue:
+            yield ConversationChunk("dialogue", text)
+        self._accept_conversation(opening)
+        yield ConversationChunk("situation_summary", opening.situation_summary)
+    
+    async def generate_opening(self, start_node: str = "arrival") -> ConversationOutput:
+        """
+        Generate an opening conversation for a start node without accepting it.
+        
+        The opening prompt only depends on the start node and the default states,
+        so the result can be handed to any new engine of the same story through
+        start_story(opening=...). The response cache is bypassed to get a new
+        variant on every call.
+        
+        Args:
+            start_node: The node ID the opening is for
             
-            # Store the current dialogue
-            self.current_dialogue = conversation.dialogue
+        Returns:
+            The generated opening conversation
             
-            # Print the dialogue
-            for text in conversation.dialogue:
-                print(text)
+        Raises:
+            ValueError: If the start node does not exist
+        """
+        if not self.story_state.start_story(start_node):
+            raise ValueError(f"Unknown start node: {start_node}")
+        prompt = self._build_conversation_prompt()
+        result = await self.llm.generate_response(prompt.text, None, cache_prefix=prompt.static_prefix, use_cache=False, lane="background")
+        return result.data
+    
+    def _get_analyzer(self) -> ConversationAnalyzer:
+        """
+        Get the cached conversation analyzer, rebuilding it only when the
+        set of characters or the state schemas have changed.
+        
+        Returns:
+            A ConversationAnalyzer for the current story state
+        """
+        if self.analyzer is None or not self.analyzer.matches(self.story_state):
+            logger.info("Building conversation analyzer")
+            self.analyzer = ConversationAnalyzer(
+                self.story_state,
+                self.analysis_assembler,
+                self.prompt_layout,
+                self.local_classifier,
+                self.local_confidence,
+                self.analysis_log
+            )
+        return self.analyzer
+    
+    def _build_conversation_prompt(self) -> AssembledPrompt:
+        """
+        Build the conversation prompt for the current story state and history.
+        
+        Returns:
+            The assembled conversation prompt
+        """
+        with span("generation_prompt"):
+            return self.prompt_builder.build_conversation_prompt(history=self.conversation_history)
+    
+    def _accept_conversation(self, conversation: ConversationOutput, printed: bool = False) -> ConversationOutput:
+        """
+        Store a generated conversation as the current dialogue and print it.
+        
+        Args:
+            conversation: The generated conversation
+            printed: Whether the dialogue lines were already printed while streaming
+            
+        Returns:
+            The accepted conversation
+        """
+        # Store the current dialogue
+        self.current_dialogue = conversation.dialogue
+        self.situation_summary = conversation.situation_summary
+        
+        # Print the dialogue
+        if self.print_output:
+            if not printed:
+                for text in conversation.dialogue:
+                    print(text)
             
             print("\n" + conversation.situation_summary + "\n")
+        
+        return conversation
+    
+    async def _request_conversation(self, prompt: AssembledPrompt) -> ConversationOutput:
+        """
+        Request a conversation from the LLM without changing the engine state.
+        
+        Args:
+            prompt: The assembled conversation prompt
             
-            return conversation
+        Returns:
+            The generated conversation
+        """
+        try:
+            with span("generation_llm"):
+                result = await self.llm.generate_response(prompt.text, None, cache_prefix=prompt.static_prefix)
+            return result.data
         except Exception as e:
             logger.error(f"Error generating conversation: {str(e)}")
             raise
     
+    async def generate_conversation(self):
+        """
+        Generate a conversation based on the current story state.
+        """
+        # Build the prompt
+        prompt = self._build_conversation_prompt()
+        
+        # Generate the conversation
+        conversation = await self._request_conversation(prompt)
+        return self._accept_conversation(conversation)
+    
+    async def stream_conversation(self) -> AsyncIterator[ConversationChunk]:
+        """
+        Generate a conversation based on the current story state, yielding each
+        dialogue line as soon as it is complete and the situation summary last.
+        
+        Yields:
+            ConversationChunk items of kind "dialogue", then one of kind "situation_summary"
+        """
+        prompt = self._build_conversation_prompt()
+        
+        emitted = 0
+        partial = {}
+        try:
+            with span("generation_llm"):
+                async with aclosing(self.llm.stream_response(prompt.text, None, cache_prefix=prompt.static_prefix)) as partials:
+                    async for partial in partials:
+                        # Partial parsing drops an unfinished trailing string, so every line is complete
+                        lines = partial.get("dialogue") or []
+                        while emitted < len(lines):
+                            text = lines[emitted]
+                            emitted += 1
+                            if self.print_output:
+                                print(text)
+                            yield ConversationChunk("dialogue", text)
+            
+            conversation = ConversationOutput.model_validate(partial)
+        except Exception as e:
+            logger.error(f"Error streaming conversation: {str(e)}")
+            raise
+        
+        for text in conversation.dialogue[emitted:]:
+            if self.print_output:
+                print(text)
+            yield ConversationChunk("dialogue", text)
+        
+        self._accept_conversation(conversation, printed=True)
+        yield ConversationChunk("situation_summary", conversation.situation_summary)
+    
+    def _record_user_response(self, user_response: str) -> None:
+        """
+        Add the current dialogue and the user's response to the conversation history.
+        
+        Args:
+            user_response: The user's response to the conversation
+        """
+        self.conversation_history.add_turn(self.current_dialogue, user_response, self.situation_summary)
+    
+    async def _analyze_and_advance(self, user_response: str) -> Dict[str, Any]:
+        """
+        Analyze the conversation, update states and advance the story if a
+        transition applies.
+        
+        Args:
+            user_response: The user's response to the conversation
+            
+        Returns:
+            Dictionary containing analysis results and updated states
+        """
+        # Analyze the conversation and update states
+        analysis_result = await analyze_conversation_and_update_states(
+            self.current_dialogue, 
+            user_response, 
+            self.story_state,
+            analyzer=self._get_analyzer()
+        )
+        
+        logger.info(f"Conversation analysis: {analysis_result['analysis']['summary']}")
+        
+        self._advance_story()
+        
+        return analysis_result
+    
+    def _advance_story(self) -> None:
+        """Advance the story if the updated states satisfy a transition"""
+        # Check if story should advance based on updated states
+        current_node = self.story_state.get_current_node()
+        if current_node and current_node.next_state:
+            # Try to advance the story
+            with span("advance_story"):
+                next_node = self.story_state.advance_story()
+            if next_node and next_node != current_node:
+                logger.info(f"Advanced to new story node: {next_node.name}")
+    
     async def process_user_input(self, user_response: str):
         """
         Process user input, analyze the conversation, and update states.
@@ -120,27 +361,28 @@ class GameEngine:
             logger.warning("No current dialogue to analyze")
             return
         
+        with span("turn", self.stats) as turn:
+            result = await self._process_turn(user_response)
+        logger.debug(f"Turn took {turn.seconds * 1000:.0f} ms")
+        return result
+    
+    async def _process_turn(self, user_response: str) -> Dict[str, Any]:
+        """Run one turn in the configured mode, see process_user_input"""
+        if self.fused_turn:
+            try:
+                return await self._fused_turn(user_response)
+            except Exception as e:
+                logger.error(f"Error processing user input: {str(e)}")
+                raise
+        
         # Add user response to conversation history
-        self.conversation_history.extend(self.current_dialogue)
-        self.conversation_history.append(f"You: {user_response}")
+        self._record_user_response(user_response)
         
-        # Analyze the conversation and update states
         try:
-            analysis_result = await analyze_conversation_and_update_states(
-                self.current_dialogue, 
-                user_response, 
-                self.story_state
-            )
-            
-            logger.info(f"Conversation analysis: {analysis_result['analysis']['summary']}")
+            if self.speculative:
+                return await self._speculative_turn(user_response)
             
-            # Check if story should advance based on updated states
-            current_node = self.story_state.get_current_node()
-            if current_node and current_node.next_state:
-                # Try to advance the story
-                next_node = self.story_state.advance_story()
-                if next_node and next_node != current_node:
-                    logger.info(f"Advanced to new story node: {next_node.name}")
+            analysis_result = await self._analyze_and_advance(user_response)
             
             # Generate new conversation based on updated states
             await self.generate_conversation()
@@ -150,6 +392,160 @@ class GameEngine:
             logger.error(f"Error processing user input: {str(e)}")
             raise
     
+    async def _fused_turn(self, user_response: str) -> Dict[str, Any]:
+        """
+        Get the state analysis and the next conversation from a single LLM request.
+        
+        The state changes are applied and the story advanced as usual. The
+        conversation from the same response was written for the current node,
+        so it is only accepted when the story stays on that node; otherwise it
+        is regenerated for the new node. When the local analyzer is confident
+        about the state changes, only the conversation is requested.
+        
+        Args:
+            user_response: The user's response to the conversation
+            
+        Returns:
+            Dictionary containing analysis results and updated states
+        """
+        analyzer = self._get_analyzer()
+        history = self.prompt_builder.render_history(self.conversation_history)
+        dialogue = self.current_dialogue
+        
+        self._record_user_response(user_response)
+        
+        # A routine turn predicted locally only needs the next conversation
+        analysis = analyzer.predict_locally(dialogue, user_response)
+        if analysis is not None:
+            with span("state_apply"):
+                analyzer.apply_state_changes(analysis)
+            analysis_result = build_analysis_result(analysis, self.story_state)
+            self._advance_story()
+            await self.generate_conversation()
+            return analysis_result
+        
+        output = await analyzer.analyze_fused_turn(dialogue, user_response, ConversationOutput, history)
+        with span("state_apply"):
+            analyzer.apply_state_changes(output)
+        analysis_result = build_analysis_result(output, self.story_state)
+        logger.info(f"Conversation analysis: {output.summary}")
+        
+        node_before = self.story_state.current_node_id
+        self._advance_story()
+        
+        if self.story_state.current_node_id == node_before:
+            self.fused_stats["accepted"] += 1
+            self._accept_conversation(ConversationOutput(
+                dialogue=output.dialogue,
+                situation_summary=output.situation_summary
+            ))
+        else:
+            self.fused_stats["regenerated"] += 1
+            logger.info("Story node changed, regenerating the fused turn conversation")
+            await self.generate_conversation()
+        
+        return analysis_result
+    
+    async def _speculative_turn(self, user_response: str) -> Dict[str, Any]:
+        """
+        Run the analysis and the next conversation generation in parallel.
+        
+        The conversation is generated speculatively from the states before the
+        analysis. Once the analysis is applied and the story has advanced, the
+        prompt is rebuilt: if it is unchanged (same node and same state rule
+        descriptions) the speculative conversation is kept, otherwise it is
+        cancelled and the conversation is regenerated from the new states.
+        
+        Args:
+            user_response: The user's response to the conversation
+            
+        Returns:
+            Dictionary containing analysis results and updated states
+        """
+        speculative_prompt = self._build_conversation_prompt()
+        speculation = asyncio.create_task(self._request_conversation(speculative_prompt))
+        
+        try:
+            analysis_result = await self._analyze_and_advance(user_response)
+        except BaseException:
+            _discard_task(speculation)
+            raise
+        
+        prompt = self._build_conversation_prompt()
+        conversation = None
+        if prompt.text == speculative_prompt.text:
+            try:
+                conversation = await speculation
+                self.speculation_stats["hits"] += 1
+                logger.info("Speculative conversation accepted")
+            except Exception as e:
+                logger.warning(f"Speculative conversation failed, regenerating: {str(e)}")
+        else:
+            _discard_task(speculation)
+            logger.info("States changed the prompt, discarding speculative conversation")
+        
+        if conversation is None:
+            self.speculation_stats["misses"] += 1
+            conversation = await self._request_conversation(prompt)
+        
+        self._accept_conversation(conversation)
+        return analysis_result
+    
+    async def stream_user_input(self, user_response: str) -> AsyncIterator[ConversationChunk]:
+        """
+        Process user input like process_user_input, but stream the next
+        conversation line by line.
+        
+        Speculative and fused turns get the next conversation in a single
+        response, before or alongside the analysis, so in those modes the turn
+        runs as in process_user_input and its lines are emitted once it is done.
+        
+        Args:
+            user_response: The user's response to the conversation
+            
+        Yields:
+            ConversationChunk items of the next conversation
+        """
+        if not self.current_dialogue:
+            logger.warning("No current dialogue to analyze")
+            return
+        
+        if self.speculative or self.fused_turn:
+            with span("turn", self.stats):
+                await self._process_turn(user_response)
+            for text in self.current_dialogue:
+                yield ConversationChunk("dialogue", text)
+            yield ConversationChunk("situation_summary", self.situation_summary)
+            return
+        
+        self._record_user_response(user_response)
+        
+        with span("turn", self.stats):
+            try:
+                await self._analyze_and_advance(user_response)
+            except Exception as e:
+                logger.error(f"Error processing user input: {str(e)}")
+                raise
+            
+            async with aclosing(self.stream_conversation()) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get the latency, token and retry statistics of this session.
+        
+        Returns:
+            Dictionary with per-phase durations (count, mean, p50, p99, max),
+            token counts, retries and the speculative or fused turn outcomes
+        """
+        stats = self.stats.to_dict()
+        if self.speculative:
+            stats["speculation"] = dict(self.speculation_stats)
+        if self.fused_turn:
+            stats["fused"] = dict(self.fused_stats)
+        return stats
+    
     def get_character_states(self):
         """
         Get the current character states.
@@ -159,16 +555,95 @@ class GameEngine:
         """
         # Dynamically get all character states
         states = {
-            char_id: char_state.state_values 
+            char_id: dict(char_state.state_values)
             for char_id, char_state in self.story_state.character_states.items()
         }
         
         # Add user state
         if self.story_state.user_state:
-            states["user"] = self.story_state.user_state.state_values
+            states["user"] = dict(self.story_state.user_state.state_values)
         
         return states
     
+    def snapshot(self, compress: bool = True) -> bytes:
+        """
+        Serialize the state of the game that changes while playing.
+        
+        The story itself is not included; the snapshot records the hash of its
+        config and can only be restored by an engine built from the same config.
+        
+        Args:
+            compress: Whether to zlib compress the snapshot
+            
+        Returns:
+            The encoded snapshot
+        """
+        snapshot = {
+            "v": SNAPSHOT_VERSION,
+            "story": self.story_hash,
+            "chars": list(self.character_ids),
+            # State values in schema order
+            "states": {
+                char_id: list(char_state.state_values.values())
+                for char_id, char_state in self.story_state.character_states.items()
+            },
+            "user": list(self.user_state.state_values.values()) if self.user_state else None,
+            "node": self.story_state.current_node_id,
+            "path": self.story_state.node_history,
+            "history": self.conversation_history.to_dict(),
+            "dialogue": self.current_dialogue,
+            "summary": self.situation_summary,
+        }
+        return encode_snapshot(snapshot, compress)
+    
+    def restore(self, data: Union[bytes, Dict[str, Any]]) -> None:
+        """
+        Restore the game from a snapshot.
+        
+        Args:
+            data: A snapshot from snapshot(), encoded or already decoded
+            
+        Raises:
+            ValueError: If the snapshot is for another story config or other characters,
+                does not match the state schemas or is at an unknown node
+        """
+        snapshot = decode_snapshot(data)
+        if snapshot["story"] != self.story_hash:
+            raise ValueError(f"Snapshot is for story {snapshot['story']}, not {self.story_hash}")
+        if snapshot["chars"] != list(self.character_ids):
+            raise ValueError(f"Snapshot is for characters {snapshot['chars']}, not {self.character_ids}")
+        # Check everything before changing any state, so a rejected snapshot leaves the game as it was
+        for char_id, values in snapshot["states"].items():
+            char_state = self.story_state.character_states.get(char_id)
+            if char_state is None:
+                raise ValueError(f"Snapshot has states of unknown character {char_id}")
+            if len(values) != len(char_state.schema.names):
+                raise ValueError(f"Snapshot has {len(values)} states for {char_id}, not {len(char_state.schema.names)}")
+        if self.user_state and snapshot["user"] is not None and len(snapshot["user"]) != len(self.user_state.schema.names):
+            raise ValueError(f"Snapshot has {len(snapshot['user'])} user states, not {len(self.user_state.schema.names)}")
+        for node_id in (snapshot["node"], *snapshot["path"]):
+            if node_id not in self.story_state.story_nodes:
+                raise ValueError(f"Snapshot is at unknown story node {node_id}")
+        
+        for char_id, values in snapshot["states"].items():
+            char_state = self.story_state.character_states[char_id]
+            for state_name, value in zip(char_state.schema.names, values):
+                char_state.state_values[state_name] = value
+        if self.user_state and snapshot["user"] is not None:
+            for state_name, value in zip(self.user_state.schema.names, snapshot["user"]):
+                self.user_state.state_values[state_name] = value
+        
+        self.story_state.current_node_id = snapshot["node"]
+        self.story_state.node_history = list(snapshot["path"])
+        self.conversation_history = ConversationHistory.from_dict(
+            snapshot["history"],
+            max_turns=self.conversation_history.max_turns,
+            max_summaries=self.conversation_history.max_summaries
+        )
+        self.current_dialogue = list(snapshot["dialogue"])
+        self.situation_summary = snapshot["summary"]
+        logger.info(f"Restored game at node {self.story_state.current_node_id}")
+    
     def get_current_node(self):
         """
         Get the current story node.
@@ -177,19 +652,47 @@ class GameEngine:
             The current story node
         """
         return self.story_state.get_current_node()
+    
+    def is_finished(self) -> bool:
+        """
+        Check whether the story has reached an end node.
+        
+        Returns:
+            True if the current node has no outgoing transitions
+        """
+        current_node = self.get_current_node()
+        return bool(current_node and not current_node.next_state)
+
+
+def _discard_task(task: asyncio.Task) -> None:
+    """Cancel a task whose result is no longer needed, consuming any exception it raised"""
+    if task.done():
+        if not task.cancelled():
+            task.exception()
+    else:
+        task.cancel()
 
 
-async def run_interactive():
-    """Run the game in interactive mode"""
+async def run_interactive(stream: bool = True):
+    """
+    Run the game in interactive mode
+    
+    Args:
+        stream: Whether to print each dialogue line as soon as it is generated
+    """
     engine = GameEngine()
     
     # Start the story
-    await engine.start_story()
+    if stream:
+        async for _ in engine.stream_start_story():
+            pass
+    else:
+        await engine.start_story()
     
     # Main game loop
     while True:
-        # Get user input
-        user_input = input("\nYour response: ")
+        # Get user input without blocking the event loop
+        user_input = await asyncio.to_thread(input, "\nYour response: ")
         
         # Check for exit command
         if user_input.lower() in ["exit", "quit", "q"]:
@@ -197,7 +700,11 @@ async def run_interactive():
             break
         
         # Process user input
-        await engine.process_user_input(user_input)
+        if stream:
+            async for _ in engine.stream_user_input(user_input):
+                pass
+        else:
+            await engine.process_user_input(user_input)
         
         # Print current states (for debugging)
         states = engine.get_character_states()
@@ -208,13 +715,11 @@ async def run_interactive():
         print(f"User: {states.get('user', {})}")
         
         # Check if we've reached an end node
-        current_node = engine.get_current_node()
-        if current_node and not current_node.next_state:
+        if engine.is_finished():
             print("\nYou've reached the end of the story.")
             break
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(run_interactive())
     
\ No newline at end of file
@@ -0,0 +1,619 @@
+import asyncio
+import json
+import time
+import uuid
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+from loguru import logger
+from game_engine import GameEngine
+from local_analyzer import close_analysis_logs
+from opening_pool import OpeningPool
+from metrics import ACTIVE_SESSIONS, GLOBAL_STATS, render_metrics
+from session_store import SessionStore, build_session_store, decode_snapshot
+from story_template import load_story_template
+
+
+class HTTPError(Exception):
+    """Error that is reported to the client with an HTTP status code"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+HTTP_REASONS = {
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+@dataclass
+class GameSession:
+    """A single player's game, identified by a session ID"""
+    session_id: str
+    engine: GameEngine
+    created_at: float = field(default_factory=time.monotonic)
+    last_active: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def touch(self) -> None:
+        """Mark the session as active now"""
+        self.last_active = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Public view of the session returned to clients"""
+        engine = self.engine
+        current_node = engine.get_current_node()
+        return {
+            "session_id": self.session_id,
+            "node_id": engine.story_state.current_node_id,
+            "node_name": current_node.name if current_node else None,
+            "dialogue": engine.current_dialogue,
+            "situation_summary": engine.situation_summary,
+            "states": engine.get_character_states(),
+            "finished": engine.is_finished(),
+        }
+
+
+class SessionManager:
+    """
+    Creates, looks up and expires GameEngine sessions by ID.
+    Turns of the same session are serialized, while different sessions
+    run concurrently on the same event loop.
+    With a store, idle sessions are evicted to it instead of being dropped,
+    and restored on their next request, by this or any other process.
+    """
+
+    def __init__(
+        self,
+        engine_factory: Optional[Callable[..., GameEngine]] = None,
+        session_ttl: float = 1800.0,
+        max_sessions: int = 10000,
+        cleanup_interval: float = 60.0,
+        store: Optional[SessionStore] = None,
+        opening_pool: Optional[OpeningPool] = None,
+    ):
+        """
+        Initialize the session manager.
+
+        Args:
+            engine_factory: Callable creating a GameEngine, receives character_ids
+            session_ttl: Seconds of inactivity after which a session expires
+            max_sessions: Maximum number of live sessions
+            cleanup_interval: Seconds between expiry sweeps
+            store: Optional store keeping snapshots of evicted sessions
+            opening_pool: Optional pool of pre-generated openings for new sessions
+        """
+        self.engine_factory = engine_factory or (lambda character_ids=None: GameEngine(character_ids, print_output=False))
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.cleanup_interval = cleanup_interval
+        self.store = store
+        self.opening_pool = opening_pool
+        self.sessions: Dict[str, GameSession] = {}
+        # Snapshots of evicted sessions still being written to the store
+        self._saves: Dict[str, asyncio.Future] = {}
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    async def create_session(self, start_node: str = "arrival", character_ids: Optional[List[str]] = None) -> GameSession:
+        """
+        Create a new session and generate its opening conversation.
+
+        Args:
+            start_node: The node ID to start the story at
+            character_ids: Optional list of character IDs for the engine
+
+        Returns:
+            The new GameSession
+        """
+        if len(self.sessions) >= self.max_sessions:
+            await self.expire_idle()
+            if len(self.sessions) >= self.max_sessions:
+                raise HTTPError(503, "Too many active sessions")
+
+        session = GameSession(session_id=uuid.uuid4().hex, engine=self.engine_factory(character_ids=character_ids))
+        self.sessions[session.session_id] = session
+
+        # Pooled openings are generated for the default characters only
+        opening = None
+        if self.opening_pool is not None and character_ids is None:
+            opening = self.opening_pool.take(start_node, session.engine.story_hash)
+
+        async with session.lock:
+            try:
+                started = await session.engine.start_story(start_node, opening=opening)
+            except Exception:
+                self.sessions.pop(session.session_id, None)
+                raise
+        if not started:
+            self.sessions.pop(session.session_id, None)
+            raise HTTPError(400, f"Cannot start story at node: {start_node}")
+
+        session.touch()
+        logger.info(f"Created session {session.session_id} ({len(self.sessions)} active)")
+        return session
+
+    async def get_session(self, session_id: str) -> Optional[GameSession]:
+        """
+        Look up a session, restoring it from the store if it was evicted.
+
+        Args:
+            session_id: The session ID
+
+        Returns:
+            The GameSession, or None if it does not exist or has expired
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            return await self._restore_session(session_id)
+        if self._is_expired(session) and not session.lock.locked():
+            await self.evict_session(session_id)
+            return await self._restore_session(session_id)
+        return session
+
+    async def _wait_for_save(self, session_id: str) -> None:
+        """Wait until the snapshot of a session being evicted is in the store"""
+        save = self._saves.get(session_id)
+        if save is not None:
+            try:
+                await asyncio.shield(save)
+            except Exception:
+                pass
+
+    async def _restore_session(self, session_id: str) -> Optional[GameSession]:
+        if self.store is None:
+            return None
+        await self._wait_for_save(session_id)
+        data = await asyncio.to_thread(self.store.load, session_id)
+        # Another request may have restored the session while the store was read
+        session = self.sessions.get(session_id)
+        if session is not None:
+            return session
+        if data is None:
+            return None
+        if len(self.sessions) >= self.max_sessions:
+            await self.expire_idle()
+            if len(self.sessions) >= self.max_sessions:
+                raise HTTPError(503, "Too many active sessions")
+        try:
+            snapshot = decode_snapshot(data)
+            engine = self.engine_factory(character_ids=snapshot["chars"])
+            engine.restore(snapshot)
+        except (ValueError, KeyError) as e:
+            logger.error(f"Cannot restore session {session_id}: {str(e)}")
+            return None
+        session = GameSession(session_id=session_id, engine=engine)
+        self.sessions[session_id] = session
+        logger.info(f"Restored session {session_id} ({len(self.sessions)} active)")
+        return session
+
+    async def evict_session(self, session_id: str) -> bool:
+        """
+        Remove a session from memory, keeping its snapshot in the store if there is one.
+
+        Args:
+            session_id: The session ID
+
+        Returns:
+            True if the session was live
+        """
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        if self.store is not None:
+            save = asyncio.ensure_future(asyncio.to_thread(self.store.save, session_id, session.engine.snapshot()))
+            self._saves[session_id] = save
+
+            def saved(_: asyncio.Future) -> None:
+                if self._saves.get(session_id) is save:
+                    del self._saves[session_id]
+
+            # The save outlives a cancelled caller, and restores wait for it until it is done
+            save.add_done_callback(saved)
+            await asyncio.shield(save)
+        return True
+
+    async def process_input(self, session_id: str, user_response: str) -> Dict[str, Any]:
+        """
+        Run one turn of a session with the user's response.
+
+        Args:
+            session_id: The session ID
+            user_response: The user's response to the current conversation
+
+        Returns:
+            The session view right after this turn
+        """
+        session = await self.get_session(session_id)
+        if session is None:
+            raise HTTPError(404, f"Session {session_id} not found")
+
+        async with session.lock:
+            session.touch()
+            if session.engine.is_finished():
+                raise HTTPError(409, "The story has already ended")
+            await session.engine.process_user_input(user_response)
+            session.touch()
+            return session.to_dict()
+
+    async def stream_input(self, session_id: str, user_response: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run one turn of a session, streaming the next conversation line by line.
+
+        Args:
+            session_id: The session ID
+            user_response: The user's response to the current conversation
+
+        Yields:
+            One event per dialogue line, the situation summary, then the session view
+        """
+        session = await self.get_session(session_id)
+        if session is None:
+            raise HTTPError(404, f"Session {session_id} not found")
+
+        async with session.lock:
+            session.touch()
+            if session.engine.is_finished():
+                raise HTTPError(409, "The story has already ended")
+            async with aclosing(session.engine.stream_user_input(user_response)) as chunks:
+                async for chunk in chunks:
+                    yield {"kind": chunk.kind, "text": chunk.text}
+            session.touch()
+            yield {"kind": "session", "session": session.to_dict()}
+
+    async def remove_session(self, session_id: str) -> bool:
+        """
+        Remove a session, including its stored snapshot.
+
+        Args:
+            session_id: The session ID
+
+        Returns:
+            True if the session existed
+        """
+        existed = self.sessions.pop(session_id, None) is not None
+        if self.store is not None:
+            # A snapshot still being saved would bring the session back after the delete
+            await self._wait_for_save(session_id)
+            existed = await asyncio.to_thread(self.store.delete, session_id) or existed
+        return existed
+
+    def _is_expired(self, session: GameSession, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return now - session.last_active > self.session_ttl
+
+    async def expire_idle(self) -> int:
+        """
+        Remove every session that has been idle longer than the TTL from memory,
+        evicting it to the store if there is one.
+
+        Returns:
+            The number of expired sessions
+        """
+        now = time.monotonic()
+        expired = [
+            session_id for session_id, session in self.sessions.items()
+            if self._is_expired(session, now) and not session.lock.locked()
+        ]
+        await asyncio.gather(*(self.evict_session(session_id) for session_id in expired))
+        if expired:
+            logger.info(f"Expired {len(expired)} idle sessions ({len(self.sessions)} active)")
+        return len(expired)
+
+    async def _cleanup_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            await self.expire_idle()
+
+    def start(self) -> None:
+        """Start the background expiry sweep and the filling of the opening pool"""
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+        if self.opening_pool is not None:
+            self.opening_pool.start()
+
+    async def stop(self) -> None:
+        """Stop the background tasks, saving every live session to the store"""
+        if self.opening_pool is not None:
+            await self.opening_pool.stop()
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+            self._cleanup_task = None
+        if self.store is not None:
+            await asyncio.gather(*(self.evict_session(session_id) for session_id in list(self.sessions)))
+            logger.info("Saved all sessions to the store")
+
+
+class GameServer:
+    """
+    Minimal asyncio HTTP/1.1 JSON server exposing a SessionManager.
+
+    Routes:
+        POST   /sessions                 create a session, body {"start_node", "character_ids"}
+        GET    /sessions/{id}            current dialogue and states of a session
+        POST   /sessions/{id}/input      play one turn, body {"text"}
+        POST   /sessions/{id}/stream     play one turn, streamed as NDJSON events
+        DELETE /sessions/{id}            end a session
+        GET    /sessions/{id}/stats      latency, token and retry statistics of a session
+        GET    /stats                    latency, token and retry statistics of all sessions
+        GET    /metrics                  Prometheus metrics in the text exposition format
+        GET    /health                   liveness and active session count
+    """
+
+    max_body_size = 64 * 1024
+
+    def __init__(self, manager: SessionManager, host: str = "127.0.0.1", port: int = 8080):
+        """
+        Initialize the server.
+
+        Args:
+            manager: The session manager serving requests
+            host: Interface to listen on
+            port: Port to listen on
+        """
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    async def start(self) -> None:
+        """Start listening and the session expiry sweep"""
+        self.manager.start()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Game server listening on http://{self.host}:{self.port}")
+
+    async def serve_forever(self) -> None:
+        """Start the server and serve until cancelled"""
+        await self.start()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            await self.manager.stop()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Malformed Content-Length header")
+        if length < 0:
+            raise HTTPError(400, "Malformed Content-Length header")
+        if length > self.max_body_size:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), urlsplit(target).path, headers, body
+
+    @staticmethod
+    def _parse_json(body: bytes) -> Dict[str, Any]:
+        if not body:
+            return {}
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            raise HTTPError(400, "Request body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return payload
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        parts = [part for part in path.split("/") if part]
+
+        if parts == ["health"] and method == "GET":
+            return 200, {"status": "ok", "sessions": len(self.manager.sessions)}
+
+        if parts == ["metrics"] and method == "GET":
+            ACTIVE_SESSIONS.set(len(self.manager.sessions))
+            return 200, render_metrics()
+
+        if parts == ["stats"] and method == "GET":
+            stats = GLOBAL_STATS.to_dict()
+            stats["sessions"] = len(self.manager.sessions)
+            if self.manager.opening_pool is not None:
+                stats["opening_pool"] = self.manager.opening_pool.stats()
+            return 200, stats
+
+        if parts == ["sessions"]:
+            if method != "POST":
+                raise HTTPError(405, "Method not allowed")
+            payload = self._parse_json(body)
+            session = await self.manager.create_session(
+                start_node=payload.get("start_node", "arrival"),
+                character_ids=payload.get("character_ids"),
+            )
+            return 201, session.to_dict()
+
+        if len(parts) == 2 and parts[0] == "sessions":
+            session_id = parts[1]
+            if method == "GET":
+                session = await self.manager.get_session(session_id)
+                if session is None:
+                    raise HTTPError(404, f"Session {session_id} not found")
+                return 200, session.to_dict()
+            if method == "DELETE":
+                if not await self.manager.remove_session(session_id):
+                    raise HTTPError(404, f"Session {session_id} not found")
+                return 204, None
+            raise HTTPError(405, "Method not allowed")
+
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "stats":
+            if method != "GET":
+                raise HTTPError(405, "Method not allowed")
+            session = await self.manager.get_session(parts[1])
+            if session is None:
+                raise HTTPError(404, f"Session {parts[1]} not found")
+            return 200, session.engine.get_stats()
+
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] in ("input", "stream"):
+            if method != "POST":
+                raise HTTPError(405, "Method not allowed")
+            text = self._parse_json(body).get("text")
+            if not isinstance(text, str) or not text.strip():
+                raise HTTPError(400, "Field 'text' is required")
+            if parts[2] == "stream":
+                return 200, self.manager.stream_input(parts[1], text)
+            return 200, await self.manager.process_input(parts[1], text)
+
+        raise HTTPError(404, f"No route for {method} {path}")
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, status: int, payload: Union[Dict[str, Any], str, None], keep_alive: bool) -> None:
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = (json.dumps(payload).encode("utf-8"), "application/json") if payload is not None else (b"", None)
+        head = [
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Unknown')}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if content_type is not None:
+            head.append(f"Content-Type: {content_type}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _write_stream(writer: asyncio.StreamWriter, events: AsyncIterator[Dict[str, Any]]) -> None:
+        """Write events as newline-delimited JSON using chunked transfer encoding"""
+        # Closing the generator releases the session lock even if the client disconnects mid-stream
+        async with aclosing(events):
+            try:
+                first = await events.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except HTTPError as e:
+                await GameServer._write_response(writer, e.status, {"error": e.message}, keep_alive=False)
+                return
+            except Exception as e:
+                logger.exception(f"Error handling request: {str(e)}")
+                await GameServer._write_response(writer, 500, {"error": "Internal server error"}, keep_alive=False)
+                return
+
+            head = [
+                "HTTP/1.1 200 OK",
+                "Content-Type: application/x-ndjson",
+                "Transfer-Encoding: chunked",
+                "Connection: close",
+            ]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+
+            async def write_event(event: Dict[str, Any]) -> None:
+                data = (json.dumps(event) + "\n").encode("utf-8")
+                writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+                await writer.drain()
+
+            try:
+                if first is not None:
+                    await write_event(first)
+                    async for event in events:
+                        await write_event(event)
+            except Exception as e:
+                logger.exception(f"Error streaming response: {str(e)}")
+                await write_event({"kind": "error", "error": "Internal server error"})
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, payload = await self._dispatch(method, path, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    logger.exception(f"Error handling request: {str(e)}")
+                    status, payload = 500, {"error": "Internal server error"}
+
+                if payload is not None and not isinstance(payload, (dict, str)):
+                    await self._write_stream(writer, payload)
+                    break
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def run_server(host: str = "127.0.0.1", port: int = 8080, session_ttl: float = 1800.0, max_sessions: int = 10000,
+                     store: Optional[SessionStore] = None, opening_pool_size: int = 0,
+                     opening_nodes: Tuple[str, ...] = ("arrival",)):
+    """Run the game server until interrupted"""
+    template = load_story_template()
+
+    def engine_factory(character_ids: Optional[List[str]] = None) -> GameEngine:
+        return GameEngine(character_ids, print_output=False, template=template)
+
+    # The pool generates its openings with the engine of the sessions it serves
+    opening_pool = None
+    if opening_pool_size > 0:
+        opening_pool = OpeningPool(engine_factory=engine_factory, start_nodes=opening_nodes, size=opening_pool_size)
+    manager = SessionManager(engine_factory, session_ttl=session_ttl, max_sessions=max_sessions, store=store,
+                             opening_pool=opening_pool)
+    server = GameServer(manager, host=host, port=port)
+    try:
+        await server.serve_forever()
+    finally:
+        close_analysis_logs()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve many game sessions over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--session-ttl", type=float, default=1800.0, help="Idle seconds before a session expires")
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--store", choices=["file", "sqlite"], help="Keep idle sessions in a local store")
+    parser.add_argument("--store-path", help="Directory of the file store or database of the SQLite store")
+    parser.add_argument("--opening-pool", type=int, default=0, help="Pre-generated openings kept ready per start node")
+    parser.add_argument("--opening-nodes", nargs="+", default=["arrival"], help="Start nodes to pre-generate openings for")
+    args = parser.parse_args()
+
+    store = build_session_store(args.store, args.store_path)
+    try:
+        asyncio.run(run_server(args.host, args.port, args.session_ttl, args.max_sessions, store,
+                               args.opening_pool, tuple(args.opening_nodes)))
+    finally:
+        if store is not None:
+            store.close()
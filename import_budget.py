@@ -0,0 +1,114 @@
+import json
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+# Heavy dependencies that must only be imported on first use
+LAZY_DEPENDENCIES = ("hydra", "omegaconf", "pydantic_ai", "openai", "httpx", "logfire", "dotenv")
+
+# Import time budget of every module in milliseconds, measured in a fresh interpreter
+IMPORT_BUDGETS_MS: Dict[str, float] = {
+    "metrics": 100,
+    "llm_scheduler": 150,
+    "model_routing": 150,
+    "session_store": 150,
+    "local_analyzer": 150,
+    "story_state": 200,
+    "story_analyser": 200,
+    "story_template": 300,
+    "story_simulator": 400,
+    "conversation_analyse": 400,
+    "game_engine": 400,
+    "opening_pool": 400,
+    "fake_llm": 300,
+    "game_server": 400,
+}
+
+# Allowed extra imports per module, for modules that need a heavy dependency anyway
+ALLOWED_DEPENDENCIES: Dict[str, Tuple[str, ...]] = {}
+
+_MEASURE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"ms": elapsed * 1000, "modules": sorted(sys.modules)}}))
+"""
+
+
+@dataclass
+class ImportMeasurement:
+    """Import time of a module and the heavy dependencies it loaded"""
+    module: str
+    ms: float
+    budget_ms: float
+    eager_dependencies: List[str]
+
+    @property
+    def ok(self) -> bool:
+        """Whether the module is within its budget and loads no heavy dependency"""
+        return self.ms <= self.budget_ms and not self.eager_dependencies
+
+
+def measure_import(module: str, budget_ms: float, repeat: int = 3) -> ImportMeasurement:
+    """
+    Measure the import time of a module in fresh interpreters.
+
+    Args:
+        module: Name of the module to import
+        budget_ms: Import time budget in milliseconds
+        repeat: Number of fresh interpreters to measure in, the fastest one counts
+
+    Returns:
+        The ImportMeasurement of the module
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    loaded: List[str] = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _MEASURE.format(module=module)],
+            cwd=directory, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["ms"])
+        loaded = result["modules"]
+    allowed = ALLOWED_DEPENDENCIES.get(module, ())
+    eager = [
+        dependency for dependency in LAZY_DEPENDENCIES
+        if dependency in loaded and dependency not in allowed
+    ]
+    return ImportMeasurement(module, min(timings), budget_ms, eager)
+
+
+def check_import_budgets(budgets: Dict[str, float] = IMPORT_BUDGETS_MS, repeat: int = 3) -> List[ImportMeasurement]:
+    """
+    Measure every module of the budget table.
+
+    Args:
+        budgets: Import time budget by module name
+        repeat: Number of fresh interpreters to measure each module in
+
+    Returns:
+        The ImportMeasurement of every module
+    """
+    return [measure_import(module, budget_ms, repeat) for module, budget_ms in budgets.items()]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check the import time of the game modules")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module, the fastest counts")
+    args = parser.parse_args()
+
+    measurements = check_import_budgets(repeat=args.repeat)
+    for measurement in measurements:
+        status = "ok" if measurement.ok else "FAIL"
+        line = f"{status:4} {measurement.module:22} {measurement.ms:7.1f} ms (budget {measurement.budget_ms:.0f} ms)"
+        if measurement.eager_dependencies:
+            line += f", imports {', '.join(measurement.eager_dependencies)}"
+        print(line)
+    sys.exit(0 if all(measurement.ok for measurement in measurements) else 1)
@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Generic, Optional, Tuple, Type, TypeVar
+from pydantic import BaseModel
+from loguru import logger
+
+T = TypeVar('T', bound=BaseModel)
+
+_TRAILING_WHITESPACE = re.compile(r"[ \t]+\n")
+
+# Output schema hashes by result type
+_schema_hashes: Dict[type, str] = {}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalise line endings and surrounding whitespace, which do not change the meaning of a prompt"""
+    prompt = prompt.replace("\r\n", "\n")
+    return _TRAILING_WHITESPACE.sub("\n", prompt).strip()
+
+
+def schema_hash(result_type: Type[BaseModel]) -> str:
+    """Hash of the JSON schema of an output model, computed once per model"""
+    digest = _schema_hashes.get(result_type)
+    if digest is None:
+        schema = json.dumps(result_type.model_json_schema(), sort_keys=True)
+        digest = hashlib.sha256(schema.encode("utf-8")).hexdigest()
+        _schema_hashes[result_type] = digest
+    return digest
+
+
+def cache_key(model_name: str, result_type: Type[BaseModel], prompt: str) -> str:
+    """
+    Build the cache key of an LLM call.
+
+    Args:
+        model_name: The model the prompt is sent to
+        result_type: The structured output model
+        prompt: The full formatted prompt
+
+    Returns:
+        A hex digest identifying the call
+    """
+    payload = json.dumps([model_name, schema_hash(result_type), normalize_prompt(prompt)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CachedResult(Generic[T]):
+    """A cached structured output, exposing `data` like a pydantic_ai run result"""
+    data: T
+
+
+class ResponseCache(ABC):
+    """Storage of structured LLM outputs by cache key, with an optional time to live"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of cached responses, the least recently used are evicted first
+            ttl: Default seconds a response stays valid, or None to keep it until evicted
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl is not None else None
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached output, or None if it is missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        """Cache an output, optionally with its own time to live"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove every cached output"""
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached output from async code; backends doing blocking I/O run it off the event loop"""
+        return self.get(key)
+
+    async def aset(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        """Cache an output from async code; backends doing blocking I/O run it off the event loop"""
+        self.set(key, value, ttl)
+
+    def close(self) -> None:
+        """Release the resources of the cache"""
+
+
+class InMemoryLRUCache(ResponseCache):
+    """Cache kept in process memory, evicting the least recently used responses"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        super().__init__(max_entries, ttl)
+        self._entries: "OrderedDict[str, Tuple[Optional[float], Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        self._entries[key] = (self._expires_at(ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """
+    Cache kept in a SQLite database, shared by processes and kept across restarts.
+    Async reads and writes run in worker threads so disk I/O never stalls the event loop.
+    """
+
+    # Evict once every this many writes
+    evict_every = 64
+
+    def __init__(self, path: str = "llm_cache.db", max_entries: int = 100_000, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            path: Path of the SQLite database, created if missing
+            max_entries: Maximum number of cached responses, the least recently used are evicted first
+            ttl: Default seconds a response stays valid, or None to keep it until evicted
+        """
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self._writes = 0
+        # The connection is shared by the worker threads, one statement sequence at a time
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                return None
+            with self._connection:
+                self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), self._expires_at(ttl), time.time())
+                )
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def evict(self) -> int:
+        """
+        Remove expired responses, then the least recently used ones over max_entries.
+
+        Returns:
+            The number of removed responses
+        """
+        with self._lock, self._connection:
+            removed = self._connection.execute(
+                "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            ).rowcount
+            removed += self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            ).rowcount
+        if removed:
+            logger.debug(f"Evicted {removed} cached LLM responses")
+        return removed
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def build_response_cache(cache_cfg: Optional[Dict[str, Any]]) -> Optional[ResponseCache]:
+    """
+    Build a response cache from the `llm.cache` section of the Hydra config.
+
+    Args:
+        cache_cfg: The cache config with `backend` ("memory", "sqlite" or null),
+            `path`, `max_entries` and `ttl`
+
+    Returns:
+        The ResponseCache, or None if caching is disabled
+    """
+    cache_cfg = cache_cfg or {}
+    backend = cache_cfg.get("backend")
+    if not backend:
+        return None
+    ttl = cache_cfg.get("ttl")
+    if backend == "memory":
+        return InMemoryLRUCache(max_entries=cache_cfg.get("max_entries") or 1024, ttl=ttl)
+    if backend == "sqlite":
+        return SQLiteResponseCache(
+            path=cache_cfg.get("path") or "llm_cache.db",
+            max_entries=cache_cfg.get("max_entries") or 100_000,
+            ttl=ttl
+        )
+    raise ValueError(f"Unknown response cache backend: {backend}")
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_cfg: Optional[Dict[str, Any]] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Get the process-wide response cache, or None if caching is disabled"""
+    return _response_cache
+
+
+def configure_response_cache(cache_cfg: Optional[Dict[str, Any]]) -> Optional[ResponseCache]:
+    """
+    Set up the process-wide response cache, once per distinct config.
+
+    Args:
+        cache_cfg: The `llm.cache` section of the Hydra config
+
+    Returns:
+        The process-wide ResponseCache, or None if caching is disabled
+    """
+    global _response_cache, _response_cache_cfg
+    cache_cfg = dict(cache_cfg or {})
+    if cache_cfg == _response_cache_cfg:
+        return _response_cache
+    # The previous cache is not closed: LLM interfaces built earlier still use it,
+    # and it is released once the last of them is garbage collected
+    _response_cache = build_response_cache(cache_cfg)
+    _response_cache_cfg = cache_cfg
+    if _response_cache is not None:
+        logger.info(f"Caching LLM responses in {type(_response_cache).__name__}")
+    return _response_cache
@@ -0,0 +1,514 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple, TypeVar
+from loguru import logger
+from metrics import REGISTRY, record_llm_retry
+
+if TYPE_CHECKING:
+    import httpx
+
+T = TypeVar('T')
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 425, 429, 500, 502, 503, 504, 520, 522, 524})
+
+# Exception class names of transient network errors in httpx and the OpenAI SDK
+RETRYABLE_ERROR_NAMES = frozenset({"TransportError", "TimeoutException", "APIConnectionError", "APITimeoutError"})
+
+# Priority of every lane, lower goes first
+DEFAULT_LANES = {"analysis": 0, "generation": 1, "background": 2}
+
+QUEUE_SECONDS = REGISTRY.histogram("game_llm_queue_seconds", "Time LLM calls wait for a concurrency slot and a rate limit token")
+DEADLINES_EXCEEDED = REGISTRY.counter("game_llm_deadlines_exceeded_total", "LLM calls abandoned at their deadline")
+RATE_LIMIT_THROTTLES = REGISTRY.counter("game_llm_rate_limit_throttles_total", "Successful responses whose rate limit headers slowed a model down")
+
+# Scheduler and model of the request holding the current slot, read by the HTTP response hook
+_current_slot: contextvars.ContextVar[Optional[Tuple["LLMScheduler", str]]] = contextvars.ContextVar("current_llm_slot", default=None)
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """An LLM call, including its queueing and retries, did not finish before its deadline"""
+
+
+@dataclass
+class SchedulerConfig:
+    """Concurrency, rate limit and retry settings shared by every LLM call in the process"""
+    max_concurrency: int = 64
+    max_concurrency_per_model: int = 16
+    # Requests per second sent to each model, None for no limit, with bursts of up to `burst` requests
+    requests_per_second: Optional[float] = None
+    burst: int = 10
+    max_retries: int = 4
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    # Seconds a call may take in total, including queueing and retries, None for no deadline
+    deadline: Optional[float] = 120.0
+    lanes: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_LANES))
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict[str, Any]]) -> "SchedulerConfig":
+        """Build scheduler settings from the `llm.scheduler` section of the Hydra config"""
+        if not cfg:
+            return cls()
+        defaults = cls()
+        return cls(
+            max_concurrency=cfg.get("max_concurrency", defaults.max_concurrency),
+            max_concurrency_per_model=cfg.get("max_concurrency_per_model", defaults.max_concurrency_per_model),
+            requests_per_second=cfg.get("requests_per_second", defaults.requests_per_second),
+            burst=cfg.get("burst", defaults.burst),
+            max_retries=cfg.get("max_retries", defaults.max_retries),
+            backoff_base=cfg.get("backoff_base", defaults.backoff_base),
+            backoff_max=cfg.get("backoff_max", defaults.backoff_max),
+            deadline=cfg.get("deadline", defaults.deadline),
+            lanes=dict(cfg.get("lanes") or defaults.lanes),
+        )
+
+
+class PrioritySemaphore:
+    """Semaphore whose waiters are woken by priority, then in arrival order"""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        """Number of callers waiting for a permit"""
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int = 0) -> None:
+        """Wait for a permit"""
+        if self._value > 0 and not self.waiting:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The permit may have been handed over just before the cancellation
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """Return a permit, handing it to the first waiter if any"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+
+class TokenBucket:
+    """Rate limiter allowing `rate` requests per second in bursts of up to `capacity`, which can be paused"""
+
+    def __init__(self, rate: Optional[float], capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # Rate imposed by the provider's remaining quota until its window resets
+        self.limited_rate: Optional[float] = None
+        self.limited_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for a while, e.g. until a provider rate limit resets"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        # Tokens refill from the end of the pause, not during it
+        self.updated = self.paused_until
+
+    def limit(self, remaining: int, seconds: float) -> None:
+        """
+        Spread the requests the provider still allows over the time until its window resets.
+
+        Args:
+            remaining: Requests left in the provider's current window
+            seconds: Seconds until the window resets
+        """
+        if remaining <= 0:
+            self.pause(seconds)
+            return
+        now = time.monotonic()
+        self.tokens = min(self.tokens, float(remaining))
+        self.updated = max(now, self.paused_until)
+        self.limited_rate = remaining / max(seconds, 1e-3)
+        self.limited_until = now + seconds
+
+    def _rate(self, now: float) -> Optional[float]:
+        if self.limited_rate is None or now >= self.limited_until:
+            return self.rate
+        return self.limited_rate if self.rate is None else min(self.rate, self.limited_rate)
+
+    async def acquire(self) -> None:
+        """Wait for a token"""
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            rate = self._rate(now)
+            if rate is None:
+                return
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / rate)
+
+
+def _error_chain(error: BaseException) -> List[BaseException]:
+    """The error and the errors it was raised from, e.g. the OpenAI error behind a pydantic_ai ModelHTTPError"""
+    chain = []
+    while error is not None and error not in chain:
+        chain.append(error)
+        error = error.__cause__ or error.__context__
+    return chain
+
+
+def classify_error(error: BaseException) -> Optional[str]:
+    """
+    Decide whether a failed LLM call is worth retrying.
+
+    Args:
+        error: The exception raised by the call
+
+    Returns:
+        The retry reason ("rate_limit", "status_<code>", "timeout" or "network"), or None if it is not retryable
+    """
+    for cause in _error_chain(error):
+        status = getattr(cause, "status_code", None)
+        if isinstance(status, int):
+            if status == 429:
+                return "rate_limit"
+            return f"status_{status}" if status in RETRYABLE_STATUS_CODES else None
+        if isinstance(cause, (TimeoutError, asyncio.TimeoutError)):
+            return "timeout"
+        if isinstance(cause, ConnectionError) or any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(cause).__mro__):
+            return "network"
+    return None
+
+
+def _reset_seconds(value: str) -> Optional[float]:
+    """Seconds until an X-RateLimit-Reset time: epoch seconds or milliseconds, or a number of seconds"""
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    # OpenRouter sends the reset time in epoch milliseconds
+    if reset > 1e11:
+        reset /= 1000
+    return max(reset - time.time(), 0.0) if reset > 1e9 else reset
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    Seconds the provider asked to wait before the next request, from the
+    Retry-After or X-RateLimit-Reset headers of the failed response.
+
+    Args:
+        error: The exception raised by the call
+
+    Returns:
+        Seconds to wait, or None if the response carried no such header
+    """
+    for cause in _error_chain(error):
+        headers = getattr(getattr(cause, "response", None), "headers", None)
+        if not headers:
+            continue
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(float(value), 0.0)
+            except ValueError:
+                try:
+                    return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+                except (TypeError, ValueError):
+                    pass
+        value = headers.get("x-ratelimit-reset")
+        if value:
+            reset = _reset_seconds(value)
+            if reset is not None:
+                return reset
+    return None
+
+
+def rate_limit_quota(headers: Mapping[str, str]) -> Optional[Tuple[int, float]]:
+    """
+    Remaining requests and seconds until the window resets, from the
+    X-RateLimit-Remaining and X-RateLimit-Reset headers of a response.
+
+    Args:
+        headers: The response headers, with lowercase lookup
+
+    Returns:
+        (remaining, seconds), or None if the response carried no usable quota
+    """
+    remaining, reset = headers.get("x-ratelimit-remaining"), headers.get("x-ratelimit-reset")
+    if not remaining or not reset:
+        return None
+    try:
+        remaining = int(float(remaining))
+    except ValueError:
+        return None
+    seconds = _reset_seconds(reset)
+    return (remaining, seconds) if seconds is not None else None
+
+
+class CallAttempts:
+    """Attempt count and deadline of one scheduled call"""
+
+    def __init__(self, scheduler: "LLMScheduler", model_name: str, deadline: Optional[float]):
+        self.scheduler = scheduler
+        self.model_name = model_name
+        self.attempt = 0
+        self.deadline_at = time.monotonic() + deadline if deadline is not None else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without a deadline"""
+        if self.deadline_at is None:
+            return None
+        return self.deadline_at - time.monotonic()
+
+    def check_deadline(self) -> Optional[float]:
+        """The remaining seconds, raising LLMDeadlineExceeded once there are none left"""
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            DEADLINES_EXCEEDED.inc(model=self.model_name)
+            raise LLMDeadlineExceeded(f"LLM call to {self.model_name} exceeded its deadline")
+        return remaining
+
+    async def backoff(self, error: BaseException) -> bool:
+        """
+        Wait before the next attempt of a failed call.
+
+        Args:
+            error: The exception raised by the failed attempt
+
+        Returns:
+            True if the call should be retried, False if the error should be raised
+        """
+        config = self.scheduler.config
+        reason = classify_error(error)
+        if reason is None or self.attempt >= config.max_retries:
+            return False
+
+        # Full jitter: a random delay up to the exponential backoff
+        delay = random.uniform(0, min(config.backoff_max, config.backoff_base * 2 ** self.attempt))
+        wait = retry_after(error)
+        if wait is not None:
+            # The provider limit applies to every caller of this model, not just this one
+            self.scheduler.bucket(self.model_name).pause(wait)
+            delay = max(delay, wait)
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            return False
+
+        self.attempt += 1
+        record_llm_retry(self.model_name, reason)
+        logger.warning(f"LLM call to {self.model_name} failed ({reason}), retry {self.attempt} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        return True
+
+
+class LLMScheduler:
+    """
+    Admits LLM calls under a global and a per-model concurrency cap and a
+    per-model rate limit, serving the analysis lane before generation and
+    background work. Failed calls are retried with jittered exponential
+    backoff, pausing the model's rate limiter when the provider asks to, until
+    the retries or the call's deadline run out.
+    """
+
+    def __init__(self, config: Optional[SchedulerConfig] = None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            config: Scheduler settings, defaults to SchedulerConfig()
+        """
+        self.config = config or SchedulerConfig()
+        self._global = PrioritySemaphore(self.config.max_concurrency)
+        self._models: Dict[str, PrioritySemaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def bucket(self, model_name: str) -> TokenBucket:
+        """Rate limiter of a model"""
+        bucket = self._buckets.get(model_name)
+        if bucket is None:
+            bucket = self._buckets[model_name] = TokenBucket(self.config.requests_per_second, self.config.burst)
+        return bucket
+
+    def observe_quota(self, model_name: str, headers: Mapping[str, str]) -> None:
+        """
+        Slow a model down before the provider starts rejecting requests, from the
+        rate limit headers of a successful response. Once the remaining requests fall
+        to the burst size, they are spread evenly until the window resets.
+
+        Args:
+            model_name: The model that answered
+            headers: The response headers
+        """
+        quota = rate_limit_quota(headers)
+        if quota is None:
+            return
+        remaining, seconds = quota
+        if remaining > self.config.burst or seconds <= 0:
+            return
+        self.bucket(model_name).limit(remaining, seconds)
+        RATE_LIMIT_THROTTLES.inc(model=model_name)
+        logger.debug(f"{model_name} has {remaining} requests left for {seconds:.1f}s, throttling")
+
+    def _model_semaphore(self, model_name: str) -> PrioritySemaphore:
+        semaphore = self._models.get(model_name)
+        if semaphore is None:
+            semaphore = self._models[model_name] = PrioritySemaphore(self.config.max_concurrency_per_model)
+        return semaphore
+
+    def priority(self, lane: str) -> int:
+        """Priority of a lane, unknown lanes go last"""
+        return self.config.lanes.get(lane, max(self.config.lanes.values(), default=0) + 1)
+
+    def attempts(self, model_name: str, deadline: Optional[float] = None) -> CallAttempts:
+        """
+        Start tracking the attempts of a call.
+
+        Args:
+            model_name: The model the call is sent to
+            deadline: Seconds the call may take in total, defaults to the configured deadline
+
+        Returns:
+            The CallAttempts of the call
+        """
+        return CallAttempts(self, model_name, self.config.deadline if deadline is None else deadline)
+
+    async def _admit(self, model_name: str, priority: int) -> None:
+        model_semaphore = self._model_semaphore(model_name)
+        await model_semaphore.acquire(priority)
+        try:
+            await self._global.acquire(priority)
+            try:
+                await self.bucket(model_name).acquire()
+            except BaseException:
+                self._global.release()
+                raise
+        except BaseException:
+            model_semaphore.release()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, model_name: str, lane: str = "generation", attempts: Optional[CallAttempts] = None) -> AsyncIterator[None]:
+        """
+        Hold a concurrency slot for one request to a model.
+
+        Args:
+            model_name: The model the request is sent to
+            lane: The priority lane of the request
+            attempts: The call's attempts, whose deadline bounds the wait
+
+        Raises:
+            LLMDeadlineExceeded: If the deadline passes while waiting
+        """
+        started = time.monotonic()
+        remaining = attempts.check_deadline() if attempts is not None else None
+        try:
+            await asyncio.wait_for(self._admit(model_name, self.priority(lane)), remaining)
+        except asyncio.TimeoutError:
+            DEADLINES_EXCEEDED.inc(model=model_name)
+            raise LLMDeadlineExceeded(f"LLM call to {model_name} waited past its deadline")
+        QUEUE_SECONDS.observe(time.monotonic() - started, lane=lane)
+        token = _current_slot.set((self, model_name))
+        try:
+            yield
+        finally:
+            try:
+                _current_slot.reset(token)
+            except ValueError:
+                # Exited from another context, e.g. a stream closed by a different task
+                _current_slot.set(None)
+            self._global.release()
+            self._model_semaphore(model_name).release()
+
+    async def run(self, model_name: str, call: Callable[[], Awaitable[T]], lane: str = "generation",
+                  deadline: Optional[float] = None) -> T:
+        """
+        Run an LLM call under the scheduler, retrying transient failures.
+
+        Args:
+            model_name: The model the call is sent to
+            call: Callable making one attempt of the call
+            lane: The priority lane of the call
+            deadline: Seconds the call may take in total, defaults to the configured deadline
+
+        Returns:
+            The result of the first successful attempt
+
+        Raises:
+            LLMDeadlineExceeded: If the deadline passes before an attempt succeeds
+        """
+        attempts = self.attempts(model_name, deadline)
+        while True:
+            try:
+                async with self.slot(model_name, lane, attempts):
+                    remaining = attempts.check_deadline()
+                    try:
+                        return await asyncio.wait_for(call(), remaining)
+                    except asyncio.TimeoutError:
+                        if attempts.remaining() is not None and attempts.remaining() <= 0:
+                            DEADLINES_EXCEEDED.inc(model=model_name)
+                            raise LLMDeadlineExceeded(f"LLM call to {model_name} exceeded its deadline")
+                        raise
+            except LLMDeadlineExceeded:
+                raise
+            except Exception as e:
+                if not await attempts.backoff(e):
+                    raise
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+async def observe_response(response: "httpx.Response") -> None:
+    """HTTP client response hook feeding the rate limit headers of successful LLM responses to the scheduler"""
+    slot = _current_slot.get()
+    if slot is not None and response.is_success:
+        scheduler, model_name = slot
+        scheduler.observe_quota(model_name, response.headers)
+
+
+def get_scheduler() -> LLMScheduler:
+    """Get the process-wide LLM scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
+
+
+def configure_scheduler(config: SchedulerConfig) -> LLMScheduler:
+    """
+    Apply scheduler settings to the process-wide scheduler, replacing it if they changed.
+    Calls already admitted by the previous scheduler finish under its limits.
+
+    Args:
+        config: The scheduler settings to apply
+
+    Returns:
+        The process-wide LLMScheduler
+    """
+    global _scheduler
+    if _scheduler is None or _scheduler.config != config:
+        _scheduler = LLMScheduler(config)
+        logger.info(f"LLM scheduler: {config.max_concurrency} concurrent calls, {config.max_concurrency_per_model} per model")
+    return _scheduler
@@ -0,0 +1,491 @@
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import statistics
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from loguru import logger
+
+# Version of the analysis log records and of the saved classifier
+ANALYSIS_LOG_VERSION = 1
+CLASSIFIER_VERSION = 1
+
+# Entity of the user state changes in logs and predictions
+USER_ENTITY = "user"
+
+_WORD_PATTERN = re.compile(r"[a-z']+")
+
+# A target is the state of one entity, e.g. ("character1", "tension")
+Target = Tuple[str, str]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of a text"""
+    return _WORD_PATTERN.findall(text.lower())
+
+
+def extract_features(dialogue: Sequence[str], user_response: str) -> Counter:
+    """
+    Bag of words of a turn. Words of the user response and of the dialogue
+    are kept apart, since the response drives most state changes.
+
+    Args:
+        dialogue: Dialogue lines the user responded to
+        user_response: The user's response
+
+    Returns:
+        Feature counts
+    """
+    features = Counter(f"u:{word}" for word in tokenize(user_response))
+    for line in dialogue:
+        # Drop the "Speaker:" prefix, which is the same on every turn
+        _, _, utterance = line.partition(":")
+        features.update(f"d:{word}" for word in tokenize(utterance or line))
+    return features
+
+
+def delta_bin(delta: int) -> int:
+    """Class of a state delta: its sign times 0 (none), 1 (1-2), 2 (3-7) or 3 (8 and more)"""
+    size = abs(delta)
+    level = 0 if size == 0 else 1 if size <= 2 else 2 if size <= 7 else 3
+    return level if delta >= 0 else -level
+
+
+def analysis_changes(analysis: Any, character_ids: Iterable[str], character_state_names: Sequence[str],
+                     user_state_names: Sequence[str]) -> Dict[str, Dict[str, int]]:
+    """
+    The state deltas of an analysis output, with zero for states it left unchanged.
+
+    Args:
+        analysis: A ConversationAnalysisOutput
+        character_ids: IDs of the analysed characters
+        character_state_names: Analysed character state names
+        user_state_names: Analysed user state names
+
+    Returns:
+        Deltas by entity and state name
+    """
+    changes = {}
+    entities = [(char_id, f"{char_id}_changes", character_state_names) for char_id in character_ids]
+    entities.append((USER_ENTITY, "user_changes", user_state_names))
+    for entity, field_name, state_names in entities:
+        entity_changes = getattr(analysis, field_name, None)
+        if entity_changes is None or not state_names:
+            continue
+        changes[entity] = {}
+        for state_name in state_names:
+            change = getattr(entity_changes, state_name, None)
+            changes[entity][state_name] = change.value if change is not None else 0
+    return changes
+
+
+class AnalysisLog:
+    """
+    Append-only JSONL log of LLM analyses, the training data of the local classifier.
+    Usable as a context manager closing the file on exit.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the log.
+
+        Args:
+            path: Path of the JSONL file, created if missing
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        # Writes come from worker threads, see awrite
+        self._lock = threading.Lock()
+
+    def write(self, dialogue: Sequence[str], user_response: str, changes: Dict[str, Dict[str, int]]) -> None:
+        """Append the analysis of a turn"""
+        record = {"v": ANALYSIS_LOG_VERSION, "dialogue": list(dialogue), "user_response": user_response, "changes": changes}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file.closed:
+                logger.warning(f"Analysis log {self.path} is closed, dropping a record")
+                return
+            self._file.write(line)
+            self._file.flush()
+
+    async def awrite(self, dialogue: Sequence[str], user_response: str, changes: Dict[str, Dict[str, int]]) -> None:
+        """Append the analysis of a turn from a worker thread, keeping the file I/O off the event loop"""
+        await asyncio.to_thread(self.write, dialogue, user_response, changes)
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> "AnalysisLog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_analysis_log(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read the records of an analysis log, skipping malformed lines.
+
+    Args:
+        path: Path of the JSONL file
+
+    Yields:
+        Records with "dialogue", "user_response" and "changes"
+    """
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed line {number} of {path}")
+                continue
+            if record.get("v") == ANALYSIS_LOG_VERSION:
+                yield record
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes over bag-of-words features with Laplace smoothing"""
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.class_counts: Counter = Counter()
+        self.feature_counts: Dict[Any, Counter] = defaultdict(Counter)
+        self.feature_totals: Counter = Counter()
+        self.vocabulary: set = set()
+
+    def fit(self, samples: Iterable[Tuple[Counter, Any]]) -> "NaiveBayesClassifier":
+        """Count the features of labelled samples"""
+        for features, label in samples:
+            self.class_counts[label] += 1
+            self.feature_counts[label].update(features)
+            self.feature_totals[label] += sum(features.values())
+            self.vocabulary.update(features)
+        return self
+
+    def predict_proba(self, features: Counter) -> Dict[Any, float]:
+        """
+        Posterior probability of every class.
+
+        Args:
+            features: Feature counts of the sample
+
+        Returns:
+            Probability by class
+        """
+        total = sum(self.class_counts.values())
+        vocabulary_size = len(self.vocabulary) or 1
+        scores = {}
+        for label, count in self.class_counts.items():
+            denominator = self.feature_totals[label] + self.alpha * vocabulary_size
+            counts = self.feature_counts[label]
+            score = math.log(count / total)
+            for feature, occurrences in features.items():
+                if feature in self.vocabulary:
+                    score += occurrences * math.log((counts[feature] + self.alpha) / denominator)
+            scores[label] = score
+        if not scores:
+            return {}
+        best = max(scores.values())
+        exps = {label: math.exp(score - best) for label, score in scores.items()}
+        norm = sum(exps.values())
+        return {label: value / norm for label, value in exps.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "alpha": self.alpha,
+            "classes": {str(label): count for label, count in self.class_counts.items()},
+            "features": {str(label): dict(counts) for label, counts in self.feature_counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "NaiveBayesClassifier":
+        classifier = cls(data["alpha"])
+        for label, count in data["classes"].items():
+            classifier.class_counts[int(label)] = count
+        for label, counts in data["features"].items():
+            classifier.feature_counts[int(label)] = Counter(counts)
+            classifier.feature_totals[int(label)] = sum(counts.values())
+            classifier.vocabulary.update(counts)
+        return classifier
+
+
+@dataclass
+class LocalPrediction:
+    """State deltas predicted for a turn, with the probability of the least certain one"""
+    changes: Dict[str, Dict[str, int]]
+    confidence: float
+
+
+class LocalStateClassifier:
+    """
+    Predicts the state deltas of a turn without an LLM call. Each entity state
+    gets its own naive Bayes classifier over delta classes (see delta_bin); the
+    predicted delta is the median delta logged for the predicted class.
+
+    Naive Bayes posteriors are overconfident, so the confidence of a prediction
+    is only compared with a threshold calibrated on held-out turns (see
+    calibrate_threshold), not read as the probability of being right.
+    """
+
+    def __init__(self, classifiers: Dict[Target, NaiveBayesClassifier], values: Dict[Target, Dict[int, int]],
+                 threshold: Optional[float] = None):
+        self.classifiers = classifiers
+        self.values = values
+        # Calibrated confidence threshold to skip the LLM, None if not calibrated
+        self.threshold = threshold
+
+    @classmethod
+    def train(cls, records: Iterable[Dict[str, Any]], min_examples: int = 50, alpha: float = 1.0) -> "LocalStateClassifier":
+        """
+        Train on analysis log records.
+
+        Args:
+            records: Records of an analysis log
+            min_examples: Examples a state needs to get a classifier
+            alpha: Laplace smoothing of the classifiers
+
+        Returns:
+            The trained LocalStateClassifier
+        """
+        samples: Dict[Target, List[Tuple[Counter, int]]] = defaultdict(list)
+        deltas: Dict[Target, Dict[int, List[int]]] = defaultdict(lambda: defaultdict(list))
+        for record in records:
+            features = extract_features(record["dialogue"], record["user_response"])
+            for entity, entity_changes in record["changes"].items():
+                for state_name, delta in entity_changes.items():
+                    target = (entity, state_name)
+                    label = delta_bin(delta)
+                    samples[target].append((features, label))
+                    deltas[target][label].append(delta)
+
+        classifiers, values = {}, {}
+        for target, target_samples in samples.items():
+            if len(target_samples) < min_examples:
+                logger.info(f"Not enough examples for {target[0]}.{target[1]} ({len(target_samples)} < {min_examples})")
+                continue
+            classifiers[target] = NaiveBayesClassifier(alpha).fit(target_samples)
+            values[target] = {label: int(statistics.median(observed)) for label, observed in deltas[target].items()}
+        return cls(classifiers, values)
+
+    def covers(self, targets: Iterable[Target]) -> bool:
+        """Whether every target has a trained classifier"""
+        return all(target in self.classifiers for target in targets)
+
+    def predict(self, dialogue: Sequence[str], user_response: str, targets: Optional[Iterable[Target]] = None) -> LocalPrediction:
+        """
+        Predict the state deltas of a turn.
+
+        Args:
+            dialogue: Dialogue lines the user responded to
+            user_response: The user's response
+            targets: Entity states to predict, defaults to every trained one
+
+        Returns:
+            The LocalPrediction, with zero confidence if a target has no classifier
+        """
+        features = extract_features(dialogue, user_response)
+        changes: Dict[str, Dict[str, int]] = defaultdict(dict)
+        confidence = 1.0
+        for target in (self.classifiers if targets is None else targets):
+            classifier = self.classifiers.get(target)
+            if classifier is None:
+                return LocalPrediction({}, 0.0)
+            probabilities = classifier.predict_proba(features)
+            label = max(probabilities, key=probabilities.get)
+            confidence = min(confidence, probabilities[label])
+            changes[target[0]][target[1]] = self.values[target][label]
+        return LocalPrediction(dict(changes), confidence)
+
+    def save(self, path: str) -> None:
+        """Save the classifier as JSON"""
+        data = {
+            "v": CLASSIFIER_VERSION,
+            "threshold": self.threshold,
+            "targets": [
+                {"entity": entity, "state": state_name, "classifier": classifier.to_dict(),
+                 "values": {str(label): value for label, value in self.values[(entity, state_name)].items()}}
+                for (entity, state_name), classifier in self.classifiers.items()
+            ],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalStateClassifier":
+        """
+        Load a classifier saved with save.
+
+        Raises:
+            ValueError: If the file was saved by an unsupported version
+        """
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("v") != CLASSIFIER_VERSION:
+            raise ValueError(f"Unsupported local classifier version: {data.get('v')}")
+        classifiers, values = {}, {}
+        for entry in data["targets"]:
+            target = (entry["entity"], entry["state"])
+            classifiers[target] = NaiveBayesClassifier.from_dict(entry["classifier"])
+            values[target] = {int(label): value for label, value in entry["values"].items()}
+        return cls(classifiers, values, data.get("threshold"))
+
+
+def _record_targets(record: Dict[str, Any]) -> List[Target]:
+    """The entity states an analysis log record has deltas for"""
+    return [(entity, state) for entity, states in record["changes"].items() for state in states]
+
+
+def calibrate_threshold(classifier: LocalStateClassifier, records: Sequence[Dict[str, Any]], target_accuracy: float = 0.95,
+                        min_answered: int = 20) -> Optional[float]:
+    """
+    Find the lowest confidence threshold at which the turns answered locally
+    are exactly right often enough.
+
+    Args:
+        classifier: The trained classifier
+        records: Held-out analysis log records, not used for training
+        target_accuracy: Share of the answered turns whose every delta must be right
+        min_answered: Fewest held-out turns a threshold must answer to be trusted
+
+    Returns:
+        The threshold, or None if no threshold reaches the target accuracy
+    """
+    outcomes = []
+    for record in records:
+        targets = _record_targets(record)
+        prediction = classifier.predict(record["dialogue"], record["user_response"], targets)
+        right = all(prediction.changes.get(entity, {}).get(state) == record["changes"][entity][state] for entity, state in targets)
+        outcomes.append((prediction.confidence, right))
+    outcomes.sort(key=lambda outcome: outcome[0], reverse=True)
+
+    threshold = None
+    correct = 0
+    for answered, (confidence, right) in enumerate(outcomes, 1):
+        correct += right
+        # A threshold answers every turn of its confidence, so only the last of equal confidences is a candidate
+        if answered < len(outcomes) and outcomes[answered][0] == confidence:
+            continue
+        if confidence > 0 and answered >= min_answered and correct / answered >= target_accuracy:
+            threshold = confidence
+    return threshold
+
+
+def evaluate(classifier: LocalStateClassifier, records: Sequence[Dict[str, Any]], threshold: float) -> Dict[str, float]:
+    """
+    Measure how often the classifier would answer on its own and how often it is right.
+
+    Args:
+        classifier: The trained classifier
+        records: Held-out analysis log records
+        threshold: Confidence threshold to skip the LLM
+
+    Returns:
+        Coverage (share of turns answered locally), exact and class accuracy on those turns,
+        and mean absolute delta error
+    """
+    answered = exact = same_class = 0
+    errors: List[int] = []
+    for record in records:
+        targets = _record_targets(record)
+        prediction = classifier.predict(record["dialogue"], record["user_response"], targets)
+        if prediction.confidence < threshold:
+            continue
+        answered += 1
+        pairs = [(prediction.changes[entity][state], record["changes"][entity][state]) for entity, state in targets]
+        exact += all(predicted == actual for predicted, actual in pairs)
+        same_class += all(delta_bin(predicted) == delta_bin(actual) for predicted, actual in pairs)
+        errors.extend(abs(predicted - actual) for predicted, actual in pairs)
+    return {
+        "turns": len(records),
+        "coverage": answered / len(records) if records else 0.0,
+        "exact_accuracy": exact / answered if answered else 0.0,
+        "class_accuracy": same_class / answered if answered else 0.0,
+        "mean_abs_error": statistics.fmean(errors) if errors else 0.0,
+    }
+
+
+# Loaded classifiers and open analysis logs by path
+_classifier_cache: Dict[str, LocalStateClassifier] = {}
+_log_cache: Dict[str, AnalysisLog] = {}
+
+
+def load_local_classifier(path: str) -> Optional[LocalStateClassifier]:
+    """
+    Load a saved classifier once per process.
+
+    Args:
+        path: Path of the saved classifier
+
+    Returns:
+        The LocalStateClassifier, or None if it cannot be loaded
+    """
+    classifier = _classifier_cache.get(path)
+    if classifier is None:
+        try:
+            classifier = LocalStateClassifier.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Cannot load the local analyzer from {path}, using the LLM: {str(e)}")
+            return None
+        _classifier_cache[path] = classifier
+        logger.info(f"Loaded local analyzer with {len(classifier.classifiers)} state classifiers from {path}")
+    return classifier
+
+
+def get_analysis_log(path: str) -> AnalysisLog:
+    """Get the analysis log of a path, opened once per process or again after close_analysis_logs"""
+    log = _log_cache.get(path)
+    if log is None or log.closed:
+        log = _log_cache[path] = AnalysisLog(path)
+    return log
+
+
+def close_analysis_logs() -> None:
+    """Close every analysis log opened with get_analysis_log"""
+    for log in _log_cache.values():
+        log.close()
+    _log_cache.clear()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train and evaluate the local state-delta classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="Train on an analysis log")
+    train_parser.add_argument("log", help="Analysis log written with analysis.log_path")
+    train_parser.add_argument("--out", default="local_analyzer.json")
+    train_parser.add_argument("--min-examples", type=int, default=50)
+    train_parser.add_argument("--holdout", type=float, default=0.2, help="Share of the log kept for evaluation")
+    train_parser.add_argument("--target-accuracy", type=float, default=0.95,
+                              help="Share of locally answered held-out turns that must be exactly right")
+    train_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    records = list(read_analysis_log(args.log))
+    random.Random(args.seed).shuffle(records)
+    split = int(len(records) * (1 - args.holdout))
+    classifier = LocalStateClassifier.train(records[:split], min_examples=args.min_examples)
+    threshold = calibrate_threshold(classifier, records[split:], args.target_accuracy)
+    if threshold is None:
+        raise SystemExit(f"No confidence threshold reaches {args.target_accuracy:.0%} accuracy on the held-out turns, "
+                         "log more turns before training the local analyzer")
+    print(f"Calibrated confidence threshold: {threshold:.4f}")
+    print(json.dumps(evaluate(classifier, records[split:], threshold), indent=2))
+    # Train the saved classifier on the whole log, keeping the threshold calibrated on the held-out turns
+    final = LocalStateClassifier.train(records, min_examples=args.min_examples)
+    final.threshold = threshold
+    final.save(args.out)
+    print(f"Saved local analyzer trained on {len(records)} turns to {args.out}")
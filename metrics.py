@@ -0,0 +1,416 @@
+import bisect
+import contextvars
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+# Default histogram bucket upper bounds in seconds, from fast local work to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Number of recent durations kept per phase to compute percentiles
+SAMPLE_SIZE = 1024
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonically increasing value per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        """Add an amount to the value of a label set"""
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels: Any) -> float:
+        """Current value of a label set"""
+        return self.values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """Value per label set that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        """Set the value of a label set"""
+        self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    """Distribution of observed values per label set, in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (the last one is +Inf), sum and count
+        self.values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """Record an observed value for a label set"""
+        key = _label_key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+        counts, totals = entry
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, (total, count)) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {int(count)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics of the process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, help, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        """Get or register a counter"""
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        """Get or register a gauge"""
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or register a histogram"""
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class PhaseStats:
+    """Duration statistics of one phase, with percentiles over the most recent samples"""
+
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self, sample_size: int = SAMPLE_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=sample_size)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """Nearest-rank percentile of the recent samples, q between 0 and 100"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        rank = max(1, math.ceil(q / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class ModelStats:
+    """Calls, latency, tokens and cost of one model"""
+
+    __slots__ = ("calls", "fallbacks", "latency", "prompt_tokens", "response_tokens", "cost")
+
+    def __init__(self):
+        self.calls = 0
+        self.fallbacks = 0
+        self.latency = PhaseStats()
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.cost = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "fallbacks": self.fallbacks,
+            "latency": self.latency.to_dict(),
+            "tokens": {"prompt": self.prompt_tokens, "response": self.response_tokens},
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class TurnStats:
+    """Phase durations, token counts, retries and cost of one session, or of the whole process"""
+
+    def __init__(self):
+        self.phases: Dict[str, PhaseStats] = {}
+        self.models: Dict[str, ModelStats] = {}
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.retries = 0
+        self.errors = 0
+        self.cost = 0.0
+        # Analyses predicted by the local analyzer instead of an LLM call
+        self.local_analyses = 0
+
+    def record_phase(self, phase: str, seconds: float) -> None:
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = PhaseStats()
+        stats.add(seconds)
+
+    def model(self, model_name: str) -> ModelStats:
+        stats = self.models.get(model_name)
+        if stats is None:
+            stats = self.models[model_name] = ModelStats()
+        return stats
+
+    def record_llm_call(self, model_name: str, prompt_tokens: int, response_tokens: int, retries: int,
+                        seconds: Optional[float] = None, cost: float = 0.0) -> None:
+        self.llm_calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.response_tokens += response_tokens
+        self.retries += retries
+        self.cost += cost
+        stats = self.model(model_name)
+        stats.calls += 1
+        stats.prompt_tokens += prompt_tokens
+        stats.response_tokens += response_tokens
+        stats.cost += cost
+        if seconds is not None:
+            stats.latency.add(seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Statistics as a JSON-serialisable dictionary"""
+        return {
+            "llm_calls": self.llm_calls,
+            "tokens": {"prompt": self.prompt_tokens, "response": self.response_tokens},
+            "retries": self.retries,
+            "errors": self.errors,
+            "cost_usd": round(self.cost, 6),
+            "local_analyses": self.local_analyses,
+            "phases": {phase: stats.to_dict() for phase, stats in self.phases.items()},
+            "models": {model_name: stats.to_dict() for model_name, stats in self.models.items()},
+        }
+
+
+REGISTRY = MetricsRegistry()
+GLOBAL_STATS = TurnStats()
+
+PHASE_SECONDS = REGISTRY.histogram("game_phase_duration_seconds", "Duration of the phases of a game turn")
+PHASE_ERRORS = REGISTRY.counter("game_phase_errors_total", "Phases that raised an error")
+LLM_REQUESTS = REGISTRY.counter("game_llm_requests_total", "Structured LLM calls sent to a model")
+LLM_TOKENS = REGISTRY.counter("game_llm_tokens_total", "LLM tokens by kind (prompt or response)")
+LLM_SECONDS = REGISTRY.histogram("game_llm_request_seconds", "Duration of successful LLM calls by model")
+LLM_COST = REGISTRY.counter("game_llm_cost_usd_total", "Spend on LLM calls in US dollars by model")
+LLM_FALLBACKS = REGISTRY.counter("game_llm_fallbacks_total", "LLM calls handed to the next model of their route")
+LLM_RETRIES = REGISTRY.counter("game_llm_retries_total", "Model requests retried after a failure or an invalid structured output")
+LOCAL_ANALYSES = REGISTRY.counter("game_local_analyses_total", "Turns seen by the local analyzer by outcome (local or llm)")
+ACTIVE_SESSIONS = REGISTRY.gauge("game_active_sessions", "Sessions held in memory")
+
+
+class Span:
+    """
+    A timed phase of a turn. Spans nest: a span inherits the session stats of
+    its parent, and LLM usage is attributed to the innermost open span.
+    """
+
+    __slots__ = ("phase", "stats", "parent", "prompt_tokens", "response_tokens", "retries", "seconds", "_started", "_token")
+
+    def __init__(self, phase: str, stats: Optional[TurnStats] = None):
+        self.phase = phase
+        self.parent = _current_span.get()
+        self.stats = stats if stats is not None else (self.parent.stats if self.parent is not None else None)
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.retries = 0
+        self.seconds = 0.0
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.seconds = time.perf_counter() - self._started
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited from another context, e.g. an async generator closed by a different task
+            _current_span.set(self.parent)
+        PHASE_SECONDS.observe(self.seconds, phase=self.phase)
+        GLOBAL_STATS.record_phase(self.phase, self.seconds)
+        if self.stats is not None:
+            self.stats.record_phase(self.phase, self.seconds)
+        # Cancellation and generator exits are not errors
+        if exc_type is not None and issubclass(exc_type, Exception):
+            PHASE_ERRORS.inc(phase=self.phase)
+            GLOBAL_STATS.errors += 1
+            if self.stats is not None:
+                self.stats.errors += 1
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def span(phase: str, stats: Optional[TurnStats] = None) -> Span:
+    """
+    Time a phase of a turn.
+
+    Args:
+        phase: Name of the phase, used as the `phase` label
+        stats: Session stats to record into, inherited from the enclosing span if not given
+
+    Returns:
+        The Span, to be used as a context manager
+    """
+    return Span(phase, stats)
+
+
+def current_span() -> Optional[Span]:
+    """The innermost open span of the current context, if any"""
+    return _current_span.get()
+
+
+def record_llm_usage(model_name: str, prompt_tokens: int, response_tokens: int, requests: int = 1,
+                     seconds: Optional[float] = None, cost: float = 0.0) -> None:
+    """
+    Record the usage of a structured LLM call, globally and on the current span.
+
+    Args:
+        model_name: The model the call was sent to
+        prompt_tokens: Tokens of the prompts sent, over all requests of the call
+        response_tokens: Tokens of the responses received, over all requests of the call
+        requests: Model requests made, more than one when the output had to be retried
+        seconds: Duration of the call, if measured
+        cost: Cost of the call in US dollars
+    """
+    retries = max(requests - 1, 0)
+    LLM_REQUESTS.inc(model=model_name)
+    LLM_TOKENS.inc(prompt_tokens, model=model_name, kind="prompt")
+    LLM_TOKENS.inc(response_tokens, model=model_name, kind="response")
+    if retries:
+        LLM_RETRIES.inc(retries, model=model_name, reason="invalid_output")
+    if seconds is not None:
+        LLM_SECONDS.observe(seconds, model=model_name)
+    if cost:
+        LLM_COST.inc(cost, model=model_name)
+    GLOBAL_STATS.record_llm_call(model_name, prompt_tokens, response_tokens, retries, seconds, cost)
+
+    current = _current_span.get()
+    if current is not None:
+        current.prompt_tokens += prompt_tokens
+        current.response_tokens += response_tokens
+        current.retries += retries
+        if current.stats is not None:
+            current.stats.record_llm_call(model_name, prompt_tokens, response_tokens, retries, seconds, cost)
+
+
+def record_llm_fallback(task: str, model_name: str, reason: str) -> None:
+    """
+    Record an LLM call handed from a model to the next model of its route.
+
+    Args:
+        task: The task of the route, e.g. "analysis"
+        model_name: The model that failed or was too slow
+        reason: Why it was abandoned, e.g. "slo" or "error"
+    """
+    LLM_FALLBACKS.inc(task=task, model=model_name, reason=reason)
+    GLOBAL_STATS.model(model_name).fallbacks += 1
+    current = _current_span.get()
+    if current is not None and current.stats is not None:
+        current.stats.model(model_name).fallbacks += 1
+
+
+def record_llm_retry(model_name: str, reason: str) -> None:
+    """
+    Record a failed LLM request that is retried, globally and on the current span.
+
+    Args:
+        model_name: The model the request was sent to
+        reason: Why it failed, e.g. "rate_limit" or "timeout"
+    """
+    LLM_RETRIES.inc(model=model_name, reason=reason)
+    GLOBAL_STATS.retries += 1
+    current = _current_span.get()
+    if current is not None:
+        current.retries += 1
+        if current.stats is not None:
+            current.stats.retries += 1
+
+
+def record_local_analysis(outcome: str) -> None:
+    """
+    Record a turn seen by the local analyzer, globally and on the current span.
+
+    Args:
+        outcome: "local" if its prediction was used, "llm" if the turn fell back to the LLM
+    """
+    LOCAL_ANALYSES.inc(outcome=outcome)
+    if outcome != "local":
+        return
+    GLOBAL_STATS.local_analyses += 1
+    current = _current_span.get()
+    if current is not None and current.stats is not None:
+        current.stats.local_analyses += 1
+
+
+def render_metrics() -> str:
+    """Render the process metrics in the Prometheus text exposition format"""
+    return REGISTRY.render()
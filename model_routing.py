@@ -0,0 +1,107 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+DEFAULT_MODEL_NAME = "meta-llama/llama-3.3-70b-instruct"
+
+# Tasks with their own model route
+TASKS = ("analysis", "generation")
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """Ordered models serving a task: the first is used, the next ones are fallbacks"""
+    task: str
+    models: Tuple[str, ...] = (DEFAULT_MODEL_NAME,)
+    # Seconds a model may take, queueing and retries included, before the next model is tried.
+    # The last model of the chain is never cut off by the SLO.
+    latency_slo: Optional[float] = None
+
+    @property
+    def primary(self) -> str:
+        """The preferred model of the route"""
+        return self.models[0]
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """Price of a model in US dollars per million tokens"""
+    prompt: float = 0.0
+    response: float = 0.0
+
+    def cost(self, prompt_tokens: int, response_tokens: int) -> float:
+        """Cost of a call in US dollars"""
+        return (prompt_tokens * self.prompt + response_tokens * self.response) / 1_000_000
+
+
+@dataclass
+class RoutingConfig:
+    """Model routes per task and model prices"""
+    routes: Dict[str, ModelRoute] = field(default_factory=dict)
+    prices: Dict[str, ModelPrice] = field(default_factory=dict)
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict[str, Any]]) -> "RoutingConfig":
+        """
+        Build the routing from the `llm` section of the Hydra config.
+
+        Args:
+            cfg: The `llm` config with `routes` ({task: {models, latency_slo}}) and
+                `prices` ({model: {prompt, response}})
+
+        Returns:
+            The RoutingConfig
+        """
+        cfg = cfg or {}
+        routes = {}
+        for task, route_cfg in (cfg.get("routes") or {}).items():
+            route_cfg = route_cfg or {}
+            models = route_cfg.get("models") or [DEFAULT_MODEL_NAME]
+            if isinstance(models, str):
+                models = [models]
+            routes[task] = ModelRoute(task, tuple(models), route_cfg.get("latency_slo"))
+        prices = {
+            model: ModelPrice(price.get("prompt", 0.0) or 0.0, price.get("response", 0.0) or 0.0)
+            for model, price in (cfg.get("prices") or {}).items()
+        }
+        return cls(routes, prices)
+
+    def route(self, task: str) -> ModelRoute:
+        """The route of a task, the default model alone if it has none"""
+        route = self.routes.get(task)
+        return route if route is not None else ModelRoute(task)
+
+    def cost(self, model_name: str, prompt_tokens: int, response_tokens: int) -> float:
+        """Cost of a call in US dollars, zero for models without a price"""
+        price = self.prices.get(model_name)
+        return price.cost(prompt_tokens, response_tokens) if price is not None else 0.0
+
+    def models(self) -> List[str]:
+        """Every model of every route"""
+        return sorted({model for route in self.routes.values() for model in route.models})
+
+
+_routing = RoutingConfig()
+
+
+def get_model_routing() -> RoutingConfig:
+    """Get the process-wide model routing"""
+    return _routing
+
+
+def configure_model_routing(config: RoutingConfig) -> RoutingConfig:
+    """
+    Set the process-wide model routing, used by LLM interfaces created afterwards.
+
+    Args:
+        config: The routing to apply
+
+    Returns:
+        The process-wide RoutingConfig
+    """
+    global _routing
+    if config != _routing:
+        _routing = config
+        for route in config.routes.values():
+            logger.info(f"Routing {route.task} to {' -> '.join(route.models)}")
+    return _routing
@@ -0,0 +1,180 @@
+import asyncio
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from loguru import logger
+from llm_scheduler import classify_error
+from game_engine import GameEngine, ConversationOutput
+from story_template import StoryTemplate, load_story_template
+
+
+class OpeningPool:
+    """
+    Keeps a few pre-generated opening conversations ready for every start node.
+
+    A new session starts from the default character and user states, so the
+    opening prompt of a start node is the same for every session and its
+    conversation can be generated before any player asks for it. Openings are
+    kept per story config and start node, and only handed to sessions of the
+    same story. Taking an
+    opening schedules a replacement in the background; when the pool of a node
+    is empty the caller falls back to generating the opening itself.
+    """
+
+    def __init__(
+        self,
+        template: Optional[StoryTemplate] = None,
+        engine_factory: Optional[Callable[..., GameEngine]] = None,
+        start_nodes: Iterable[str] = ("arrival",),
+        size: int = 4,
+        max_concurrency: int = 2,
+        retry_delay: float = 5.0,
+        max_retry_delay: float = 300.0,
+    ):
+        """
+        Initialize the pool.
+
+        Args:
+            template: The story template, loaded from the default config if not given
+            engine_factory: Callable creating the engine of the sessions, e.g. the one of
+                the SessionManager; the openings are generated by an engine it creates
+            start_nodes: IDs of the start nodes to keep openings for
+            size: Number of openings kept ready per start node
+            max_concurrency: Maximum number of openings generated at the same time
+            retry_delay: Seconds to wait before the first retry of a failed generation,
+                doubled on every further failure up to max_retry_delay
+            max_retry_delay: Longest wait between retries
+        """
+        if engine_factory is not None:
+            self.engine = engine_factory()
+        else:
+            self.engine = GameEngine(print_output=False, template=template or load_story_template())
+        self.story_hash = self.engine.story_hash
+        self.size = size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # Set when a generation fails for a reason retrying cannot fix, e.g. a missing API key
+        self.error: Optional[str] = None
+        # Ready openings and openings being generated by (story hash, start node)
+        self.openings: Dict[Tuple[str, str], Deque[ConversationOutput]] = {}
+        self._pending: Dict[Tuple[str, str], int] = {}
+        for start_node in start_nodes:
+            if start_node not in self.engine.story_state.story_nodes:
+                raise ValueError(f"Unknown start node: {start_node}")
+            self.openings[self._key(start_node)] = deque()
+            self._pending[self._key(start_node)] = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._running = False
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def character_ids(self) -> List[str]:
+        """IDs of the characters the openings are generated for"""
+        return self.engine.character_ids
+
+    def _key(self, start_node: str) -> Tuple[str, str]:
+        return self.story_hash, start_node
+
+    def _schedule_refill(self, start_node: str) -> None:
+        """Start generating openings until the pool of a start node is full again"""
+        if not self._running or self.error is not None:
+            return
+        key = self._key(start_node)
+        missing = self.size - len(self.openings[key]) - self._pending[key]
+        for _ in range(missing):
+            self._pending[key] += 1
+            task = asyncio.create_task(self._generate_one(start_node))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _generate_one(self, start_node: str) -> None:
+        key = self._key(start_node)
+        try:
+            failures = 0
+            while True:
+                if self.error is not None:
+                    return
+                try:
+                    async with self._semaphore:
+                        opening = await self.engine.generate_opening(start_node)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if classify_error(e) is None:
+                        # Retrying cannot fix e.g. a missing API key or a rejected request
+                        if self.error is None:
+                            self.error = str(e)
+                            logger.error(f"Stopped pre-generating openings: {e}")
+                        return
+                    delay = min(self.max_retry_delay, self.retry_delay * 2 ** failures)
+                    failures += 1
+                    logger.warning(f"Failed to pre-generate an opening for {start_node}, retrying in {delay:.0f}s: {e}")
+                    await asyncio.sleep(delay)
+            self.openings[key].append(opening)
+            logger.debug(f"Opening pool for {start_node}: {len(self.openings[key])}/{self.size}")
+        finally:
+            self._pending[key] -= 1
+
+    def take(self, start_node: str = "arrival", story_hash: Optional[str] = None) -> Optional[ConversationOutput]:
+        """
+        Take a ready opening of a start node and schedule its replacement.
+
+        Args:
+            start_node: The node ID the session starts at
+            story_hash: Hash of the session's story config, openings of another story are never returned
+
+        Returns:
+            A pre-generated opening, or None if none is ready
+        """
+        openings = self.openings.get((story_hash or self.story_hash, start_node))
+        if openings is None:
+            return None
+        if openings:
+            opening = openings.popleft()
+            self.hits += 1
+        else:
+            opening = None
+            self.misses += 1
+        self._schedule_refill(start_node)
+        return opening
+
+    def start(self) -> None:
+        """Start filling the pools of every start node in the background"""
+        self._running = True
+        for _, start_node in self.openings:
+            self._schedule_refill(start_node)
+
+    async def stop(self) -> None:
+        """Cancel every pending generation"""
+        self._running = False
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, object]:
+        """Ready and pending openings per start node, the hit and miss counts of take, and the error that stopped refills"""
+        return {
+            "ready": {start_node: len(openings) for (_, start_node), openings in self.openings.items()},
+            "pending": {start_node: pending for (_, start_node), pending in self._pending.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "error": self.error,
+        }
+
+
+if __name__ == "__main__":
+    async def main():
+        pool = OpeningPool(size=2)
+        pool.start()
+        while any(pool._pending.values()):
+            await asyncio.sleep(0.5)
+        print(pool.stats())
+
+        engine = GameEngine(character_ids=pool.character_ids)
+        await engine.start_story("arrival", opening=pool.take("arrival"))
+        await pool.stop()
+
+    asyncio.run(main())
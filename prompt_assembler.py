@@ -0,0 +1,212 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+from loguru import logger
+
+# A tokenizer returns the number of tokens in a text
+Tokenizer = Callable[[str], int]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text, assuming about four characters per token"""
+    return (len(text) + 3) // 4
+
+
+def get_tokenizer(name: Optional[str] = None) -> Tokenizer:
+    """
+    Get a token counting function by name.
+
+    Args:
+        name: "estimate" (default) for the character based estimate, or
+            "tiktoken:<encoding>" to count with a tiktoken encoding
+
+    Returns:
+        A function returning the number of tokens in a text
+    """
+    if not name or name == "estimate":
+        return estimate_tokens
+
+    if name.startswith("tiktoken:"):
+        try:
+            import tiktoken
+        except ImportError:
+            logger.warning(f"tiktoken is not installed, falling back to estimated token counts for {name}")
+            return estimate_tokens
+        encoding = tiktoken.get_encoding(name.split(":", 1)[1])
+        return lambda text: len(encoding.encode(text))
+
+    raise ValueError(f"Unknown tokenizer: {name}")
+
+
+def truncate_text(text: str, max_tokens: int, count_tokens: Tokenizer = estimate_tokens, keep_end: bool = False) -> str:
+    """
+    Cut a text at a word boundary so that it fits a token budget.
+
+    Args:
+        text: The text to truncate
+        max_tokens: Token budget for the result
+        count_tokens: Function counting the tokens of a text
+        keep_end: Keep the end of the text instead of the beginning
+
+    Returns:
+        The truncated text, marked with "..." where it was cut
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split(" ")
+
+    def cut(n: int) -> str:
+        if n == 0:
+            return ""
+        return "... " + " ".join(words[-n:]) if keep_end else " ".join(words[:n]) + " ..."
+
+    # Binary search for the largest number of words that fits
+    low, high = 0, len(words) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(cut(mid)) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return cut(low)
+
+
+@dataclass
+class PromptSection:
+    """
+    A named part of a prompt.
+    The header and footer are always kept; only the text can be trimmed.
+    """
+    name: str
+    text: str
+    # Sections with a higher priority are trimmed first, 0 is never trimmed
+    priority: int = 0
+    header: str = ""
+    footer: str = ""
+    # Optional function returning the text within a token budget, used instead of truncation
+    shrink: Optional[Callable[[int], str]] = None
+    # Whether truncation keeps the end of the text (e.g. the most recent history)
+    keep_end: bool = False
+    # Whether the section is the same on every turn, so it can be part of a cached prompt prefix
+    static: bool = False
+
+    def render(self) -> str:
+        """Full text of the section"""
+        return f"{self.header}{self.text}{self.footer}"
+
+
+@dataclass
+class AssembledPrompt:
+    """A prompt assembled from sections, with its token accounting"""
+    text: str
+    section_tokens: Dict[str, int]
+    total_tokens: int
+    max_tokens: Optional[int] = None
+    trimmed: List[str] = field(default_factory=list)
+    # Leading part of the prompt made of static sections, sent as a cacheable prefix
+    static_prefix: str = ""
+
+    @property
+    def over_budget(self) -> bool:
+        """Whether the prompt is still larger than its budget"""
+        return self.max_tokens is not None and self.total_tokens > self.max_tokens
+
+
+class PromptAssembler:
+    """
+    Joins prompt sections into a single prompt within a token budget.
+    When the prompt is too large, sections are trimmed by priority, highest
+    first, until it fits. Sections of the same priority share the cut in
+    proportion to their size.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, tokenizer: Tokenizer = estimate_tokens):
+        """
+        Initialize the assembler.
+
+        Args:
+            max_tokens: Token budget for the whole prompt, or None for no limit
+            tokenizer: Function counting the tokens of a text
+        """
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer
+
+    def _shrink(self, section: PromptSection, max_text_tokens: int) -> str:
+        if section.shrink is not None:
+            return section.shrink(max_text_tokens)
+        return truncate_text(section.text, max_text_tokens, self.tokenizer, keep_end=section.keep_end)
+
+    def assemble(self, sections: List[PromptSection]) -> AssembledPrompt:
+        """
+        Assemble the sections into a prompt.
+
+        Args:
+            sections: The prompt sections in output order
+
+        Returns:
+            The assembled prompt with the final token count of every section
+        """
+        section_tokens = {section.name: self.tokenizer(section.render()) for section in sections}
+        total = sum(section_tokens.values())
+        trimmed = []
+
+        if self.max_tokens is not None and total > self.max_tokens:
+            priorities = sorted({section.priority for section in sections if section.priority > 0}, reverse=True)
+            for priority in priorities:
+                excess = total - self.max_tokens
+                if excess <= 0:
+                    break
+                group = [section for section in sections if section.priority == priority and section.text]
+                text_tokens = {section.name: self.tokenizer(section.text) for section in group}
+                group_tokens = sum(text_tokens.values())
+                if not group_tokens:
+                    continue
+                # Share the cut between the sections of this priority in proportion to their size
+                for section in group:
+                    cut = -(-excess * text_tokens[section.name] // group_tokens)
+                    section.text = self._shrink(section, max(0, text_tokens[section.name] - cut))
+                    new_tokens = self.tokenizer(section.render())
+                    total += new_tokens - section_tokens[section.name]
+                    section_tokens[section.name] = new_tokens
+                    trimmed.append(section.name)
+
+            if total > self.max_tokens:
+                logger.warning(f"Prompt has {total} tokens after trimming, over the budget of {self.max_tokens}")
+            else:
+                logger.debug(f"Trimmed prompt sections {trimmed} to fit {self.max_tokens} tokens")
+
+        static_prefix = ""
+        for section in sections:
+            if not section.static:
+                break
+            static_prefix += section.render()
+
+        return AssembledPrompt(
+            text="".join(section.render() for section in sections),
+            section_tokens=section_tokens,
+            total_tokens=total,
+            max_tokens=self.max_tokens,
+            trimmed=trimmed,
+            static_prefix=static_prefix,
+        )
+
+
+def build_prompt_assembler(prompt_cfg: Optional[Dict[str, Any]], model_names: Union[str, Sequence[str]]) -> PromptAssembler:
+    """
+    Build the prompt assembler for a model route from the `prompt` section of the Hydra config.
+
+    Args:
+        prompt_cfg: The prompt config with `tokenizer` and per-model `max_tokens`
+        model_names: The model the prompts are sent to, or every model of its fallback
+            chain, in which case the smallest budget applies so any of them can take the prompt
+
+    Returns:
+        A PromptAssembler with the token budget of the route
+    """
+    prompt_cfg = prompt_cfg or {}
+    budgets = prompt_cfg.get("max_tokens", {}) or {}
+    if isinstance(model_names, str):
+        model_names = [model_names]
+    limits = [budgets.get(model_name, budgets.get("default")) for model_name in model_names]
+    limits = [limit for limit in limits if limit is not None]
+    max_tokens = min(limits) if limits else None
+    return PromptAssembler(max_tokens=max_tokens, tokenizer=get_tokenizer(prompt_cfg.get("tokenizer")))
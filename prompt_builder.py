@@ -1,3 +1,5 @@
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Dict, List, Optional, Any
 from pydantic import BaseModel, Field
 # Import pydantic-ai correctly - commented out until correct import path is determined
@@ -5,6 +7,8 @@ from pydantic import BaseModel, Field
 from loguru import logger
 from character_state import CharacterState
 from story_state import StoryState
+from conversation_history import ConversationHistory
+from prompt_assembler import AssembledPrompt, PromptAssembler, PromptSection
 
 class CharacterPrompt(BaseModel):
     """Model for character-specific prompt information"""
@@ -65,6 +69,80 @@ class PromptContext(BaseModel):
         
         return f"{story_str}\n\n{characters_str}{user_str}\n\n"
 
+# Instructions for generating a conversation snippet, shared by every prompt that asks for dialogue
+CONVERSATION_INSTRUCTIONS = """Generate a conversation snippet between the characters that:
+1. Reflects the current story node and situation
+2. Shows the characters' personalities and backgrounds
+3. Incorporates their current emotional and psychological states
+4. Maintains appropriate tension and dynamics based on character states
+5. Takes into account the user's current state and preferences
+6. Feels natural and realistic
+7. End with open ended situation to wait for User's response.
+                                                       
+The conversation should be 3-8 exchanges between the characters and finally wait for the user's response.
+"""
+
+@dataclass(frozen=True)
+class CharacterFragment:
+    """Static prompt text of a character"""
+    # None when the story config gives no name, so callers can pick their own fallback
+    name: Optional[str]
+    background: str
+
+@dataclass(frozen=True)
+class StaticPromptFragments:
+    """Prompt text that never changes for a loaded story"""
+    story_background: str
+    characters: Dict[str, CharacterFragment]
+
+# Static fragments per story, shared by every session playing that story. Only the
+# most recently used stories are kept, a server may load many story variants over time
+STATIC_FRAGMENTS_CACHE_SIZE = 8
+_static_fragments_cache: "OrderedDict[str, StaticPromptFragments]" = OrderedDict()
+
+def get_static_fragments(story_state: StoryState) -> StaticPromptFragments:
+    """
+    Get the static prompt fragments of a story, rendering them only once per story.
+    
+    Args:
+        story_state: A story state of the story
+        
+    Returns:
+        The StaticPromptFragments shared by all sessions of the story
+    """
+    key = story_state.config.fingerprint()
+    fragments = _static_fragments_cache.get(key)
+    if fragments is not None:
+        _static_fragments_cache.move_to_end(key)
+    else:
+        characters = {}
+        for char_id, char_info in story_state.get_character_background().items():
+            characters[char_id] = CharacterFragment(
+                name=char_info.get("name"),
+                background=char_info.get("background", "")
+            )
+        fragments = StaticPromptFragments(
+            story_background=story_state.get_story_background(),
+            characters=characters
+        )
+        _static_fragments_cache[key] = fragments
+        if len(_static_fragments_cache) > STATIC_FRAGMENTS_CACHE_SIZE:
+            _static_fragments_cache.popitem(last=False)
+    return fragments
+
+# Prompt layouts. The cache friendly layout orders content from most static to
+# most dynamic so that consecutive prompts share the longest possible prefix.
+PROMPT_LAYOUT_DEFAULT = "default"
+PROMPT_LAYOUT_CACHE_FRIENDLY = "cache_friendly"
+
+CACHE_FRIENDLY_INTRO = """
+You are an AI assistant helping to generate dialogue between characters for an interactive narrative game.
+
+Based on the context about the story, characters, user, their current states and the history given below,
+generate a realistic conversation snippet that reflects the current situation and character dynamics.
+
+"""
+
 # This is a placeholder class that would be replaced with the actual pydantic-ai implementation
 class LLMPromptTemplate:
     """Placeholder for LLM prompt template functionality"""
@@ -83,15 +161,33 @@ class PromptBuilder:
     to generate conversation and narrative content.
     """
     
-    def __init__(self, story_state: StoryState):
+    def __init__(
+        self,
+        story_state: StoryState,
+        history_max_tokens: Optional[int] = None,
+        assembler: Optional[PromptAssembler] = None,
+        layout: str = PROMPT_LAYOUT_DEFAULT
+    ):
         """
         Initialize the PromptBuilder with story state.
         The story state contains all character states and user state.
         
         Args:
             story_state: The current state of the story, containing character states and user state
+            history_max_tokens: Token budget for the conversation history, or None for no limit
+            assembler: Prompt assembler enforcing the prompt token budget, defaults to no budget
+            layout: Prompt layout, "default" or "cache_friendly"
         """
+        if layout not in (PROMPT_LAYOUT_DEFAULT, PROMPT_LAYOUT_CACHE_FRIENDLY):
+            raise ValueError(f"Unknown prompt layout: {layout}")
         self.story_state = story_state
+        self.layout = layout
+        self.history_max_tokens = history_max_tokens
+        self.assembler = assembler or PromptAssembler()
+        self.last_prompt: Optional[AssembledPrompt] = None
+        
+        # Story and character backgrounds never change after the story is loaded
+        self.fragments = get_static_fragments(story_state)
         
         # Define the conversation prompt template
         self.conversation_template = LLMPromptTemplate("""
@@ -106,17 +202,7 @@ Context:
 History:
 {history}
 
-Generate a conversation snippet between the characters that:
-1. Reflects the current story node and situation
-2. Shows the characters' personalities and backgrounds
-3. Incorporates their current emotional and psychological states
-4. Maintains appropriate tension and dynamics based on character states
-5. Takes into account the user's current state and preferences
-6. Feels natural and realistic
-7. End with open ended situation to wait for User's response.
-                                                       
-The conversation should be 3-8 exchanges between the characters and finally wait for the user's response.
-""")
+""" + CONVERSATION_INSTRUCTIONS)
     
     def _build_character_prompts(self) -> Dict[str, CharacterPrompt]:
         """
@@ -126,18 +212,22 @@ The conversation should be 3-8 exchanges between the characters and finally wait
             Dictionary of character prompts keyed by character ID
         """
         character_prompts = {}
-        character_backgrounds = self.story_state.get_character_background()
         
-        for char_id, char_info in character_backgrounds.items():
+        for char_id, fragment in self.fragments.characters.items():
             # Create a character prompt for each character
             character_prompts[char_id] = CharacterPrompt(
-                name=char_info.get("name", f"Character {char_id}"),
-                background=char_info.get("background", ""),
+                name=self._character_name(char_id),
+                background=fragment.background,
                 current_state_description=self._get_character_state_description(char_id)
             )
         
         return character_prompts
     
+    def _character_name(self, char_id: str) -> str:
+        """Name of a character as shown in conversation prompts"""
+        name = self.fragments.characters[char_id].name
+        return f"Character {char_id}" if name is None else name
+    
     def _get_character_state_description(self, char_id: str) -> str:
         """
         Get a description of the character's current state based on state rules.
@@ -171,6 +261,19 @@ The conversation should be 3-8 exchanges between the characters and finally wait
         Returns:
             UserPrompt object containing user state information, or None if no user state
         """
+        state_description = self._get_user_state_text()
+        if state_description is None:
+            return None
+        
+        return UserPrompt(current_state_description=state_description)
+    
+    def _get_user_state_text(self) -> Optional[str]:
+        """
+        Get a description of the user's current state based on state rules.
+        
+        Returns:
+            A string describing the user's current state, or None if no user state
+        """
         if not self.story_state.user_state:
             return None
         
@@ -182,9 +285,7 @@ The conversation should be 3-8 exchanges between the characters and finally wait
         for state_name, description in rules.items():
             descriptions.append(f"{state_name}: {description}")
         
-        state_description = "; ".join(descriptions)
-        
-        return UserPrompt(current_state_description=state_description)
+        return "; ".join(descriptions)
     
     def _build_story_prompt(self) -> StoryPrompt:
         """
@@ -196,7 +297,7 @@ The conversation should be 3-8 exchanges between the characters and finally wait
         current_node = self.story_state.get_current_node()
         
         return StoryPrompt(
-            background=self.story_state.get_story_background(),
+            background=self.fragments.story_background,
             current_node_name=current_node.name if current_node else "",
             current_node_description=current_node.description if current_node else ""
         )
@@ -212,7 +313,7 @@ The conversation should be 3-8 exchanges between the characters and finally wait
         
         # Get states for all characters
         for char_id, char_state in self.story_state.character_states.items():
-            states[char_id] = char_state.state_values
+            states[char_id] = dict(char_state.state_values)
         
         return states
     
@@ -241,7 +342,7 @@ The conversation should be 3-8 exchanges between the characters and finally wait
         if not self.story_state.user_state:
             return None
         
-        return self.story_state.user_state.state_values
+        return dict(self.story_state.user_state.state_values)
     
     def _get_user_state_description(self) -> Optional[Dict[str, str]]:
         """
@@ -273,27 +374,180 @@ The conversation should be 3-8 exchanges between the characters and finally wait
         )
     
     
+    def render_history(self, history=None, max_tokens: Optional[int] = None) -> Optional[str]:
+        """
+        Render the conversation history for a prompt.
+        
+        Args:
+            history: A ConversationHistory, rendered within the history token budget,
+                or an already rendered history string
+            max_tokens: Tighter token budget for this rendering, if any
+            
+        Returns:
+            The history text, or None if there is no history
+        """
+        if isinstance(history, ConversationHistory):
+            budget = self.history_max_tokens
+            if max_tokens is not None:
+                budget = max_tokens if budget is None else min(budget, max_tokens)
+            return history.render(max_tokens=budget, count_tokens=self.assembler.tokenizer)
+        return history
+    
+    def _history_section(self, history, header: str, footer: str) -> PromptSection:
+        """
+        Build the prompt section holding the conversation history.
+        History is trimmed before any other section.
+        
+        Args:
+            history: A ConversationHistory or an already rendered history string
+            header: Text placed before the history
+            footer: Text placed after the history
+            
+        Returns:
+            The history PromptSection
+        """
+        shrink = None
+        if isinstance(history, ConversationHistory):
+            shrink = lambda max_tokens: str(self.render_history(history, max_tokens))
+        return PromptSection(
+            "history",
+            str(self.render_history(history)),
+            priority=3,
+            header=header,
+            footer=footer,
+            shrink=shrink,
+            keep_end=True
+        )
+    
+    def _current_node_text(self) -> str:
+        """Name and description of the current story node"""
+        current_node = self.story_state.get_current_node()
+        if not current_node:
+            return ": "
+        return f"{current_node.name}: {current_node.description}"
+    
+    def _context_sections(self) -> List[PromptSection]:
+        """
+        Build the context sections of the default layout, backgrounds being trimmable.
+        Rendered untrimmed, the sections are identical to str(self.build_prompt_context()),
+        but only the node and state descriptions are computed per turn.
+        
+        Returns:
+            List of PromptSection objects
+        """
+        sections = [
+            PromptSection("story_background", self.fragments.story_background, priority=2, header="# Story Background\n"),
+            PromptSection("current_situation", f"\n\n# Current Situation\n{self._current_node_text()}\n\n"),
+        ]
+        for index, (char_id, fragment) in enumerate(self.fragments.characters.items()):
+            separator = "\n\n" if index else ""
+            sections.append(PromptSection(
+                f"character_background.{char_id}",
+                fragment.background,
+                priority=2,
+                header=f"{separator}## {self._character_name(char_id)}\n",
+                footer=f"\n\nCurrent state: {self._get_character_state_description(char_id)}"
+            ))
+        user_text = self._get_user_state_text()
+        user_str = f"\n\n## User State\n{user_text}" if user_text is not None else ""
+        sections.append(PromptSection("user_state", f"{user_str}\n\n"))
+        return sections
+    
+    def _cache_friendly_sections(self, history) -> List[PromptSection]:
+        """
+        Build the conversation prompt sections ordered from most static to most
+        dynamic: instructions, story and character backgrounds, then the current
+        node, the state descriptions and the history.
+        
+        Args:
+            history: A ConversationHistory or an already rendered history string
+            
+        Returns:
+            List of PromptSection objects
+        """
+        sections = [
+            PromptSection("instructions", CACHE_FRIENDLY_INTRO + CONVERSATION_INSTRUCTIONS + "\nContext:\n", static=True),
+            PromptSection("story_background", self.fragments.story_background, priority=2, header="# Story Background\n", footer="\n\n", static=True),
+        ]
+        for char_id, fragment in self.fragments.characters.items():
+            sections.append(PromptSection(
+                f"character_background.{char_id}",
+                fragment.background,
+                priority=2,
+                header=f"## {self._character_name(char_id)}\n",
+                footer="\n\n",
+                static=True
+            ))
+        
+        sections.append(PromptSection("current_situation", f"# Current Situation\n{self._current_node_text()}\n\n"))
+        states_text = "".join(
+            f"{self._character_name(char_id)}: {self._get_character_state_description(char_id)}\n"
+            for char_id in self.fragments.characters
+        )
+        sections.append(PromptSection("character_states", f"# Current States\n{states_text}"))
+        user_text = self._get_user_state_text()
+        if user_text is not None:
+            sections.append(PromptSection("user_state", f"\n## User State\n{user_text}\n"))
+        sections.append(self._history_section(history, header="\nHistory:\n", footer="\n"))
+        return sections
+    
+    def build_conversation_prompt(self, history=None) -> AssembledPrompt:
+        """
+        Assemble the conversation prompt within the prompt token budget.
+        
+        Args:
+            history: A ConversationHistory or an already rendered history string
+        
+        Returns:
+            The AssembledPrompt with its per-section token counts
+        """
+        if self.layout == PROMPT_LAYOUT_CACHE_FRIENDLY:
+            self.last_prompt = self.assembler.assemble(self._cache_friendly_sections(history))
+            return self.last_prompt
+        
+        template = self.conversation_template.template
+        intro, rest = template.split("{context}")
+        between, instructions = rest.split("{history}")
+        
+        sections = [PromptSection("instructions_intro", intro)]
+        sections.extend(self._context_sections())
+        sections.append(self._history_section(history, header=between, footer=""))
+        sections.append(PromptSection("instructions", instructions))
+        
+        self.last_prompt = self.assembler.assemble(sections)
+        return self.last_prompt
+    
     def generate_conversation_prompt(self,history=None) -> str:
         """
         Generate a prompt specifically for conversation generation.
         
+        Args:
+            history: A ConversationHistory or an already rendered history string
+        
         Returns:
             A formatted string prompt for generating conversations
         """
-        context = str(self.build_prompt_context())
-        return self.conversation_template.format(context=context,history=history)
+        return self.build_conversation_prompt(history).text
 
-def build_prompt_builder(story_state: StoryState) -> PromptBuilder:
+def build_prompt_builder(
+    story_state: StoryState,
+    history_max_tokens: Optional[int] = None,
+    assembler: Optional[PromptAssembler] = None,
+    layout: str = PROMPT_LAYOUT_DEFAULT
+) -> PromptBuilder:
     """
     Factory function to create a PromptBuilder instance.
     
     Args:
         story_state: The current state of the story, containing character states and user state
+        history_max_tokens: Token budget for the conversation history, or None for no limit
+        assembler: Prompt assembler enforcing the prompt token budget
+        layout: Prompt layout, "default" or "cache_friendly"
         
     Returns:
         A configured PromptBuilder instance
     """
-    return PromptBuilder(story_state)
+    return PromptBuilder(story_state, history_max_tokens, assembler, layout)
 
 if __name__ == "__main__":
     # Example usage
@@ -1,78 +1,481 @@
-from pydantic_ai import Agent
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
 import os
-from dotenv import load_dotenv
-from typing import Dict, List, Optional, Any, TypeVar, Generic
-from pydantic import BaseModel, Field
+import time
+from pydantic_core import from_json
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Any, TypeVar, Generic, AsyncIterator, Sequence
+from pydantic import BaseModel, Field, ValidationError
 from loguru import logger
+from llm_cache import CachedResult, ResponseCache, cache_key, get_response_cache
+from metrics import record_llm_fallback, record_llm_usage
+from model_routing import DEFAULT_MODEL_NAME, ModelRoute, get_model_routing
+from llm_scheduler import LLMDeadlineExceeded, LLMScheduler, get_scheduler, observe_response
 
-# Load environment variables
-load_dotenv()
-api_key = os.environ.get("OPENROUTER_API_KEY")
+# pydantic_ai, the OpenAI SDK and httpx take most of the import time of the
+# game, so they are imported when the first client or agent is created
+if TYPE_CHECKING:
+    import httpx
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import ModelMessage
+    from pydantic_ai.models import Model
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.providers.openai import OpenAIProvider
+    from pydantic_ai.usage import Usage
+
+
+_dotenv_loaded = False
+
+
+def get_api_key() -> Optional[str]:
+    """Get the OpenRouter API key, loading environment variables from .env on first use"""
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _dotenv_loaded = True
+    return os.environ.get("OPENROUTER_API_KEY")
 
 # Generic type for different output models
 T = TypeVar('T', bound=BaseModel)
 
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+# Model name of LLMClientRegistry.register_model standing for every model
+ANY_MODEL = "*"
+
+
+@dataclass
+class ClientPoolConfig:
+    """Connection pool settings shared by every LLM client in the process"""
+    base_url: str = DEFAULT_BASE_URL
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    timeout: float = 120.0
+    connect_timeout: float = 10.0
+    
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict[str, Any]]) -> "ClientPoolConfig":
+        """Build pool settings from the `llm` section of the Hydra config"""
+        if not cfg:
+            return cls()
+        pool_cfg = cfg.get("pool", {}) or {}
+        return cls(
+            base_url=cfg.get("base_url", DEFAULT_BASE_URL),
+            max_connections=pool_cfg.get("max_connections", cls.max_connections),
+            max_keepalive_connections=pool_cfg.get("max_keepalive_connections", cls.max_keepalive_connections),
+            keepalive_expiry=pool_cfg.get("keepalive_expiry", cls.keepalive_expiry),
+            timeout=pool_cfg.get("timeout", cls.timeout),
+            connect_timeout=pool_cfg.get("connect_timeout", cls.connect_timeout),
+        )
+
+
+class LLMClientRegistry:
+    """
+    Process-wide registry of LLM clients.
+    All models share one bounded HTTP connection pool, and each model name
+    maps to a single OpenAIModel that is reused by every LLMInterface.
+    """
+    
+    def __init__(self, config: Optional[ClientPoolConfig] = None):
+        """
+        Initialize the registry. Clients are created lazily on first use.
+        
+        Args:
+            config: Connection pool settings, defaults to ClientPoolConfig()
+        """
+        self.config = config or ClientPoolConfig()
+        self._http_client: Optional["httpx.AsyncClient"] = None
+        self._provider: Optional["OpenAIProvider"] = None
+        self._models: Dict[str, "OpenAIModel"] = {}
+    
+    @property
+    def in_use(self) -> bool:
+        """Whether any client has been created from this registry"""
+        return self._http_client is not None
+    
+    def _get_provider(self) -> "OpenAIProvider":
+        """Get the shared provider, creating the pooled HTTP client if needed"""
+        if self._provider is None:
+            api_key = get_api_key()
+            if not api_key:
+                raise ValueError("OPENROUTER_API_KEY environment variable is not set")
+            
+            import httpx
+            from pydantic_ai.providers.openai import OpenAIProvider
+            
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.config.max_connections,
+                    max_keepalive_connections=self.config.max_keepalive_connections,
+                    keepalive_expiry=self.config.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.config.timeout, connect=self.config.connect_timeout),
+                # Rate limit headers of successful responses let the scheduler slow down before a 429
+                event_hooks={"response": [observe_response]},
+            )
+            # Retries are left to the LLM scheduler, which shares rate limit pauses across calls
+            from openai import AsyncOpenAI
+            self._provider = OpenAIProvider(
+                openai_client=AsyncOpenAI(
+                    base_url=self.config.base_url,
+                    api_key=api_key,
+                    http_client=self._http_client,
+                    max_retries=0,
+                )
+            )
+            logger.info(f"Created shared LLM HTTP pool (max_connections={self.config.max_connections})")
+        return self._provider
+    
+    def get_model(self, model_name: str) -> "OpenAIModel":
+        """
+        Get the shared model for a model name.
+        
+        Args:
+            model_name: The model identifier to use with OpenRouter
+            
+        Returns:
+            An OpenAIModel bound to the shared connection pool
+        """
+        model = self._models.get(model_name) or self._models.get(ANY_MODEL)
+        if model is None:
+            from pydantic_ai.models.openai import OpenAIModel
+            model = OpenAIModel(model_name, provider=self._get_provider())
+            self._models[model_name] = model
+        return model
+    
+    def register_model(self, model_name: str, model: "Model") -> None:
+        """
+        Serve a model name with a given model instead of an OpenRouter client,
+        e.g. a local fake model for benchmarks. Applies to LLMInterfaces created afterwards.
+        
+        Args:
+            model_name: The model identifier to replace, or ANY_MODEL for every model without its own entry
+            model: The pydantic_ai model to use for it
+        """
+        self._models[model_name] = model
+    
+    async def aclose(self) -> None:
+        """Close the shared HTTP client and forget all cached models"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._http_client = None
+        self._provider = None
+        self._models = {}
+
+
+_client_registry: Optional[LLMClientRegistry] = None
+
+
+def get_client_registry() -> LLMClientRegistry:
+    """Get the process-wide LLM client registry"""
+    global _client_registry
+    if _client_registry is None:
+        _client_registry = LLMClientRegistry()
+    return _client_registry
+
+
+def configure_client_registry(config: ClientPoolConfig) -> LLMClientRegistry:
+    """
+    Apply connection pool settings to the process-wide registry.
+    Settings can only change before the first client is created; later
+    calls with different settings keep the existing pool.
+    
+    Args:
+        config: The connection pool settings to apply
+        
+    Returns:
+        The process-wide registry
+    """
+    registry = get_client_registry()
+    if registry.config == config:
+        return registry
+    if registry.in_use:
+        logger.warning("LLM client pool is already in use, ignoring new pool settings")
+        return registry
+    registry.config = config
+    return registry
+
+
 class LLMInterface(Generic[T]):
     """
     Interface for interacting with LLMs using pydantic_ai Agent.
     Supports variable prompts and structured output.
+    Calls go to the first model of the task's route and fall back to the
+    next ones when a model fails or exceeds the route's latency SLO.
     """
     
-    def __init__(self,result_type : type[T], model_name: str = "meta-llama/llama-3.3-70b-instruct"):
+    def __init__(self,result_type : type[T], model_name: Optional[str] = None, registry: Optional[LLMClientRegistry] = None,
+                 cache: Optional[ResponseCache] = None, scheduler: Optional[LLMScheduler] = None, lane: Optional[str] = None,
+                 task: str = "generation", fallback_models: Sequence[str] = (), latency_slo: Optional[float] = None):
         """
         Initialize the LLM interface with the specified model.
         
         Args:
-            model_name: The model identifier to use with OpenRouter
+            model_name: The model identifier to use with OpenRouter, defaults to the configured route of the task
+            registry: Client registry to borrow the model from, defaults to the process-wide registry
+            cache: Response cache, defaults to the process-wide cache (disabled unless configured)
+            scheduler: Scheduler admitting and retrying the calls, defaults to the process-wide scheduler
+            lane: Default priority lane of the calls, defaults to the task
+            task: The task of the calls, "analysis" or "generation", selecting the model route
+            fallback_models: Models to fall back to after an explicit model_name
+            latency_slo: Seconds a model may take before falling back, with an explicit model_name
+        """
+        self.registry = registry or get_client_registry()
+        self.result_type = result_type
+        self.routing = get_model_routing()
+        if model_name is None:
+            self.route = self.routing.route(task)
+        else:
+            self.route = ModelRoute(task, (model_name, *fallback_models), latency_slo)
+        self.model_name = self.route.primary
+        self.cache = cache if cache is not None else get_response_cache()
+        self.scheduler = scheduler or get_scheduler()
+        self.lane = lane or task
+        self._agents: Dict[str, "Agent"] = {}
+        self.agent = self._get_agent(self.model_name)
+    
+    def _get_agent(self, model_name: str) -> "Agent":
+        """Get the agent of a model of the route, creating it on first use"""
+        agent = self._agents.get(model_name)
+        if agent is None:
+            from pydantic_ai import Agent
+            agent = Agent(self.registry.get_model(model_name), result_type=self.result_type)
+            self._agents[model_name] = agent
+        return agent
+    
+    def _model_deadline(self, index: int, deadline: Optional[float]) -> Optional[float]:
+        """Deadline of the model at a position of the route: the call deadline, capped by the SLO except for the last model"""
+        slo = self.route.latency_slo
+        if slo is None or index == len(self.route.models) - 1:
+            return deadline
+        if deadline is None:
+            deadline = self.scheduler.config.deadline
+        return slo if deadline is None else min(slo, deadline)
+    
+    def _fall_back(self, model_name: str, error: Exception) -> None:
         """
-        if not api_key:
-            raise ValueError("OPENROUTER_API_KEY environment variable is not set")
+        Record that a model of the route gave up on a call and the next model takes over.
         
-        model = OpenAIModel(
-            model_name,
-            provider=OpenAIProvider(
-                base_url='https://openrouter.ai/api/v1',
-                api_key=api_key,
-            ),
-        )
-        self.agent = Agent(model,result_type=result_type)
+        Args:
+            model_name: The model that failed or missed the latency SLO
+            error: The exception that ended its attempts, LLMDeadlineExceeded for an SLO breach
+        """
+        reason = "slo" if isinstance(error, LLMDeadlineExceeded) else "error"
+        record_llm_fallback(self.route.task, model_name, reason)
+        logger.warning(f"Falling back from {model_name} for {self.route.task} ({reason}): {str(error)}")
+    
+    def _format_prompt(self, prompt_template: str, variables: Optional[Dict[str, Any]]) -> str:
+        """Format the prompt template with the provided variables, if any"""
+        if variables is not None:
+            return prompt_template.format(**variables)
+        return prompt_template
+    
+    @staticmethod
+    def _split_cache_prefix(prompt: str, cache_prefix: Optional[str]) -> tuple[str, Optional[List["ModelMessage"]]]:
+        """
+        Move a static prompt prefix into its own system message.
+        
+        Providers with automatic prompt caching cache on the exact leading
+        messages, so keeping the static part in a separate, byte-identical
+        message lets every turn reuse it.
         
+        Args:
+            prompt: The formatted prompt
+            cache_prefix: Static leading part of the prompt, if any
+            
+        Returns:
+            The remaining user prompt and the message history carrying the prefix
+        """
+        if not cache_prefix or not prompt.startswith(cache_prefix) or len(cache_prefix) == len(prompt):
+            return prompt, None
+        from pydantic_ai.messages import ModelRequest, SystemPromptPart
+        return prompt[len(cache_prefix):], [ModelRequest(parts=[SystemPromptPart(content=cache_prefix)])]
+    
+    async def _cached(self, key: Optional[str]) -> Optional[T]:
+        """Get a cached output for a key, or None on a miss or an output that no longer validates"""
+        if key is None:
+            return None
+        value = await self.cache.aget(key)
+        if value is None:
+            return None
+        try:
+            return self.result_type.model_validate(value)
+        except ValidationError:
+            logger.warning("Ignoring a cached LLM response that does not match the output model")
+            return None
+    
+    async def _store(self, key: Optional[str], output: BaseModel) -> None:
+        if key is not None:
+            await self.cache.aset(key, output.model_dump(mode="json"))
+    
+    def _record_usage(self, model_name: str, usage: "Usage", seconds: float) -> None:
+        """Record the latency, token counts, retries and cost of a finished call in the metrics"""
+        prompt_tokens, response_tokens = usage.request_tokens or 0, usage.response_tokens or 0
+        record_llm_usage(model_name, prompt_tokens, response_tokens, usage.requests, seconds,
+                         self.routing.cost(model_name, prompt_tokens, response_tokens))
+    
+    def _cache_key(self, formatted_prompt: str, use_cache: bool) -> Optional[str]:
+        # Keyed on the primary model: only its responses are stored, never those of a fallback
+        if self.cache is None or not use_cache:
+            return None
+        return cache_key(self.model_name, self.result_type, formatted_prompt)
     
-    async def generate_response(self, prompt_template: str, variables: Dict[str, Any]) -> T:
+    async def generate_response(self, prompt_template: str, variables: Dict[str, Any], cache_prefix: Optional[str] = None, use_cache: bool = True,
+                                lane: Optional[str] = None, deadline: Optional[float] = None) -> T:
         """
         Generate a structured response from the LLM based on a prompt template with variables.
         
+        The request waits for a slot of the scheduler and transient failures
+        such as rate limits and timeouts are retried until the deadline.
+        
         Args:
             prompt_template: The prompt template with placeholders for variables
             variables: Dictionary of variables to substitute in the prompt template
-            output_class: The Pydantic model class to structure the output
+            cache_prefix: Static leading part of the formatted prompt to send as a cacheable system message
+            use_cache: Whether to use the response cache for this call, if there is one
+            lane: Priority lane of the call, defaults to the lane of this interface
+            deadline: Seconds the call may take including queueing and retries, defaults to the scheduler deadline
             
         Returns:
             An instance of the specified output_class containing the structured response
         """
-        if variables is not None:
-            # Format the prompt template with the provided variables
-            formatted_prompt = prompt_template.format(**variables)
-        else:
-            formatted_prompt = prompt_template
+        formatted_prompt = self._format_prompt(prompt_template, variables)
+        key = self._cache_key(formatted_prompt, use_cache)
+        cached = await self._cached(key)
+        if cached is not None:
+            logger.debug("Using cached LLM response")
+            return CachedResult(cached)
         
-        # Use the agent to generate a structured response
+        user_prompt, message_history = self._split_cache_prefix(formatted_prompt, cache_prefix)
+        
+        # Use the agent to generate a structured response, trying the models of the route in order
         try:
-            response = await self.agent.run(
-                formatted_prompt
-            )
-            return response
+            for index, model_name in enumerate(self.route.models):
+                agent = self._get_agent(model_name)
+                started = time.perf_counter()
+                try:
+                    response = await self.scheduler.run(
+                        model_name,
+                        lambda: agent.run(user_prompt, message_history=message_history),
+                        lane=lane or self.lane,
+                        deadline=self._model_deadline(index, deadline)
+                    )
+                except Exception as e:
+                    if index == len(self.route.models) - 1:
+                        raise
+                    self._fall_back(model_name, e)
+                    continue
+                self._record_usage(model_name, response.usage(), time.perf_counter() - started)
+                if index == 0:
+                    await self._store(key, response.data)
+                return response
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
             raise
+    
+    async def stream_response(self, prompt_template: str, variables: Optional[Dict[str, Any]], cache_prefix: Optional[str] = None,
+                              use_cache: bool = True, lane: Optional[str] = None, deadline: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the structured response as it is generated.
+        
+        Each item is the output parsed so far as a plain dictionary. Strings that
+        are still being generated are left out, so every string value present is
+        complete. The last item holds the full output, which callers validate
+        against the result type. The stream holds a scheduler slot while it is
+        open; a failure is only retried before the first item was yielded.
+        
+        Args:
+            prompt_template: The prompt template with placeholders for variables
+            variables: Dictionary of variables to substitute in the prompt template
+            cache_prefix: Static leading part of the formatted prompt to send as a cacheable system message
+            use_cache: Whether to use the response cache for this call, if there is one
+            lane: Priority lane of the call, defaults to the lane of this interface
+            deadline: Seconds the call may wait and retry before streaming, defaults to the scheduler deadline.
+                The latency SLO of the route bounds the same wait, not the streaming itself
+            
+        Yields:
+            Partially parsed output dictionaries; a cached output is yielded whole
+        """
+        formatted_prompt = self._format_prompt(prompt_template, variables)
+        key = self._cache_key(formatted_prompt, use_cache)
+        cached = await self._cached(key)
+        if cached is not None:
+            logger.debug("Using cached LLM response")
+            yield cached.model_dump()
+            return
+        
+        user_prompt, message_history = self._split_cache_prefix(formatted_prompt, cache_prefix)
+        
+        try:
+            last_args = None
+            for index, model_name in enumerate(self.route.models):
+                agent = self._get_agent(model_name)
+                attempts = self.scheduler.attempts(model_name, self._model_deadline(index, deadline))
+                started = time.perf_counter()
+                try:
+                    while True:
+                        try:
+                            async with self.scheduler.slot(model_name, lane or self.lane, attempts):
+                                async with agent.run_stream(user_prompt, message_history=message_history) as result:
+                                    async for message, _ in result.stream_structured(debounce_by=None):
+                                        args = _tool_call_args(message)
+                                        if args is not None:
+                                            last_args = args
+                                            yield args
+                                    self._record_usage(model_name, result.usage(), time.perf_counter() - started)
+                            break
+                        except LLMDeadlineExceeded:
+                            raise
+                        except Exception as e:
+                            if last_args is not None or not await attempts.backoff(e):
+                                raise
+                    break
+                except Exception as e:
+                    # Once output was streamed, another model cannot take over
+                    if last_args is not None or index == len(self.route.models) - 1:
+                        raise
+                    self._fall_back(model_name, e)
+            # index is the model that answered; a fallback's output is not cached as the primary's
+            if key is not None and last_args is not None and index == 0:
+                try:
+                    await self._store(key, self.result_type.model_validate(last_args))
+                except ValidationError:
+                    pass
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            raise
+
+
+def _tool_call_args(message: Any) -> Optional[Dict[str, Any]]:
+    """Extract the (possibly partial) structured output arguments from a streamed model response"""
+    for part in message.parts:
+        if getattr(part, "part_kind", None) != "tool-call":
+            continue
+        args = part.args
+        # Older pydantic_ai versions wrap the arguments
+        args = getattr(args, "args_json", getattr(args, "args_dict", args))
+        if isinstance(args, str):
+            if not args:
+                return None
+            try:
+                args = from_json(args, allow_partial=True)
+            except ValueError:
+                return None
+        return args if isinstance(args, dict) else None
+    return None
 
 
 # Example usage
 async def example_usage():
-    # Initialize the LLM interface
-    llm = LLMInterface()
+    class Greeting(BaseModel):
+        text: str = Field(description="A one sentence greeting")
+    
+    # Initialize the LLM interface with the model of the generation route
+    llm = LLMInterface(Greeting, task="generation")
+    response = await llm.generate_response("Greet {name} as an old friend arriving for dinner.", {"name": "Alice"})
+    print(response.data.text)
+    
+    # Release the shared connection pool
+    await get_client_registry().aclose()
     
     
 
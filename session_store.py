@@ -0,0 +1,195 @@
+import json
+import os
+import re
+import sqlite3
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Union
+from loguru import logger
+
+# Version of the snapshot layout written by GameEngine.snapshot
+SNAPSHOT_VERSION = 1
+
+# First byte of an encoded snapshot: plain or zlib compressed JSON
+_PLAIN = b"j"
+_COMPRESSED = b"z"
+
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def encode_snapshot(snapshot: Dict[str, Any], compress: bool = True) -> bytes:
+    """
+    Encode a snapshot as compact JSON, optionally zlib compressed.
+
+    Args:
+        snapshot: The snapshot dictionary
+        compress: Whether to compress the JSON
+
+    Returns:
+        The encoded snapshot
+    """
+    data = json.dumps(snapshot, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if compress:
+        return _COMPRESSED + zlib.compress(data)
+    return _PLAIN + data
+
+
+def decode_snapshot(data: Union[bytes, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Decode a snapshot written by encode_snapshot.
+
+    Args:
+        data: The encoded snapshot, or an already decoded dictionary
+
+    Returns:
+        The snapshot dictionary
+
+    Raises:
+        ValueError: If the data is not a snapshot of a supported version
+    """
+    if isinstance(data, dict):
+        snapshot = data
+    else:
+        kind, body = data[:1], data[1:]
+        if kind == _COMPRESSED:
+            body = zlib.decompress(body)
+        elif kind != _PLAIN:
+            raise ValueError("Unknown snapshot encoding")
+        snapshot = json.loads(body)
+    if snapshot.get("v") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {snapshot.get('v')}")
+    return snapshot
+
+
+class SessionStore(ABC):
+    """Storage of encoded session snapshots by session ID"""
+
+    @abstractmethod
+    def save(self, session_id: str, data: bytes) -> None:
+        """Store the snapshot of a session, replacing any previous one"""
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[bytes]:
+        """Get the snapshot of a session, or None if there is none"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """Delete the snapshot of a session, returning whether it existed"""
+
+    @abstractmethod
+    def session_ids(self) -> List[str]:
+        """IDs of all stored sessions"""
+
+    def close(self) -> None:
+        """Release the resources of the store"""
+
+
+class FileSessionStore(SessionStore):
+    """Stores every session snapshot in its own file of a directory"""
+
+    suffix = ".snap"
+
+    def __init__(self, directory: str = "sessions"):
+        """
+        Initialize the store.
+
+        Args:
+            directory: Directory holding the snapshot files, created if missing
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        if not _SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"Invalid session ID: {session_id!r}")
+        return os.path.join(self.directory, session_id + self.suffix)
+
+    def save(self, session_id: str, data: bytes) -> None:
+        path = self._path(session_id)
+        # Write to a temporary file first so a crash never leaves half a snapshot
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def load(self, session_id: str) -> Optional[bytes]:
+        try:
+            with open(self._path(session_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, session_id: str) -> bool:
+        try:
+            os.remove(self._path(session_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def session_ids(self) -> List[str]:
+        return [name[:-len(self.suffix)] for name in os.listdir(self.directory) if name.endswith(self.suffix)]
+
+
+class SQLiteSessionStore(SessionStore):
+    """Stores session snapshots in a SQLite table"""
+
+    def __init__(self, path: str = "sessions.db"):
+        """
+        Initialize the store.
+
+        Args:
+            path: Path of the SQLite database, created if missing
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection.commit()
+
+    def save(self, session_id: str, data: bytes) -> None:
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, data, time.time())
+            )
+
+    def load(self, session_id: str) -> Optional[bytes]:
+        row = self._connection.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def delete(self, session_id: str) -> bool:
+        with self._connection:
+            cursor = self._connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def session_ids(self) -> List[str]:
+        return [row[0] for row in self._connection.execute("SELECT session_id FROM sessions")]
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def build_session_store(kind: Optional[str], path: Optional[str] = None) -> Optional[SessionStore]:
+    """
+    Build a session store by name.
+
+    Args:
+        kind: "file", "sqlite", or None for no store
+        path: Directory of the file store or database of the SQLite store
+
+    Returns:
+        The SessionStore, or None if kind is None
+    """
+    if not kind:
+        return None
+    if kind == "file":
+        store = FileSessionStore(path or "sessions")
+    elif kind == "sqlite":
+        store = SQLiteSessionStore(path or "sessions.db")
+    else:
+        raise ValueError(f"Unknown session store: {kind}")
+    logger.info(f"Using {kind} session store at {path or 'default location'}")
+    return store
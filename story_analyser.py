@@ -0,0 +1,374 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from collections import deque
+import operator
+from loguru import logger
+from character_state import CharacterSchema, build_character_schema, build_user_schema
+from story_state import CompiledCondition, CompiledTransition, StoryState, build_story_state, config_hash
+
+# Fixpoint rounds after which states still changing are widened to their full range
+WIDENING_ROUNDS = 50
+
+
+@dataclass
+class StateRange:
+    """Values a state can take during a playthrough"""
+    min: float
+    max: float
+    low: float
+    high: float
+    # Whether the conversation analysis changes the state, which can then take any value in its bounds
+    analysed: bool
+
+    def include(self, low: float, high: float) -> bool:
+        """Widen the range to include [low, high] within the state bounds, returning whether it changed"""
+        low, high = max(self.min, min(low, self.max)), max(self.min, min(high, self.max))
+        if low >= self.low and high <= self.high:
+            return False
+        self.low, self.high = min(self.low, low), max(self.high, high)
+        return True
+
+
+@dataclass
+class TransitionInfo:
+    """Static facts about one transition of a story node"""
+    index: int
+    target: Optional[str]
+    # Whether the target node exists
+    valid_target: bool
+    # Whether some reachable state values satisfy the conditions
+    satisfiable: bool
+    # Whether the conditions hold for all reachable state values
+    always_true: bool
+    # Index of an earlier always-true transition of the same node that is taken instead
+    shadowed_by: Optional[int] = None
+
+
+@dataclass
+class StoryAnalysis:
+    """Result of the static analysis of a story graph"""
+    config_hash: str
+    start_node: Optional[str]
+    # Targets of every node's transitions, in config order, including unknown targets
+    adjacency: Dict[str, List[Optional[str]]]
+    transitions: Dict[str, List[TransitionInfo]]
+    end_nodes: List[str]
+    reachable_nodes: List[str]
+    unreachable_nodes: List[str]
+    # (node, transition index, target) of transitions pointing to unknown nodes
+    dangling_targets: List[Tuple[str, int, Optional[str]]]
+    # (node, transition index) of transitions whose conditions can never hold
+    dead_transitions: List[Tuple[str, int]]
+    # (node, transition index, index of the earlier always-true transition)
+    shadowed_transitions: List[Tuple[str, int, int]]
+    # Reachable non-end nodes that no transition can leave
+    stuck_nodes: List[str]
+    # Reachable nodes from which no end node can be reached
+    no_ending_nodes: List[str]
+    # States that keep their default value in every playthrough
+    constant_states: List[str]
+    state_ranges: Dict[str, Tuple[float, float]]
+    condition_errors: List[str] = field(default_factory=list)
+
+    @property
+    def errors(self) -> List[str]:
+        """Problems that can leave a session stuck or break a transition"""
+        errors = [f"Malformed condition or effect in {error}" for error in self.condition_errors]
+        errors += [f"Transition {index} of {node_id} points to unknown node {target}" for node_id, index, target in self.dangling_targets]
+        errors += [f"Node {node_id} is reachable but no transition can leave it" for node_id in self.stuck_nodes]
+        errors += [f"No ending can be reached from node {node_id}" for node_id in self.no_ending_nodes if node_id not in self.stuck_nodes]
+        return errors
+
+    @property
+    def warnings(self) -> List[str]:
+        """Problems that make parts of the story dead content"""
+        warnings = [f"Node {node_id} is unreachable" for node_id in self.unreachable_nodes]
+        warnings += [f"Conditions of transition {index} of {node_id} can never hold" for node_id, index in self.dead_transitions]
+        warnings += [f"Transition {index} of {node_id} is shadowed by always-true transition {by}" for node_id, index, by in self.shadowed_transitions]
+        warnings += [f"State {name} never changes" for name in self.constant_states]
+        return warnings
+
+    @property
+    def ok(self) -> bool:
+        """Whether the story has no errors"""
+        return not self.errors
+
+    def report(self) -> str:
+        """Human readable summary of the analysis"""
+        lines = [
+            f"Story {self.config_hash[:12]}: {len(self.adjacency)} nodes, {len(self.reachable_nodes)} reachable from {self.start_node}, "
+            f"{len(self.end_nodes)} endings"
+        ]
+        lines.append(f"\nErrors ({len(self.errors)}):")
+        lines.extend(f"  {error}" for error in self.errors)
+        lines.append(f"\nWarnings ({len(self.warnings)}):")
+        lines.extend(f"  {warning}" for warning in self.warnings)
+        return "\n".join(lines)
+
+
+class StoryAnalyser:
+    """
+    Static analysis of a story graph.
+
+    State values are approximated by intervals: a state the conversation
+    analysis changes can take any value within its min/max, while the others
+    start at their default and only move through transition effects. The
+    intervals over-approximate the values of every playthrough, so a
+    condition that no value in them satisfies can never hold at runtime.
+    """
+
+    def __init__(self, story_state: StoryState, character_schemas: Dict[str, CharacterSchema], user_schema: Optional[CharacterSchema] = None):
+        """
+        Initialize the analyser.
+
+        Args:
+            story_state: The story to analyse, with its transitions compiled
+            character_schemas: Schema of every character, by character ID
+            user_schema: Schema of the user state, or None if the story has no user state
+        """
+        self.story_state = story_state
+        self.nodes = story_state.story_nodes
+        self.ranges: Dict[str, StateRange] = {}
+        entities = dict(character_schemas)
+        if user_schema is not None:
+            entities["user"] = user_schema
+        for entity, schema in entities.items():
+            for position, state_name in enumerate(schema.names):
+                analysed = entity != "user" or state_name not in schema.no_analyse_name
+                low, high = (schema.mins[position], schema.maxs[position]) if analysed else (schema.defaults[position],) * 2
+                self.ranges[f"{entity}.{state_name}"] = StateRange(
+                    schema.mins[position], schema.maxs[position], low, high, analysed
+                )
+
+    def _condition_range(self, condition: CompiledCondition) -> Optional[StateRange]:
+        return self.ranges.get(f"{condition.entity}.{condition.state_name}")
+
+    def _condition_satisfiable(self, condition: CompiledCondition) -> bool:
+        state_range = self._condition_range(condition)
+        if state_range is None:
+            return False
+        low, high, value = state_range.low, state_range.high, condition.value
+        # Check the bounds and the constant itself, which covers every comparison over an interval
+        return any(condition.compare(candidate, value) for candidate in (low, high, value) if low <= candidate <= high)
+
+    def _condition_always_true(self, condition: CompiledCondition) -> bool:
+        state_range = self._condition_range(condition)
+        if state_range is None:
+            return False
+        low, high, value = state_range.low, state_range.high, condition.value
+        if condition.compare(low, value) != condition.compare(high, value):
+            return False
+        # Both bounds agree; a value strictly inside can only differ at the constant itself
+        return condition.compare(low, value) and (not low < value < high or condition.compare(value, value))
+
+    def _satisfiable(self, transition: CompiledTransition) -> bool:
+        return transition.unconditional or any(self._condition_satisfiable(c) for c in transition.conditions)
+
+    def _always_true(self, transition: CompiledTransition) -> bool:
+        return transition.unconditional or any(self._condition_always_true(c) for c in transition.conditions)
+
+    def _narrowed(self, transition: CompiledTransition, name: str, state_range: StateRange) -> Tuple[float, float]:
+        """Range of a state when the transition is taken, narrowed when all its conditions test that state"""
+        names = {f"{c.entity}.{c.state_name}" for c in transition.conditions}
+        if transition.unconditional or names != {name}:
+            return state_range.low, state_range.high
+        bounds = []
+        for condition in transition.conditions:
+            if not self._condition_satisfiable(condition):
+                continue
+            low, high, value = state_range.low, state_range.high, condition.value
+            if condition.compare is operator.eq:
+                low = high = value
+            elif condition.compare in (operator.gt, operator.ge):
+                low = max(low, value)
+            elif condition.compare in (operator.lt, operator.le):
+                high = min(high, value)
+            bounds.append((low, high))
+        return min(low for low, _ in bounds), max(high for _, high in bounds)
+    
+    def _apply_effects(self, transition: CompiledTransition) -> bool:
+        changed = False
+        # Range of each state along the effects of this transition
+        local: Dict[str, Tuple[float, float]] = {}
+        for effect in transition.effects:
+            name = f"{effect.entity}.{effect.state_name}"
+            state_range = self.ranges.get(name)
+            if state_range is None:
+                # A failing effect stops the effects after it
+                break
+            low, high = local.get(name) or self._narrowed(transition, name, state_range)
+            # Effects are monotone in the current value, so the bounds map to the bounds
+            results = (effect.apply_op(low, effect.value), effect.apply_op(high, effect.value))
+            low = max(state_range.min, min(min(results), state_range.max))
+            high = max(state_range.min, min(max(results), state_range.max))
+            local[name] = (low, high)
+            changed |= state_range.include(low, high)
+        return changed
+
+    def _propagate(self, start_node: str) -> List[str]:
+        """Find the reachable nodes and the state ranges together, until neither changes"""
+        reachable = {start_node}
+        rounds = 0
+        changed = True
+        while changed:
+            changed = False
+            rounds += 1
+            for node_id in list(reachable):
+                for transition in self.nodes[node_id].transitions:
+                    if not self._satisfiable(transition):
+                        continue
+                    changed |= self._apply_effects(transition)
+                    if transition.next_node in self.nodes and transition.next_node not in reachable:
+                        reachable.add(transition.next_node)
+                        changed = True
+            if rounds == WIDENING_ROUNDS:
+                # Effects like "/= 2" only converge in the limit
+                for state_range in self.ranges.values():
+                    if (state_range.low, state_range.high) != (state_range.min, state_range.max):
+                        state_range.include(state_range.min, state_range.max)
+        return [node_id for node_id in self.nodes if node_id in reachable]
+
+    def analyse(self, start_node_id: Optional[str] = None, cfg_hash: str = "") -> StoryAnalysis:
+        """
+        Analyse the story graph.
+
+        Args:
+            start_node_id: Node playthroughs start at, defaults to the first node
+            cfg_hash: Hash of the config the story was built from
+
+        Returns:
+            The StoryAnalysis
+        """
+        start_node = start_node_id or next(iter(self.nodes), None)
+        reachable = self._propagate(start_node) if start_node in self.nodes else []
+
+        adjacency, transitions = {}, {}
+        dangling, dead, shadowed = [], [], []
+        for node_id, node in self.nodes.items():
+            adjacency[node_id] = [transition.next_node for transition in node.transitions]
+            infos = []
+            taken_by = None
+            for index, transition in enumerate(node.transitions):
+                info = TransitionInfo(
+                    index=index,
+                    target=transition.next_node,
+                    valid_target=transition.next_node in self.nodes,
+                    satisfiable=self._satisfiable(transition),
+                    always_true=self._always_true(transition),
+                    shadowed_by=taken_by
+                )
+                infos.append(info)
+                if not info.valid_target:
+                    dangling.append((node_id, index, transition.next_node))
+                if taken_by is not None:
+                    shadowed.append((node_id, index, taken_by))
+                elif not info.satisfiable:
+                    dead.append((node_id, index))
+                # An always-true transition to an unknown node does not stop the search
+                if taken_by is None and info.always_true and info.valid_target:
+                    taken_by = index
+            transitions[node_id] = infos
+
+        # Reachability again, now without the transitions that can never be taken
+        if start_node in self.nodes:
+            usable_reach = {start_node}
+            queue = deque([start_node])
+            while queue:
+                for info in transitions[queue.popleft()]:
+                    if info.satisfiable and info.valid_target and info.shadowed_by is None and info.target not in usable_reach:
+                        usable_reach.add(info.target)
+                        queue.append(info.target)
+            reachable = [node_id for node_id in reachable if node_id in usable_reach]
+
+        end_nodes = [node_id for node_id, node in self.nodes.items() if not node.next_state]
+        stuck = [
+            node_id for node_id in reachable
+            if self.nodes[node_id].next_state
+            and not any(info.satisfiable and info.valid_target and info.shadowed_by is None for info in transitions[node_id])
+        ]
+
+        # Walk the usable edges backwards from the endings
+        incoming: Dict[str, List[str]] = {node_id: [] for node_id in self.nodes}
+        for node_id, infos in transitions.items():
+            for info in infos:
+                if info.satisfiable and info.valid_target and info.shadowed_by is None:
+                    incoming[info.target].append(node_id)
+        can_end = set(end_nodes)
+        queue = deque(end_nodes)
+        while queue:
+            for source in incoming[queue.popleft()]:
+                if source not in can_end:
+                    can_end.add(source)
+                    queue.append(source)
+
+        constant = [
+            name for name, state_range in self.ranges.items()
+            if not state_range.analysed and state_range.low == state_range.high
+        ]
+
+        return StoryAnalysis(
+            config_hash=cfg_hash,
+            start_node=start_node,
+            adjacency=adjacency,
+            transitions=transitions,
+            end_nodes=end_nodes,
+            reachable_nodes=reachable,
+            unreachable_nodes=[node_id for node_id in self.nodes if node_id not in reachable],
+            dangling_targets=dangling,
+            dead_transitions=dead,
+            shadowed_transitions=shadowed,
+            stuck_nodes=stuck,
+            no_ending_nodes=[node_id for node_id in reachable if node_id not in can_end],
+            constant_states=constant,
+            state_ranges={name: (state_range.low, state_range.high) for name, state_range in self.ranges.items()},
+            condition_errors=list(self.story_state.config.condition_errors)
+        )
+
+
+# Analyses by config hash and character IDs
+_analysis_cache: Dict[Tuple[str, Tuple[str, ...]], StoryAnalysis] = {}
+
+
+def analyse_story(cfg, character_ids: Optional[List[str]] = None) -> StoryAnalysis:
+    """
+    Analyse the story of a Hydra config, reusing the result for an identical config.
+
+    Args:
+        cfg: The composed Hydra config
+        character_ids: Character IDs of the story, defaults to ["character1", "character2"]
+
+    Returns:
+        The StoryAnalysis of the configured story
+    """
+    character_ids = character_ids or ["character1", "character2"]
+    cfg_hash = config_hash(cfg)
+    key = (cfg_hash, tuple(character_ids))
+    if key not in _analysis_cache:
+        character_schema = build_character_schema(cfg)
+        user_schema = build_user_schema(cfg) if cfg.get("user") else None
+        analyser = StoryAnalyser(
+            build_story_state(cfg),
+            {char_id: character_schema for char_id in character_ids},
+            user_schema
+        )
+        _analysis_cache[key] = analyser.analyse(cfg_hash=cfg_hash)
+        logger.info(f"Analysed story {cfg_hash[:12]}: {len(_analysis_cache[key].errors)} errors, {len(_analysis_cache[key].warnings)} warnings")
+    return _analysis_cache[key]
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from hydra import initialize, compose
+
+    parser = argparse.ArgumentParser(description="Check the configured story graph")
+    parser.add_argument("overrides", nargs="*", help="Hydra overrides, e.g. story=Facade_story")
+    parser.add_argument("--strict", action="store_true", help="Also fail on warnings")
+    args = parser.parse_args()
+
+    with initialize(version_base="1.1", config_path="config"):
+        cfg = compose(config_name="config", overrides=args.overrides)
+
+    analysis = analyse_story(cfg)
+    print(analysis.report())
+    sys.exit(1 if analysis.errors or (args.strict and analysis.warnings) else 0)
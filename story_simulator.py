@@ -0,0 +1,341 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from collections import Counter
+import numpy as np
+from loguru import logger
+from character_state import CharacterSchema, build_character_schema, build_user_schema
+from story_state import StoryState, build_story_state
+
+# A policy returns the state deltas of one turn, shape (runs, columns), for the runs being simulated
+Policy = Callable[[int, np.ndarray, np.random.Generator], np.ndarray]
+
+
+@dataclass
+class SimulatedTransition:
+    """A compiled story transition expressed over simulator columns"""
+    # (column, comparison function, constant), using OR logic
+    conditions: List[Tuple[int, Callable[[Any, Any], Any], int]]
+    # (column, update function, constant), applied in order
+    effects: List[Tuple[int, Callable[[Any, Any], Any], int]]
+    unconditional: bool
+    # Index of the next node, or -1 if the next node does not exist
+    target: int
+
+
+@dataclass
+class SimulationResult:
+    """Aggregated outcome of a batch of simulated playthroughs"""
+    runs: int
+    max_turns: int
+    # Total number of visits of every node
+    node_visits: Dict[str, int]
+    # Number of runs that visited every node at least once
+    node_reach: Dict[str, int]
+    # Number of runs that finished at every end node
+    endings: Dict[str, int]
+    # Number of runs still in progress after max_turns, by current node
+    unfinished: Dict[str, int]
+    # Turns taken by the finished runs, by number of turns
+    turns_to_end: Dict[int, int] = field(default_factory=dict)
+
+    @property
+    def unreachable_nodes(self) -> List[str]:
+        """Nodes that no run visited"""
+        return [node_id for node_id, count in self.node_reach.items() if count == 0]
+
+    def report(self) -> str:
+        """Human readable summary of the simulation"""
+        lines = [f"{self.runs} playthroughs, at most {self.max_turns} turns"]
+        finished = sum(self.endings.values())
+        lines.append(f"\nEndings ({finished} finished):")
+        for node_id, count in sorted(self.endings.items(), key=lambda item: -item[1]):
+            lines.append(f"  {node_id}: {count} ({count / self.runs:.1%})")
+        if self.unfinished:
+            lines.append(f"\nUnfinished after {self.max_turns} turns ({self.runs - finished}):")
+            for node_id, count in sorted(self.unfinished.items(), key=lambda item: -item[1]):
+                lines.append(f"  {node_id}: {count}")
+        if self.turns_to_end:
+            total_turns = sum(turns * count for turns, count in self.turns_to_end.items())
+            lines.append(f"\nAverage turns to an ending: {total_turns / finished:.1f}")
+        lines.append("\nNode reach (share of runs visiting the node):")
+        for node_id, count in self.node_reach.items():
+            lines.append(f"  {node_id}: {count / self.runs:.1%} ({self.node_visits[node_id]} visits)")
+        unreachable = self.unreachable_nodes
+        lines.append(f"\nUnreachable nodes: {', '.join(unreachable) if unreachable else 'none'}")
+        return "\n".join(lines)
+
+
+class RandomPolicy:
+    """Draws independent integer deltas for every analysed state on every turn"""
+
+    def __init__(self, low: int = -10, high: int = 10, change_probability: float = 1.0):
+        """
+        Initialize the policy.
+
+        Args:
+            low: Smallest delta
+            high: Largest delta
+            change_probability: Probability that a state changes at all on a turn
+        """
+        self.low = low
+        self.high = high
+        self.change_probability = change_probability
+
+    def __call__(self, turn: int, values: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        deltas = rng.integers(self.low, self.high, size=values.shape, endpoint=True)
+        if self.change_probability < 1.0:
+            deltas *= rng.random(values.shape) < self.change_probability
+        return deltas
+
+
+class ScriptedPolicy:
+    """Applies the same scripted deltas to every run, one step of the script per turn"""
+
+    def __init__(self, script: List[Dict[str, int]], columns: Dict[str, int], repeat: bool = False):
+        """
+        Initialize the policy.
+
+        Args:
+            script: Deltas of every turn, keyed by "<entity>.<state>" (e.g. "character1.tension")
+            columns: Column of every "<entity>.<state>", see StorySimulator.columns
+            repeat: Whether to start over at the end of the script instead of stopping all changes
+        """
+        self.repeat = repeat
+        self.steps = []
+        for step in script:
+            unknown = [key for key in step if key not in columns]
+            if unknown:
+                raise ValueError(f"Unknown states in script: {unknown}")
+            self.steps.append({columns[key]: delta for key, delta in step.items()})
+
+    def __call__(self, turn: int, values: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        deltas = np.zeros(values.shape, dtype=np.int64)
+        if not self.steps or (turn >= len(self.steps) and not self.repeat):
+            return deltas
+        for column, delta in self.steps[turn % len(self.steps)].items():
+            deltas[:, column] = delta
+        return deltas
+
+
+class StorySimulator:
+    """
+    Runs many playthroughs of a story at once.
+
+    The states of all characters and the user are held in one array of shape
+    (runs, columns). Every turn applies the policy's deltas with the same
+    clamping as CharacterState.update_state, then advances every run with the
+    same rules as StoryState.advance_story, vectorized per story node.
+    """
+
+    def __init__(self, story_state: StoryState, character_schemas: Dict[str, CharacterSchema], user_schema: Optional[CharacterSchema] = None):
+        """
+        Initialize the simulator.
+
+        Args:
+            story_state: The story to simulate, with its transitions compiled
+            character_schemas: Schema of every character, by character ID
+            user_schema: Schema of the user state, or None if the story has no user state
+        """
+        self.story_state = story_state
+        self.node_ids = list(story_state.story_nodes.keys())
+        self.node_index = {node_id: index for index, node_id in enumerate(self.node_ids)}
+
+        # Lay the states of all entities side by side
+        entities = dict(character_schemas)
+        if user_schema is not None:
+            entities["user"] = user_schema
+        self.columns: Dict[str, int] = {}
+        defaults, mins, maxs, analysed = [], [], [], []
+        for entity, schema in entities.items():
+            for position, state_name in enumerate(schema.names):
+                self.columns[f"{entity}.{state_name}"] = len(defaults)
+                defaults.append(schema.defaults[position])
+                mins.append(schema.mins[position])
+                maxs.append(schema.maxs[position])
+                analysed.append(entity != "user" or state_name not in schema.no_analyse_name)
+        self.defaults = np.array(defaults, dtype=float)
+        self.mins = np.array(mins, dtype=float)
+        self.maxs = np.array(maxs, dtype=float)
+        # Columns the conversation analysis can change; the policy only drives these
+        self.analysed = np.array(analysed, dtype=bool)
+
+        self.transitions = [self._compile_node(node_id) for node_id in self.node_ids]
+        self.is_end = np.array([not node.next_state for node in story_state.story_nodes.values()], dtype=bool)
+
+    def _compile_node(self, node_id: str) -> List[SimulatedTransition]:
+        transitions = []
+        for transition in self.story_state.story_nodes[node_id].transitions:
+            # A condition on a missing state never holds, as in CompiledCondition.evaluate
+            conditions = [
+                (self.columns[f"{condition.entity}.{condition.state_name}"], condition.compare, condition.value)
+                for condition in transition.conditions
+                if f"{condition.entity}.{condition.state_name}" in self.columns
+            ]
+            # A failing effect stops the effects after it, as in CompiledTransition.apply_effects
+            effects = []
+            for effect in transition.effects:
+                key = f"{effect.entity}.{effect.state_name}"
+                if key not in self.columns:
+                    break
+                effects.append((self.columns[key], effect.apply_op, effect.value))
+            if transition.next_node not in self.node_index:
+                logger.warning(f"Transition from {node_id} to unknown node {transition.next_node}")
+            transitions.append(SimulatedTransition(
+                conditions=conditions,
+                effects=effects,
+                unconditional=transition.unconditional,
+                target=self.node_index.get(transition.next_node, -1)
+            ))
+        return transitions
+
+    def _apply_deltas(self, values: np.ndarray, deltas: np.ndarray) -> None:
+        np.add(values, np.where(self.analysed, deltas, 0), out=values)
+        np.clip(values, self.mins, self.maxs, out=values)
+
+    def _advance(self, values: np.ndarray, current: np.ndarray, active: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Advance every active run by one story transition.
+
+        Returns:
+            The new node indices, and whether each run took a transition, which
+            a transition back to the same node does too
+        """
+        new_current = current.copy()
+        moved = np.zeros(len(current), dtype=bool)
+        for node, transitions in enumerate(self.transitions):
+            pending = np.flatnonzero(active & (current == node))
+            for transition in transitions:
+                if not len(pending):
+                    break
+                if transition.unconditional:
+                    is_open = np.ones(len(pending), dtype=bool)
+                else:
+                    is_open = np.zeros(len(pending), dtype=bool)
+                    for column, compare, value in transition.conditions:
+                        is_open |= compare(values[pending, column], value)
+                selected = pending[is_open]
+                if not len(selected):
+                    continue
+
+                # Apply effects before transitioning
+                for column, apply_op, value in transition.effects:
+                    updated = apply_op(values[selected, column], value)
+                    values[selected, column] = np.clip(updated, self.mins[column], self.maxs[column])
+
+                # Runs whose next node does not exist keep checking the following transitions
+                if transition.target >= 0:
+                    new_current[selected] = transition.target
+                    moved[selected] = True
+                    pending = pending[~is_open]
+        return new_current, moved
+
+    def _simulate_batch(self, runs: int, max_turns: int, policy: Policy, rng: np.random.Generator, start: int) -> Dict[str, np.ndarray]:
+        values = np.tile(self.defaults, (runs, 1))
+        current = np.full(runs, start)
+        visits = np.zeros(len(self.node_ids), dtype=np.int64)
+        visited = np.zeros((runs, len(self.node_ids)), dtype=bool)
+        finished_at = np.full(runs, -1)
+        visits[start] += runs
+        visited[:, start] = True
+        rows = np.arange(runs)
+
+        for turn in range(max_turns):
+            active = ~self.is_end[current]
+            finished_at[(finished_at < 0) & ~active] = turn
+            if not active.any():
+                break
+            self._apply_deltas(values, policy(turn, values, rng) * active[:, None])
+            new_current, moved = self._advance(values, current, active)
+            visits += np.bincount(new_current[moved], minlength=len(self.node_ids))
+            visited[rows[moved], new_current[moved]] = True
+            current = new_current
+        finished_at[(finished_at < 0) & self.is_end[current]] = max_turns
+
+        return {"current": current, "visits": visits, "reach": visited.sum(axis=0), "finished_at": finished_at}
+
+    def simulate(self, runs: int, max_turns: int = 50, policy: Optional[Policy] = None, seed: Optional[int] = None,
+                 batch_size: int = 100_000, start_node_id: Optional[str] = None) -> SimulationResult:
+        """
+        Simulate playthroughs of the story.
+
+        Args:
+            runs: Number of playthroughs
+            max_turns: Maximum number of turns of a playthrough
+            policy: Policy drawing the state deltas of every turn, defaults to RandomPolicy()
+            seed: Seed of the random generator passed to the policy
+            batch_size: Number of playthroughs simulated at once, bounding memory use
+            start_node_id: Node the playthroughs start at, defaults to the first node
+
+        Returns:
+            The SimulationResult of all playthroughs
+        """
+        policy = policy or RandomPolicy()
+        rng = np.random.default_rng(seed)
+        start = self.node_index[start_node_id] if start_node_id else 0
+
+        visits = np.zeros(len(self.node_ids), dtype=np.int64)
+        reach = np.zeros(len(self.node_ids), dtype=np.int64)
+        endings, unfinished, turns_to_end = Counter(), Counter(), Counter()
+        for batch_start in range(0, runs, batch_size):
+            batch = self._simulate_batch(min(batch_size, runs - batch_start), max_turns, policy, rng, start)
+            visits += batch["visits"]
+            reach += batch["reach"]
+            done = batch["finished_at"] >= 0
+            endings.update(Counter(np.asarray(self.node_ids)[batch["current"][done]].tolist()))
+            unfinished.update(Counter(np.asarray(self.node_ids)[batch["current"][~done]].tolist()))
+            turns_to_end.update(Counter(batch["finished_at"][done].tolist()))
+            logger.debug(f"Simulated {batch_start + len(batch['current'])}/{runs} playthroughs")
+
+        return SimulationResult(
+            runs=runs,
+            max_turns=max_turns,
+            node_visits=dict(zip(self.node_ids, visits.tolist())),
+            node_reach=dict(zip(self.node_ids, reach.tolist())),
+            endings=dict(endings),
+            unfinished=dict(unfinished),
+            turns_to_end=dict(sorted(turns_to_end.items()))
+        )
+
+
+def build_story_simulator(cfg, character_ids: Optional[List[str]] = None) -> StorySimulator:
+    """
+    Build a StorySimulator from the Hydra config.
+
+    Args:
+        cfg: The composed Hydra config
+        character_ids: Character IDs of the story, defaults to ["character1", "character2"]
+
+    Returns:
+        A StorySimulator for the configured story
+    """
+    character_ids = character_ids or ["character1", "character2"]
+    character_schema = build_character_schema(cfg)
+    user_schema = build_user_schema(cfg) if cfg.get("user") else None
+    return StorySimulator(
+        build_story_state(cfg),
+        {char_id: character_schema for char_id in character_ids},
+        user_schema
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from hydra import initialize, compose
+
+    parser = argparse.ArgumentParser(description="Simulate playthroughs of the configured story")
+    parser.add_argument("--runs", type=int, default=100_000)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--low", type=int, default=-10, help="Smallest random delta per turn")
+    parser.add_argument("--high", type=int, default=10, help="Largest random delta per turn")
+    args = parser.parse_args()
+
+    with initialize(version_base="1.1", config_path="config"):
+        cfg = compose(config_name="config")
+
+    simulator = build_story_simulator(cfg)
+    started = time.perf_counter()
+    result = simulator.simulate(args.runs, args.turns, RandomPolicy(args.low, args.high), seed=args.seed)
+    print(result.report())
+    print(f"\nSimulated in {time.perf_counter() - started:.2f}s")
@@ -1,18 +1,225 @@
 from dataclasses import dataclass, field
-from typing import Dict, Optional, List, Any
-from hydra.core.config_store import ConfigStore
-from omegaconf import DictConfig, OmegaConf
-import hydra
+from typing import Callable, Dict, Optional, List, Any, Tuple
+import hashlib
+import json
+import operator
 import re
+import sys
 from loguru import logger
 from character_state import StateRules, StateConfig, CharacterState, build_character_state,build_user_state
 
+def _to_container(value: Any) -> Any:
+    """Convert an OmegaConf config to plain Python objects, leaving other values as they are"""
+    # A config can only exist once omegaconf is imported, so there is no need to import it here
+    omegaconf = sys.modules.get("omegaconf")
+    if omegaconf is not None and isinstance(value, omegaconf.Container):
+        return omegaconf.OmegaConf.to_container(value, resolve=True)
+    return value
+
+# Conditions and effects look like "character1.tension >= 70" or "user.evening_phase += 1"
+CONDITION_PATTERN = re.compile(r'([\w\.]+)\s*([<>=!+-]+)\s*(-?\d+)')
+
+COMPARISON_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+EFFECT_OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    "=": lambda current, value: value,
+    "+=": operator.add,
+    "-=": operator.sub,
+    "*=": operator.mul,
+    "/=": operator.truediv,
+}
+
+def parse_condition(condition_str: str) -> Tuple[str, str, str, int]:
+    """
+    Parse a condition or effect string into entity, variable, operator and value.
+    
+    Args:
+        condition_str: A string like "character1.tension >= 70"
+        
+    Returns:
+        Tuple of entity, variable name, operator and integer value
+        
+    Raises:
+        ValueError: If the string is not of the form "<entity>.<variable> <operator> <integer>"
+    """
+    match = CONDITION_PATTERN.match(str(condition_str))
+    if not match:
+        raise ValueError(f"Failed to parse '{condition_str}'")
+    full_var_name, op, value = match.groups()
+    
+    # Split the variable name into entity and attribute
+    parts = full_var_name.split('.')
+    if len(parts) != 2:
+        raise ValueError(f"Invalid variable format in '{condition_str}'")
+    entity, var_name = parts
+    if entity != "user" and not entity.startswith("character"):
+        raise ValueError(f"Unknown entity {entity} in '{condition_str}'")
+    return entity, var_name, op, int(value)
+
+@dataclass(frozen=True)
+class CompiledCondition:
+    """A condition resolved to an entity, a state, a comparison function and a constant"""
+    source: str
+    entity: str
+    state_name: str
+    compare: Callable[[Any, Any], bool]
+    value: int
+    
+    def evaluate(self, entities: Dict[str, CharacterState]) -> bool:
+        """Evaluate the condition against the states of the story's entities"""
+        state_obj = entities.get(self.entity)
+        if state_obj is None:
+            logger.warning(f"State {self.entity} not available to evaluate condition: {self.source}")
+            return False
+        current_value = state_obj.state_values.get(self.state_name)
+        if current_value is None:
+            logger.error(f"Variable {self.state_name} not found in {self.entity} state")
+            return False
+        return self.compare(current_value, self.value)
+
+@dataclass(frozen=True)
+class CompiledEffect:
+    """An effect resolved to an entity, a state, an update function and a constant"""
+    source: str
+    entity: str
+    state_name: str
+    apply_op: Callable[[Any, Any], Any]
+    value: int
+    
+    def apply(self, entities: Dict[str, CharacterState]) -> bool:
+        """Apply the effect through the state's update_state, which keeps values within bounds"""
+        state_obj = entities.get(self.entity)
+        if state_obj is None:
+            logger.warning(f"State {self.entity} not available to apply effect: {self.source}")
+            return False
+        current_value = state_obj.state_values.get(self.state_name)
+        if current_value is None:
+            logger.error(f"Variable {self.state_name} not found in {self.entity} state")
+            return False
+        new_value = self.apply_op(current_value, self.value)
+        state_obj.update_state(**{self.state_name: new_value - current_value})
+        logger.info(f"Applied effect: {self.source}, new value: {state_obj.state_values[self.state_name]}")
+        return True
+
+@dataclass(frozen=True)
+class CompiledTransition:
+    """A transition of a story node with its conditions and effects compiled"""
+    next_node: Optional[str]
+    # Conditions use OR logic
+    conditions: Tuple[CompiledCondition, ...] = ()
+    effects: Tuple[CompiledEffect, ...] = ()
+    # True when the transition has no conditions at all, not when all of them failed to compile
+    unconditional: bool = True
+    
+    def is_open(self, entities: Dict[str, CharacterState]) -> bool:
+        """Whether the transition can be taken"""
+        if self.unconditional:
+            return True
+        return any(condition.evaluate(entities) for condition in self.conditions)
+    
+    def apply_effects(self, entities: Dict[str, CharacterState]) -> bool:
+        """Apply the effects in order, stopping at the first one that fails"""
+        return all(effect.apply(entities) for effect in self.effects)
+
+def compile_condition(condition_str: str) -> CompiledCondition:
+    """
+    Compile a condition string.
+    
+    Args:
+        condition_str: A condition like "character1.tension >= 70"
+        
+    Returns:
+        The CompiledCondition
+        
+    Raises:
+        ValueError: If the condition is malformed or uses an unsupported operator
+    """
+    entity, var_name, op, value = parse_condition(condition_str)
+    if op not in COMPARISON_OPERATORS:
+        raise ValueError(f"Unsupported operator {op} in condition '{condition_str}'")
+    return CompiledCondition(str(condition_str), entity, var_name, COMPARISON_OPERATORS[op], value)
+
+def compile_effect(effect_str: str) -> CompiledEffect:
+    """
+    Compile an effect string.
+    
+    Args:
+        effect_str: An effect like "user.evening_phase += 1"
+        
+    Returns:
+        The CompiledEffect
+        
+    Raises:
+        ValueError: If the effect is malformed, uses an unsupported operator or divides by zero
+    """
+    entity, var_name, op, value = parse_condition(effect_str)
+    if op not in EFFECT_OPERATORS:
+        raise ValueError(f"Unsupported operator {op} in effect '{effect_str}'")
+    if op == "/=" and value == 0:
+        raise ValueError(f"Division by zero in effect '{effect_str}'")
+    return CompiledEffect(str(effect_str), entity, var_name, EFFECT_OPERATORS[op], value)
+
+def compile_transitions(node_id: str, next_state: List[Dict[str, Any]], errors: Optional[List[str]] = None) -> List[CompiledTransition]:
+    """
+    Compile the transitions of a story node.
+    
+    A malformed condition never holds, as when it was evaluated at runtime, and
+    a malformed effect stops the effects after it. Both are logged here, once.
+    
+    Args:
+        node_id: ID of the node, for error messages
+        next_state: The node's next_state list from the story config
+        errors: Optional list collecting the error messages
+        
+    Returns:
+        List of CompiledTransition objects in config order
+    """
+    def report(message: str) -> None:
+        logger.error(f"Story node {node_id}: {message}")
+        if errors is not None:
+            errors.append(f"{node_id}: {message}")
+    
+    transitions = []
+    for transition in next_state or []:
+        condition_strs = transition.get("condition", []) or []
+        conditions = []
+        for condition_str in condition_strs:
+            try:
+                conditions.append(compile_condition(condition_str))
+            except ValueError as e:
+                report(f"{e}, the condition never holds")
+        
+        effects = []
+        for effect_str in transition.get("effects", []) or []:
+            try:
+                effects.append(compile_effect(effect_str))
+            except ValueError as e:
+                report(f"{e}, skipping it and the effects after it")
+                break
+        
+        transitions.append(CompiledTransition(
+            next_node=transition.get("next_node"),
+            conditions=tuple(conditions),
+            effects=tuple(effects),
+            unconditional=not condition_strs
+        ))
+    return transitions
+
 @dataclass
 class StoryNodeConfig:
     """Configuration for a single story node/state"""
     name: str
     description: str
     next_state: List[Dict[str, Any]] = field(default_factory=list)
+    # next_state compiled by build_story_state, None until compiled
+    transitions: Optional[List[CompiledTransition]] = field(default=None, repr=False, compare=False)
     
     def __str__(self) -> str:
         """String representation of StoryNodeConfig"""
@@ -24,6 +231,17 @@ class StoryStateConfig:
     story_background: str = ""
     character_background: Dict[str, Dict[str, str]] = field(default_factory=dict)
     story_state: Dict[str, StoryNodeConfig] = field(default_factory=dict)
+    # Malformed conditions and effects found when compiling the story nodes
+    condition_errors: List[str] = field(default_factory=list)
+    _fingerprint: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    
+    def fingerprint(self) -> str:
+        """Hash of the static story text (story and character backgrounds), computed once"""
+        if self._fingerprint is None:
+            character_background = _to_container(self.character_background)
+            payload = json.dumps([self.story_background, character_background], sort_keys=True)
+            self._fingerprint = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+        return self._fingerprint
     
     def __str__(self) -> str:
         """String representation of StoryStateConfig"""
@@ -42,14 +260,24 @@ class StoryState:
         self.story_nodes = config.story_state
         self.current_node_id = None
         self.node_history = []
+        # States referenced by conditions and effects, by entity name
+        self.entities: Dict[str, CharacterState] = {}
+        
+        # Nodes built without build_story_state are compiled here
+        for node_id, node in self.story_nodes.items():
+            if node.transitions is None:
+                node.transitions = compile_transitions(node_id, node.next_state, config.condition_errors)
         
     def set_character_state(self, character_name: str, character_state: CharacterState):
         """Set a character state to use for condition evaluation"""
         self.character_states[character_name] = character_state
+        if character_name.startswith("character"):
+            self.entities[character_name] = character_state
         
     def set_user_state(self, user_state: CharacterState):
         """Set the user state to use for condition evaluation"""
         self.user_state = user_state
+        self.entities["user"] = user_state
         
     def start_story(self, start_node_id: str = None):
         """Start the story at the specified node or the first node in the config"""
@@ -76,141 +304,6 @@ class StoryState:
             return self.story_nodes[self.current_node_id]
         return None
     
-    def _parse_condition(self, condition_str: str) -> tuple:
-        """Parse a condition string into entity, variable, operator, and value"""
-        # Match patterns like "character1.tension >= 70" or "user.evening_phase == 1"
-        match = re.match(r'([\w\.]+)\s*([<>=!+-]+)\s*(-?\d+)', condition_str)
-        if match:
-            full_var_name, operator, value = match.groups()
-            
-            # Split the variable name into entity and attribute
-            parts = full_var_name.split('.')
-            if len(parts) == 2:
-                entity, var_name = parts
-                return entity, var_name, operator, int(value)
-            else:
-                logger.error(f"Invalid variable format in condition: {condition_str}")
-                return None, None, None, None
-        return None, None, None, None
-    
-    def _evaluate_condition(self, condition_str: str) -> bool:
-        """Evaluate a single condition string against character or user state"""
-        entity, var_name, operator, value = self._parse_condition(condition_str)
-        
-        if entity is None or var_name is None:
-            logger.error(f"Failed to parse condition: {condition_str}")
-            return False
-        
-        # Determine which state object to use based on the entity prefix
-        state_obj = None
-        if entity == "user":
-            if not self.user_state:
-                logger.warning("No user state available to evaluate condition")
-                return False
-            state_obj = self.user_state
-        elif entity.startswith("character"):
-            if entity not in self.character_states:
-                logger.warning(f"Character state {entity} not available to evaluate condition")
-                return False
-            state_obj = self.character_states[entity]
-        else:
-            logger.error(f"Unknown entity in condition: {entity}")
-            return False
-        
-        # Check if the variable exists in the state
-        if var_name not in state_obj.state_values:
-            logger.error(f"Variable {var_name} not found in {entity} state")
-            return False
-        
-        current_value = state_obj.state_values[var_name]
-        
-        # Evaluate the condition
-        if operator == "==":
-            return current_value == value
-        elif operator == "!=":
-            return current_value != value
-        elif operator == ">":
-            return current_value > value
-        elif operator == ">=":
-            return current_value >= value
-        elif operator == "<":
-            return current_value < value
-        elif operator == "<=":
-            return current_value <= value
-        else:
-            logger.error(f"Unsupported operator: {operator}")
-            return False
-    
-    def _evaluate_conditions(self, conditions: List[str]) -> bool:
-        """Evaluate a list of conditions (using OR logic)"""
-        if not conditions:
-            return True
-        
-        # Use OR logic for multiple conditions
-        return any(self._evaluate_condition(cond) for cond in conditions)
-    
-    def _apply_effect(self, effect_str: str) -> bool:
-        """Apply a single effect to the character or user state"""
-        entity, var_name, operator, value = self._parse_condition(effect_str)
-        
-        if entity is None or var_name is None:
-            logger.error(f"Failed to parse effect: {effect_str}")
-            return False
-        
-        # Determine which state object to use based on the entity prefix
-        state_obj = None
-        if entity == "user":
-            if not self.user_state:
-                logger.warning("No user state available to apply effect")
-                return False
-            state_obj = self.user_state
-        elif entity.startswith("character"):
-            if entity not in self.character_states:
-                logger.warning(f"Character state {entity} not available to apply effect")
-                return False
-            state_obj = self.character_states[entity]
-        else:
-            logger.error(f"Unknown entity in effect: {entity}")
-            return False
-        
-        # Check if the variable exists in the state
-        if var_name not in state_obj.state_values:
-            logger.error(f"Variable {var_name} not found in {entity} state")
-            return False
-        
-        current_value = state_obj.state_values[var_name]
-        
-        # Calculate the new value
-        if operator == "=":
-            new_value = value
-        elif operator == "+=":
-            new_value = current_value + value
-        elif operator == "-=":
-            new_value = current_value - value
-        elif operator == "*=":
-            new_value = current_value * value
-        elif operator == "/=":
-            if value == 0:
-                logger.error("Division by zero in effect")
-                return False
-            new_value = current_value / value
-        else:
-            logger.error(f"Unsupported operator: {operator}")
-            return False
-        
-        # Update the state using its own method to ensure bounds checking
-        update_dict = {var_name: new_value - current_value}  # Convert to delta for update_state
-        state_obj.update_state(**update_dict)
-        logger.info(f"Applied effect: {effect_str}, new value: {state_obj.state_values[var_name]}")
-        return True
-    
-    def _apply_effects(self, effects: List[str]) -> bool:
-        """Apply a list of effects to the character or user state"""
-        if not effects:
-            return True
-        
-        return all(self._apply_effect(effect) for effect in effects)
-    
     def advance_story(self) -> Optional[StoryNodeConfig]:
         """Advance the story to the next node based on conditions"""
         current_node = self.get_current_node()
@@ -224,14 +317,12 @@ class StoryState:
             return current_node
         
         # Check each possible next state
-        for transition in current_node.next_state:
-            conditions = transition.get("condition", [])
-            next_node_id = transition.get("next_node")
-            effects = transition.get("effects", [])
+        for transition in current_node.transitions:
+            next_node_id = transition.next_node
             
-            if self._evaluate_conditions(conditions):
+            if transition.is_open(self.entities):
                 # Apply effects before transitioning
-                self._apply_effects(effects)
+                transition.apply_effects(self.entities)
                 
                 # Transition to the next node
                 if next_node_id in self.story_nodes:
@@ -260,19 +351,36 @@ class StoryState:
         return self.character_background
 
 
-@hydra.main(config_path="config", config_name="config", version_base="1.1")
+def config_hash(cfg) -> str:
+    """
+    Hash the story, character and user sections of a config.
+    
+    Args:
+        cfg: The composed Hydra config
+        
+    Returns:
+        A hex digest that changes whenever the story or its state schemas change
+    """
+    sections = {key: _to_container(cfg[key]) for key in ("story", "character", "user") if key in cfg}
+    payload = json.dumps(sections, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
 def build_story_state(cfg: dict) -> StoryState:
     """Build a StoryState instance from configuration"""
     story_config_dict = cfg.story
     
     # Create StoryNodeConfig instances for each story node
     story_nodes = {}
+    condition_errors = []
     if "story_state" in story_config_dict:
         for node_id, node_data in story_config_dict.story_state.items():
+            next_state = node_data.get("next_state", [])
             node_config = StoryNodeConfig(
                 name=node_data.get("name", ""),
                 description=node_data.get("description", ""),
-                next_state=node_data.get("next_state", [])
+                next_state=next_state,
+                # Compile the conditions and effects once, reporting malformed ones now
+                transitions=compile_transitions(node_id, next_state, condition_errors)
             )
             story_nodes[node_id] = node_config
     
@@ -280,15 +388,17 @@ def build_story_state(cfg: dict) -> StoryState:
     story_state_config = StoryStateConfig(
         story_background=story_config_dict.get("story_background", ""),
         character_background=story_config_dict.get("character_background", {}),
-        story_state=story_nodes
+        story_state=story_nodes,
+        condition_errors=condition_errors
     )
     
     # Create and return the StoryState
     story_state = StoryState(story_state_config)
     logger.info(f"Built StoryState with {len(story_nodes)} nodes")
+    if condition_errors:
+        logger.warning(f"Story config has {len(condition_errors)} malformed conditions or effects")
     return story_state
 
-@hydra.main(config_path="config", config_name="config", version_base="1.1")
 def test_story_state(cfg: dict):
     # Build character states
     character1_state = build_character_state(cfg)
@@ -324,4 +434,5 @@ def test_story_state(cfg: dict):
 
 
 if __name__ == "__main__":
-    test_story_state()
\ No newline at end of file
+    import hydra
+    hydra.main(config_path="config", config_name="config", version_base="1.1")(test_story_state)()
\ No newline at end of file
@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from loguru import logger
+from character_state import CharacterSchema, CharacterState, build_character_schema, build_user_schema
+from story_state import StoryState, StoryStateConfig, build_story_state, config_hash
+from prompt_builder import StaticPromptFragments, get_static_fragments
+
+if TYPE_CHECKING:
+    from omegaconf import DictConfig
+
+
+@dataclass
+class StoryTemplate:
+    """
+    Everything about a story that is the same for all of its sessions: the
+    composed config, the story nodes with their compiled conditions, the
+    character and user schemas and the rendered static prompt fragments.
+    Built once per config; each session only gets fresh mutable state.
+    """
+    cfg: "DictConfig"
+    story_hash: str
+    story_config: StoryStateConfig
+    character_schema: CharacterSchema
+    user_schema: Optional[CharacterSchema]
+    fragments: StaticPromptFragments
+
+    @classmethod
+    def from_config(cls, cfg: "DictConfig") -> "StoryTemplate":
+        """
+        Build the template of the story of a composed Hydra config.
+
+        Args:
+            cfg: The composed Hydra config
+
+        Returns:
+            The StoryTemplate
+        """
+        story_state = build_story_state(cfg)
+        template = cls(
+            cfg=cfg,
+            story_hash=config_hash(cfg),
+            story_config=story_state.config,
+            character_schema=build_character_schema(cfg),
+            user_schema=build_user_schema(cfg) if cfg.get("user") else None,
+            fragments=get_static_fragments(story_state)
+        )
+        logger.info(f"Loaded story template {template.story_hash[:12]} with {len(story_state.story_nodes)} nodes")
+        return template
+
+    def new_story_state(self, character_ids: List[str]) -> StoryState:
+        """
+        Create the mutable state of a new session: a StoryState sharing this
+        template's nodes, with default character and user states.
+
+        Args:
+            character_ids: IDs of the characters of the session
+
+        Returns:
+            A StoryState with its character and user states set
+        """
+        story_state = StoryState(self.story_config)
+        for char_id in character_ids:
+            story_state.set_character_state(char_id, CharacterState(self.character_schema))
+        if self.user_schema is not None:
+            story_state.set_user_state(CharacterState(self.user_schema))
+        return story_state
+
+
+# Templates by Hydra overrides
+_template_cache: Dict[Tuple[str, ...], StoryTemplate] = {}
+
+
+def load_story_template(overrides: Optional[List[str]] = None) -> StoryTemplate:
+    """
+    Compose the Hydra config and build its StoryTemplate, once per set of overrides.
+
+    Args:
+        overrides: Optional Hydra overrides, e.g. ["story=Facade_story"]
+
+    Returns:
+        The StoryTemplate shared by every caller with the same overrides
+    """
+    key = tuple(overrides or ())
+    template = _template_cache.get(key)
+    if template is None:
+        from hydra import initialize, compose
+
+        with initialize(version_base="1.1", config_path="config"):
+            cfg = compose(config_name="config", overrides=list(key))
+        template = StoryTemplate.from_config(cfg)
+        _template_cache[key] = template
+    return template
@@ -0,0 +1,31 @@
+import asyncio
+import os
+import sys
+import pytest
+
+# The game modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm import FakeModelConfig, install_fake_model
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fake_llm():
+    """Serve every model with the local fake model, so no test reaches OpenRouter"""
+    return install_fake_model(FakeModelConfig())
+
+
+@pytest.fixture(scope="session")
+def template():
+    """The default story template, loaded once"""
+    from story_template import load_story_template
+    return load_story_template()
+
+
+@pytest.fixture
+def engine(template):
+    """A started engine of the default story"""
+    from game_engine import GameEngine
+    engine = GameEngine(print_output=False, template=template)
+    asyncio.run(engine.start_story())
+    return engine
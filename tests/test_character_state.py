@@ -0,0 +1,70 @@
+import random
+import pytest
+from loguru import logger
+from character_state import RuleIndex, build_character_state, build_user_state
+
+
+def matching_rule(rules, value):
+    """Rule lookup by scanning every range, as get_rules did before the index"""
+    result = None
+    for rule, prompt in rules.items():
+        low, _, high = str(rule).partition("-")
+        if int(low) <= value <= int(high or low):
+            result = prompt
+    return result
+
+
+@pytest.fixture
+def warnings():
+    messages = []
+    sink = logger.add(messages.append, level="WARNING", format="{message}")
+    yield messages
+    logger.remove(sink)
+
+
+def test_lookup_finds_the_range_of_every_value():
+    rules = {"0-30": "low", "31-60": "mid", "61-99": "high", "100": "max"}
+    index = RuleIndex.from_rules("tension", rules, 0, 100)
+    for value in range(-5, 106):
+        assert index.lookup(value) == matching_rule(rules, value)
+    assert index.lookup(30.5) is None
+    assert index.lookup(45.5) == "mid"
+
+
+def test_unordered_rules_are_sorted():
+    index = RuleIndex.from_rules("tension", {"51-100": "high", "0-50": "low"})
+    assert index.lookup(0) == "low" and index.lookup(51) == "high"
+
+
+def test_overlapping_ranges_are_rejected():
+    with pytest.raises(ValueError, match="overlap"):
+        RuleIndex.from_rules("tension", {"0-30": "low", "30-60": "mid"})
+
+
+@pytest.mark.parametrize("rule", ["a-b", "60-30"])
+def test_malformed_ranges_are_rejected(rule):
+    with pytest.raises(ValueError):
+        RuleIndex.from_rules("tension", {rule: "prompt"})
+
+
+def test_gaps_are_reported_and_have_no_rule(warnings):
+    index = RuleIndex.from_rules("tension", {"10-30": "low", "40-90": "high"}, 0, 100)
+    assert index.lookup(35) is None and index.lookup(5) is None and index.lookup(95) is None
+    assert any("31-39" in message for message in warnings)
+    assert any("0-9" in message for message in warnings)
+    assert any("91-100" in message for message in warnings)
+
+
+@pytest.mark.parametrize("build", [build_character_state, build_user_state])
+def test_get_rules_matches_a_scan_of_the_config(template, build):
+    state = build(template.cfg)
+    rng = random.Random(0)
+    for _ in range(500):
+        name = rng.choice(list(state.state_values))
+        state.update_state(**{name: rng.randint(-30, 30)})
+        expected = {}
+        for state_name, value in state.state_values.items():
+            prompt = matching_rule(state.state_dicts[state_name].rules, value)
+            if prompt is not None:
+                expected[state_name] = prompt
+        assert state.get_rules() == expected
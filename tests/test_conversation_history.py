@@ -0,0 +1,58 @@
+from conversation_history import ConversationHistory
+
+
+def history_of(turns, **bounds):
+    history = ConversationHistory(**bounds)
+    for number in range(turns):
+        history.add_turn([f"Trip: Line {number}."], f"Reply {number}", f"Summary {number}.")
+    return history
+
+
+def test_old_turns_move_into_the_summary():
+    history = history_of(5, max_turns=2, max_summaries=2)
+    assert len(history) == 5
+    assert [turn.user_response for turn in history.turns] == ["Reply 3", "Reply 4"]
+    assert history.summaries == ["Summary 1.", "Summary 2."]
+    assert history.render() == "\n".join([
+        "Earlier: Summary 1. Summary 2.",
+        "Trip: Line 3.", "You: Reply 3",
+        "Trip: Line 4.", "You: Reply 4",
+    ])
+
+
+def test_empty_history_renders_nothing():
+    assert ConversationHistory().render() is None
+    assert ConversationHistory().render(max_tokens=10) is None
+
+
+def test_budget_summarises_the_oldest_turns_first():
+    history = history_of(3, max_turns=3)
+    full = history.render()
+
+    def count_words(text):
+        return len(text.split())
+
+    assert history.render(max_tokens=count_words(full), count_tokens=count_words) == full
+    trimmed = history.render(max_tokens=count_words(full) - 1, count_tokens=count_words)
+    assert trimmed == "\n".join(["Earlier: Summary 0.", "Trip: Line 1.", "You: Reply 1", "Trip: Line 2.", "You: Reply 2"])
+    # Once every turn is summarised, the oldest summaries go
+    assert history.render(max_tokens=3, count_tokens=count_words) == "Earlier: Summary 2."
+    # Rendering within a budget leaves the history itself unchanged
+    assert history.render() == full
+
+
+def test_budget_counts_with_the_given_tokenizer():
+    history = history_of(4, max_turns=4)
+    for budget in (5, 10, 20, 40):
+        text = history.render(max_tokens=budget, count_tokens=lambda text: len(text.split()))
+        assert text is None or len(text.split()) <= budget
+
+
+def test_dict_round_trip():
+    history = history_of(5, max_turns=2, max_summaries=3)
+    restored = ConversationHistory.from_dict(history.to_dict(), max_turns=2, max_summaries=3)
+    assert restored == history
+    assert restored.render() == history.render()
+    restored.add_turn(["Grace: More."], "Reply 5", "Summary 5.")
+    history.add_turn(["Grace: More."], "Reply 5", "Summary 5.")
+    assert restored == history
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+from game_engine import ConversationOutput, GameEngine
+from pydantic_LLM import ANY_MODEL, LLMClientRegistry, LLMInterface
+
+FUSED_DIALOGUE = ["Trip: Fused line.", "Grace: Also fused."]
+GENERATED_DIALOGUE = ["Trip: Generated line.", "Grace: Also generated."]
+
+
+def scripted_llm(result_type, args, calls):
+    """LLM interface answering every request with the same structured output"""
+    def respond(messages, info):
+        calls.append(result_type)
+        return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, args)])
+
+    registry = LLMClientRegistry()
+    registry.register_model(ANY_MODEL, FunctionModel(respond))
+    return LLMInterface(result_type, task="generation", registry=registry)
+
+
+@pytest.fixture
+def engine(template):
+    engine = GameEngine(print_output=False, fused_turn=True, template=template)
+    asyncio.run(engine.start_story())
+    return engine
+
+
+def script_engine(engine, calls):
+    """Serve the fused and the plain conversation requests of the engine with scripted outputs"""
+    analyzer = engine._get_analyzer()
+    analyzer._get_fused_llm(ConversationOutput)
+    fused_args = {
+        "summary": "The guest is warmly welcomed.",
+        "character1_changes": {"tension": {"value": 5, "reasoning": "Scripted"}},
+        "character2_changes": {},
+        "user_changes": {},
+        "dialogue": FUSED_DIALOGUE,
+        "situation_summary": "Fused summary.",
+    }
+    analyzer.fused_llm = scripted_llm(analyzer.FusedTurnOutput, fused_args, calls)
+    engine.llm = scripted_llm(ConversationOutput, {"dialogue": GENERATED_DIALOGUE, "situation_summary": "Generated summary."}, calls)
+    return analyzer
+
+
+def test_fused_output_extends_the_analysis_output(engine):
+    analyzer = script_engine(engine, [])
+    fields = set(analyzer.FusedTurnOutput.model_fields)
+    assert set(analyzer.ConversationAnalysisOutput.model_fields) < fields
+    assert set(ConversationOutput.model_fields) < fields
+
+
+def test_conversation_of_the_fused_response_is_kept_on_the_same_node(engine):
+    calls = []
+    analyzer = script_engine(engine, calls)
+    # The arrival only ends in the first phase of the evening
+    engine.user_state.state_values["evening_phase"] = 2
+    tension = engine.story_state.character_states["character1"].state_values["tension"]
+
+    result = asyncio.run(engine.process_user_input("Hello, both of you."))
+    assert engine.story_state.current_node_id == "arrival"
+    assert engine.current_dialogue == FUSED_DIALOGUE and engine.situation_summary == "Fused summary."
+    assert engine.story_state.character_states["character1"].state_values["tension"] == tension + 5
+    assert result["analysis"]["summary"] == "The guest is warmly welcomed."
+    assert calls == [analyzer.FusedTurnOutput]
+    assert engine.fused_stats == {"accepted": 1, "regenerated": 0}
+
+
+def test_conversation_is_regenerated_when_the_story_advances(engine):
+    calls = []
+    analyzer = script_engine(engine, calls)
+    asyncio.run(engine.process_user_input("Hello, both of you."))
+    assert engine.story_state.current_node_id != "arrival"
+    assert engine.current_dialogue == GENERATED_DIALOGUE
+    assert calls == [analyzer.FusedTurnOutput, ConversationOutput]
+    assert engine.fused_stats == {"accepted": 0, "regenerated": 1}
+
+
+def test_local_prediction_skips_the_fused_request(engine):
+    calls = []
+    analyzer = script_engine(engine, calls)
+    engine.user_state.state_values["evening_phase"] = 2
+    local = analyzer.ConversationAnalysisOutput(summary="Predicted locally", character1_changes={}, character2_changes={}, user_changes={})
+    analyzer.predict_locally = lambda dialogue, user_response: local
+
+    result = asyncio.run(engine.process_user_input("Hello, both of you."))
+    assert result["analysis"]["summary"] == "Predicted locally"
+    assert engine.current_dialogue == GENERATED_DIALOGUE
+    assert calls == [ConversationOutput]
+
+
+def test_incomplete_fused_response_is_retried(engine):
+    calls = []
+    analyzer = script_engine(engine, calls)
+    engine.user_state.state_values["evening_phase"] = 2
+    valid = {"summary": "Retried.", "character1_changes": {}, "character2_changes": {}, "user_changes": {},
+             "dialogue": FUSED_DIALOGUE, "situation_summary": "Fused summary."}
+
+    def respond(messages, info):
+        calls.append("fused")
+        # The first response lacks the conversation and fails validation
+        args = {key: value for key, value in valid.items() if key != "dialogue"} if len(calls) == 1 else valid
+        return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, args)])
+
+    registry = LLMClientRegistry()
+    registry.register_model(ANY_MODEL, FunctionModel(respond))
+    analyzer.fused_llm = LLMInterface(analyzer.FusedTurnOutput, task="generation", registry=registry)
+
+    result = asyncio.run(engine.process_user_input("Hello, both of you."))
+    assert result["analysis"]["summary"] == "Retried."
+    assert calls == ["fused", "fused"] and engine.current_dialogue == FUSED_DIALOGUE
@@ -0,0 +1,25 @@
+import asyncio
+import json
+from game_engine import GameEngine
+
+
+def test_analyzer_is_reused_across_turns(engine):
+    asyncio.run(engine.process_user_input("Hello, both of you."))
+    analyzer = engine.analyzer
+    asyncio.run(engine.process_user_input("How was your trip?"))
+    assert engine.analyzer is analyzer
+
+
+def test_analyzer_is_rebuilt_when_characters_change(template):
+    engine = GameEngine(print_output=False, template=template)
+    analyzer = engine._get_analyzer()
+    engine.story_state.character_states.pop("character2")
+    assert engine._get_analyzer() is not analyzer
+    assert engine.analyzer.matches(engine.story_state)
+
+
+def test_analysis_result_holds_a_snapshot_of_the_states(engine):
+    result = asyncio.run(engine.process_user_input("Hello, both of you."))
+    states = json.loads(json.dumps(result["updated_states"]))
+    asyncio.run(engine.process_user_input("How was your trip?"))
+    assert result["updated_states"] == states
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import pytest
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+from game_engine import ConversationOutput, GameEngine
+from game_server import GameServer, HTTPError, SessionManager
+from pydantic_LLM import ANY_MODEL, LLMClientRegistry, LLMInterface
+from session_store import build_session_store
+
+CHUNKS = ('{"dialogue": ["Trip: Welcome!"', ', "Grace: Come in."', '], "situation_summary": "The evening starts."}')
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = build_session_store("sqlite", str(tmp_path / "sessions.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def manager(template, store):
+    return SessionManager(lambda character_ids=None: GameEngine(character_ids, print_output=False, template=template), store=store)
+
+
+def slow_stream_llm(delay):
+    """LLM interface answering with the conversation of CHUNKS, streamed with a pause before every chunk"""
+    async def respond(messages, info):
+        return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, "".join(CHUNKS))])
+
+    async def stream(messages, info):
+        name = info.result_tools[0].name
+        for index, chunk in enumerate(CHUNKS):
+            await asyncio.sleep(delay)
+            yield {0: DeltaToolCall(name=name if index == 0 else None, json_args=chunk)}
+
+    registry = LLMClientRegistry()
+    registry.register_model(ANY_MODEL, FunctionModel(respond, stream_function=stream))
+    return LLMInterface(ConversationOutput, task="generation", registry=registry)
+
+
+def test_sessions_survive_eviction_and_restore(manager):
+    async def scenario():
+        session = await manager.create_session()
+        await manager.process_input(session.session_id, "Hello, both of you.")
+        view = session.to_dict()
+        assert await manager.evict_session(session.session_id)
+        assert session.session_id not in manager.sessions
+
+        # Concurrent requests restore a single session
+        first, second = await asyncio.gather(manager.get_session(session.session_id), manager.get_session(session.session_id))
+        assert first is second and first.to_dict() == view
+        view = await manager.process_input(session.session_id, "How was your trip?")
+        assert len(view["dialogue"]) > 0
+
+        assert await manager.remove_session(session.session_id)
+        assert await manager.get_session(session.session_id) is None
+        with pytest.raises(HTTPError) as error:
+            await manager.process_input(session.session_id, "Hello?")
+        assert error.value.status == 404
+
+    asyncio.run(scenario())
+
+
+def test_restore_waits_for_a_pending_save(manager):
+    async def scenario():
+        session = await manager.create_session()
+        view = session.to_dict()
+        eviction = asyncio.create_task(manager.evict_session(session.session_id))
+        await asyncio.sleep(0)
+        restored = await manager.get_session(session.session_id)
+        await eviction
+        return view, restored
+
+    view, restored = asyncio.run(scenario())
+    assert restored is not None and restored.to_dict() == view
+
+
+def test_idle_sessions_expire_to_the_store(manager):
+    async def scenario():
+        idle, active = await manager.create_session(), await manager.create_session()
+        idle.last_active -= manager.session_ttl + 1
+        assert await manager.expire_idle() == 1
+        assert list(manager.sessions) == [active.session_id]
+        assert (await manager.get_session(idle.session_id)).to_dict() == idle.to_dict()
+
+    asyncio.run(scenario())
+
+
+def test_sessions_without_a_store_are_dropped(template):
+    async def scenario():
+        manager = SessionManager(lambda character_ids=None: GameEngine(character_ids, print_output=False, template=template))
+        session = await manager.create_session()
+        session.last_active -= manager.session_ttl + 1
+        assert await manager.get_session(session.session_id) is None
+
+    asyncio.run(scenario())
+
+
+def test_unknown_start_nodes_are_rejected(manager):
+    with pytest.raises(HTTPError) as error:
+        asyncio.run(manager.create_session(start_node="nowhere"))
+    assert error.value.status == 400 and not manager.sessions
+
+
+async def request(port, method, path, body=None, headers=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode() if body is not None else b""
+    head = [f"{method} {path} HTTP/1.1", "Connection: close", f"Content-Length: {len(data)}", *(headers or [])]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body) if body else None
+
+
+async def started_server(manager):
+    server = GameServer(manager, port=0)
+    await server.start()
+    return server, server._server.sockets[0].getsockname()[1]
+
+
+async def stop_server(server):
+    server._server.close()
+    await server._server.wait_closed()
+    await server.manager.stop()
+
+
+def test_http_routes(manager):
+    async def scenario():
+        server, port = await started_server(manager)
+        try:
+            status, created = await request(port, "POST", "/sessions", {})
+            assert status == 201
+            session_id = created["session_id"]
+            status, view = await request(port, "POST", f"/sessions/{session_id}/input", {"text": "Hello, both of you."})
+            assert status == 200 and view["session_id"] == session_id
+            assert (await request(port, "GET", f"/sessions/{session_id}"))[1] == view
+            assert (await request(port, "POST", f"/sessions/{session_id}/input", {}))[0] == 400
+            assert (await request(port, "POST", "/sessions", headers=["Content-Length: lots"]))[0] == 400
+            assert (await request(port, "GET", "/health"))[1]["sessions"] == 1
+            assert (await request(port, "DELETE", f"/sessions/{session_id}"))[0] == 204
+            assert (await request(port, "GET", f"/sessions/{session_id}"))[0] == 404
+        finally:
+            await stop_server(server)
+
+    asyncio.run(scenario())
+
+
+def test_streamed_turn_sends_ndjson_events(manager):
+    async def scenario():
+        server, port = await started_server(manager)
+        try:
+            session = await manager.create_session()
+            session.engine.llm = slow_stream_llm(0)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            data = json.dumps({"text": "Hello, both of you."}).encode()
+            writer.write(f"POST /sessions/{session.session_id}/stream HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+            response = await reader.read()
+            writer.close()
+        finally:
+            await stop_server(server)
+        head, _, body = response.partition(b"\r\n\r\n")
+        assert b"application/x-ndjson" in head
+        # Chunked encoding: size lines alternate with the events
+        return [json.loads(line) for line in body.split(b"\r\n")[1::2] if line]
+
+    events = asyncio.run(scenario())
+    assert [event["kind"] for event in events] == ["dialogue", "dialogue", "situation_summary", "session"]
+    assert events[-1]["session"]["dialogue"] == ["Trip: Welcome!", "Grace: Come in."]
+
+
+def test_disconnected_stream_releases_the_session(manager):
+    async def scenario():
+        server, port = await started_server(manager)
+        try:
+            session = await manager.create_session()
+            session.engine.llm = slow_stream_llm(0.05)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            data = json.dumps({"text": "Hello, both of you."}).encode()
+            writer.write(f"POST /sessions/{session.session_id}/stream HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+            # Hang up after the first line
+            await reader.readuntil(b"Trip: Welcome!")
+            writer.close()
+            for _ in range(100):
+                if not session.lock.locked():
+                    break
+                await asyncio.sleep(0.02)
+            assert not session.lock.locked()
+            session.engine.llm = slow_stream_llm(0)
+            view = await manager.process_input(session.session_id, "Sorry, I was gone.")
+            assert view["dialogue"] == ["Trip: Welcome!", "Grace: Come in."]
+        finally:
+            await stop_server(server)
+
+    asyncio.run(scenario())
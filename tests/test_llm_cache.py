@@ -0,0 +1,125 @@
+import asyncio
+import time
+import pytest
+from pydantic import BaseModel
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+import llm_cache
+from llm_cache import (InMemoryLRUCache, ResponseCache, SQLiteResponseCache, build_response_cache, cache_key,
+                       configure_response_cache)
+from llm_scheduler import LLMScheduler, SchedulerConfig
+from pydantic_LLM import LLMClientRegistry, LLMInterface
+
+
+class Answer(BaseModel):
+    text: str
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    cache = build_response_cache({"backend": request.param, "path": str(tmp_path / "cache.db"), "max_entries": 3})
+    yield cache
+    cache.close()
+
+
+def test_hit_and_miss(cache):
+    assert cache.get("a") is None
+    cache.set("a", {"text": "one"})
+    assert cache.get("a") == {"text": "one"}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_expires_entries(cache):
+    cache.set("short", {"text": "one"}, ttl=0.05)
+    cache.set("long", {"text": "two"})
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.get("long") == {"text": "two"}
+
+
+def test_async_access(cache):
+    async def scenario():
+        await cache.aset("a", {"text": "one"})
+        return await cache.aget("a")
+
+    assert asyncio.run(scenario()) == {"text": "one"}
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = InMemoryLRUCache(max_entries=2)
+    cache.set("a", {})
+    cache.set("b", {})
+    cache.get("a")
+    cache.set("c", {})
+    assert cache.get("b") is None and cache.get("a") == {} and len(cache) == 2
+
+
+def test_sqlite_cache_evicts_over_max_entries(tmp_path):
+    cache = SQLiteResponseCache(str(tmp_path / "cache.db"), max_entries=3)
+    for index in range(10):
+        cache.set(str(index), {"index": index})
+    assert cache.evict() == 7
+    assert cache.get("9") == {"index": 9} and cache.get("0") is None
+    cache.close()
+
+
+def test_cache_backends_must_implement_every_method():
+    with pytest.raises(TypeError):
+        ResponseCache()
+
+
+def test_key_ignores_whitespace_but_not_model_or_prompt():
+    assert cache_key("m", Answer, "Hello\r\nthere  \n") == cache_key("m", Answer, "Hello\nthere")
+    assert cache_key("m", Answer, "Hello") != cache_key("other", Answer, "Hello")
+    assert cache_key("m", Answer, "Hello") != cache_key("m", Answer, "Goodbye")
+
+
+def counting_model(calls, name, fail=False):
+    def respond(messages, info):
+        calls.append(name)
+        if fail:
+            raise ModelHTTPError(400, name)
+        return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, {"text": name})])
+
+    return FunctionModel(respond)
+
+
+def interface(calls, cache, primary_fails=False):
+    registry = LLMClientRegistry()
+    registry.register_model("primary", counting_model(calls, "primary", fail=primary_fails))
+    registry.register_model("fallback", counting_model(calls, "fallback"))
+    return LLMInterface(Answer, model_name="primary", fallback_models=("fallback",), registry=registry, cache=cache,
+                        scheduler=LLMScheduler(SchedulerConfig(max_retries=0)))
+
+
+def test_repeated_prompts_are_answered_from_the_cache():
+    calls = []
+    llm = interface(calls, InMemoryLRUCache())
+    first = asyncio.run(llm.generate_response("Hello", None))
+    second = asyncio.run(llm.generate_response("Hello", None))
+    assert second.data == first.data and calls == ["primary"]
+    asyncio.run(llm.generate_response("Hello", None, use_cache=False))
+    assert calls == ["primary", "primary"]
+
+
+def test_fallback_responses_are_not_cached():
+    calls = []
+    cache = InMemoryLRUCache()
+    llm = interface(calls, cache, primary_fails=True)
+    assert asyncio.run(llm.generate_response("Hello", None)).data.text == "fallback"
+    assert len(cache) == 0
+
+
+def test_reconfiguring_keeps_the_previous_cache_usable(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "_response_cache", None)
+    monkeypatch.setattr(llm_cache, "_response_cache_cfg", None)
+    calls = []
+    configure_response_cache({"backend": "sqlite", "path": str(tmp_path / "first.db")})
+    registry = LLMClientRegistry()
+    registry.register_model("primary", counting_model(calls, "primary"))
+    llm = LLMInterface(Answer, model_name="primary", registry=registry)
+    configure_response_cache({"backend": "sqlite", "path": str(tmp_path / "second.db")})
+    asyncio.run(llm.generate_response("Hello", None))
+    asyncio.run(llm.generate_response("Hello", None))
+    assert calls == ["primary"]
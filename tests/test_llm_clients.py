@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from pydantic import BaseModel
+from pydantic_ai.models.function import FunctionModel
+import pydantic_LLM
+from pydantic_LLM import ANY_MODEL, ClientPoolConfig, LLMClientRegistry, LLMInterface
+
+
+class Answer(BaseModel):
+    text: str
+
+
+@pytest.fixture
+def api_key(monkeypatch):
+    monkeypatch.setattr(pydantic_LLM, "_dotenv_loaded", True)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+
+
+def test_pool_settings_are_read_from_the_config():
+    config = ClientPoolConfig.from_config({"base_url": "http://localhost:1234/v1", "pool": {"max_connections": 7}})
+    assert config.base_url == "http://localhost:1234/v1"
+    assert config.max_connections == 7
+    assert config.max_keepalive_connections == ClientPoolConfig.max_keepalive_connections
+    assert ClientPoolConfig.from_config(None) == ClientPoolConfig()
+
+
+def test_models_share_one_connection_pool(api_key):
+    registry = LLMClientRegistry(ClientPoolConfig(max_connections=7))
+    assert not registry.in_use
+    first, second = registry.get_model("first"), registry.get_model("second")
+    assert registry.get_model("first") is first and first is not second
+    assert first.client is second.client
+    assert first.client._client is registry._http_client
+    assert registry._http_client._transport._pool._max_connections == 7
+
+    asyncio.run(registry.aclose())
+    assert registry._http_client is None and not registry.in_use
+    assert registry.get_model("first") is not first
+
+
+def test_interfaces_reuse_the_registry_model(api_key):
+    registry = LLMClientRegistry()
+    llm, other = LLMInterface(Answer, model_name="m", registry=registry), LLMInterface(Answer, model_name="m", registry=registry)
+    assert llm.agent.model is other.agent.model is registry.get_model("m")
+    asyncio.run(registry.aclose())
+
+
+def test_missing_api_key_is_reported(monkeypatch):
+    monkeypatch.setattr(pydantic_LLM, "_dotenv_loaded", True)
+    monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
+    with pytest.raises(ValueError):
+        LLMClientRegistry().get_model("m")
+
+
+def test_registered_models_replace_openrouter_clients():
+    registry = LLMClientRegistry()
+    fallback, own = FunctionModel(lambda messages, info: None), FunctionModel(lambda messages, info: None)
+    registry.register_model(ANY_MODEL, fallback)
+    registry.register_model("own", own)
+    assert registry.get_model("own") is own
+    assert registry.get_model("anything") is fallback
+    assert not registry.in_use
+
+
+def test_pool_settings_are_kept_once_in_use(api_key, monkeypatch):
+    registry = LLMClientRegistry()
+    monkeypatch.setattr(pydantic_LLM, "_client_registry", registry)
+    assert pydantic_LLM.configure_client_registry(ClientPoolConfig(max_connections=7)) is registry
+    assert registry.config.max_connections == 7
+    registry.get_model("m")
+    pydantic_LLM.configure_client_registry(ClientPoolConfig(max_connections=9))
+    assert registry.config.max_connections == 7
+    asyncio.run(registry.aclose())
@@ -0,0 +1,173 @@
+import asyncio
+import time
+import httpx
+import pytest
+from llm_scheduler import (LLMDeadlineExceeded, LLMScheduler, RATE_LIMIT_THROTTLES, SchedulerConfig, TokenBucket,
+                           classify_error, observe_response, rate_limit_quota, retry_after)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = httpx.Response(status_code, headers=headers or {})
+
+
+def scheduler(**settings):
+    return LLMScheduler(SchedulerConfig(backoff_base=0.01, backoff_max=0.05, **settings))
+
+
+def flaky(errors, result="ok"):
+    calls = []
+
+    async def call():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return call, calls
+
+
+def test_errors_are_classified():
+    assert classify_error(StatusError(429)) == "rate_limit"
+    assert classify_error(StatusError(503)) == "status_503"
+    assert classify_error(StatusError(400)) is None
+    assert classify_error(asyncio.TimeoutError()) == "timeout"
+    assert classify_error(ConnectionError()) == "network"
+    assert classify_error(ValueError()) is None
+    try:
+        try:
+            raise StatusError(502)
+        except StatusError as e:
+            raise RuntimeError("wrapped") from e
+    except RuntimeError as wrapped:
+        assert classify_error(wrapped) == "status_502"
+
+
+def test_retry_after_reads_the_response_headers():
+    assert retry_after(StatusError(429, {"retry-after": "2"})) == 2.0
+    assert retry_after(StatusError(429, {"x-ratelimit-reset": str(int((time.time() + 5) * 1000))})) == pytest.approx(5, abs=1)
+    assert retry_after(StatusError(429)) is None
+
+
+def test_transient_errors_are_retried():
+    call, calls = flaky([StatusError(429), StatusError(503)])
+    assert asyncio.run(scheduler().run("m", call)) == "ok"
+    assert len(calls) == 3
+
+
+def test_permanent_errors_are_raised_at_once():
+    call, calls = flaky([StatusError(400)])
+    with pytest.raises(StatusError):
+        asyncio.run(scheduler().run("m", call))
+    assert len(calls) == 1
+
+
+def test_retries_run_out():
+    call, calls = flaky([StatusError(503)] * 5)
+    with pytest.raises(StatusError):
+        asyncio.run(scheduler(max_retries=2).run("m", call))
+    assert len(calls) == 3
+
+
+def test_retry_after_pauses_every_caller_of_the_model():
+    call, calls = flaky([StatusError(429, {"retry-after": "0.2"})])
+    asyncio.run(scheduler().run("m", call))
+    assert calls[1] - calls[0] >= 0.2
+
+
+def test_tokens_do_not_accumulate_during_a_pause():
+    async def scenario():
+        bucket = TokenBucket(rate=10, capacity=10)
+        bucket.pause(0.2)
+        await asyncio.sleep(0.25)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.15
+
+
+def test_slow_calls_exceed_the_deadline():
+    async def call():
+        await asyncio.sleep(1)
+
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        asyncio.run(scheduler().run("m", call, deadline=0.1))
+    assert time.monotonic() - started < 0.5
+
+
+def test_no_retry_past_the_deadline():
+    call, calls = flaky([StatusError(429, {"retry-after": "5"})])
+    with pytest.raises(StatusError):
+        asyncio.run(scheduler().run("m", call, deadline=1))
+    assert len(calls) == 1
+
+
+def test_waiting_for_a_slot_counts_against_the_deadline():
+    async def scenario():
+        sched = scheduler(max_concurrency=1)
+        async with sched.slot("m"):
+            await asyncio.wait_for(sched.run("m", flaky([])[0], deadline=0.1), 2)
+
+    with pytest.raises(LLMDeadlineExceeded):
+        asyncio.run(scenario())
+
+
+def test_lanes_are_served_by_priority():
+    async def scenario():
+        sched = scheduler(max_concurrency=1)
+        order = []
+
+        async def call(lane):
+            async with sched.slot("m", lane):
+                order.append(lane)
+
+        async with sched.slot("m"):
+            tasks = [asyncio.create_task(call(lane)) for lane in ("background", "generation", "analysis")]
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["analysis", "generation", "background"]
+
+
+def test_rate_limit_quota_parses_headers():
+    assert rate_limit_quota({"x-ratelimit-remaining": "3", "x-ratelimit-reset": "2"}) == (3, 2.0)
+    assert rate_limit_quota({"x-ratelimit-remaining": "3"}) is None
+    assert rate_limit_quota({"x-ratelimit-remaining": "many", "x-ratelimit-reset": "2"}) is None
+
+
+def test_low_quota_throttles_the_model():
+    sched = scheduler(burst=5)
+    before = RATE_LIMIT_THROTTLES.get(model="m")
+    sched.observe_quota("m", {"x-ratelimit-remaining": "100", "x-ratelimit-reset": "1"})
+    assert sched.bucket("m").limited_rate is None
+    sched.observe_quota("m", {"x-ratelimit-remaining": "2", "x-ratelimit-reset": "0.4"})
+    assert sched.bucket("m").limited_rate == pytest.approx(5)
+    assert RATE_LIMIT_THROTTLES.get(model="m") == before + 1
+
+    async def acquire(count):
+        started = time.monotonic()
+        for _ in range(count):
+            await sched.bucket("m").acquire()
+        return time.monotonic() - started
+
+    # The two remaining requests go out at once, the next waits for the limited rate
+    assert asyncio.run(acquire(3)) >= 0.15
+
+
+def test_successful_responses_inside_a_slot_feed_the_quota():
+    async def scenario():
+        sched = scheduler(burst=5)
+        response = httpx.Response(200, headers={"x-ratelimit-remaining": "0", "x-ratelimit-reset": "1"})
+        await observe_response(response)
+        assert sched.bucket("m").paused_until == 0
+        async with sched.slot("m"):
+            await observe_response(response)
+        return sched.bucket("m").paused_until - time.monotonic()
+
+    assert asyncio.run(scenario()) > 0.5
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import random
+import pytest
+from conversation_analyse import ConversationAnalyzer
+from local_analyzer import (AnalysisLog, LocalStateClassifier, calibrate_threshold, delta_bin, evaluate,
+                            extract_features, read_analysis_log)
+from metrics import LOCAL_ANALYSES
+
+DIALOGUE = ["Trip: So, how was the drive?", "Grace: Traffic must have been awful."]
+FILLER = ("well", "so", "the", "drive", "evening", "really", "you", "know", "i", "think")
+# Words of the user response and the delta they drive every state by
+KEYWORDS = {"thanks": 5, "wonderful": 5, "insult": -5, "awful": -5, "okay": 0, "sure": 0}
+
+
+def synthetic_records(targets, count, seed=0, noise=0.0):
+    """Turns whose state deltas follow a keyword of the user response, except for a share of random ones"""
+    rng = random.Random(seed)
+    records = []
+    for _ in range(count):
+        keyword = rng.choice(list(KEYWORDS))
+        words = rng.sample(FILLER, 4) + [keyword]
+        rng.shuffle(words)
+        changes = {}
+        delta = KEYWORDS[keyword] if rng.random() >= noise else rng.choice([-5, 0, 5])
+        for entity, state_name in targets:
+            changes.setdefault(entity, {})[state_name] = delta
+        records.append({"dialogue": DIALOGUE, "user_response": " ".join(words), "changes": changes})
+    return records
+
+
+TARGETS = [("character1", "trust"), ("character1", "tension"), ("user", "confidence")]
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return LocalStateClassifier.train(synthetic_records(TARGETS, 300))
+
+
+def test_delta_bins():
+    assert [delta_bin(delta) for delta in (0, 1, 2, 3, 7, 8, 20)] == [0, 1, 1, 2, 2, 3, 3]
+    assert [delta_bin(-delta) for delta in (1, 3, 8)] == [-1, -2, -3]
+
+
+def test_features_keep_the_response_apart_from_the_dialogue():
+    features = extract_features(["Trip: Hello there"], "Hello")
+    assert features == {"u:hello": 1, "d:hello": 1, "d:there": 1}
+
+
+def test_keyword_turns_are_predicted(classifier):
+    held_out = synthetic_records(TARGETS, 100, seed=1)
+    scores = evaluate(classifier, held_out, threshold=0.8)
+    assert scores["coverage"] > 0.9
+    assert scores["exact_accuracy"] == 1.0
+    prediction = classifier.predict(DIALOGUE, "thanks so much, wonderful evening")
+    assert prediction.changes == {"character1": {"trust": 5, "tension": 5}, "user": {"confidence": 5}}
+    assert prediction.confidence > 0.8
+
+
+def test_calibrated_threshold_reaches_the_target_accuracy():
+    classifier = LocalStateClassifier.train(synthetic_records(TARGETS, 400, noise=0.2))
+    held_out = synthetic_records(TARGETS, 400, seed=1, noise=0.2)
+    threshold = calibrate_threshold(classifier, held_out, target_accuracy=0.8)
+    assert threshold is not None
+    scores = evaluate(classifier, held_out, threshold)
+    assert scores["exact_accuracy"] >= 0.8 and scores["coverage"] > 0
+    # No threshold makes predictions of noisy labels that accurate
+    assert calibrate_threshold(classifier, held_out, target_accuracy=0.99) is None
+
+
+def test_threshold_is_saved_with_the_classifier(classifier, tmp_path):
+    path = str(tmp_path / "classifier.json")
+    classifier.threshold = 0.9
+    try:
+        classifier.save(path)
+    finally:
+        classifier.threshold = None
+    assert LocalStateClassifier.load(path).threshold == 0.9
+
+
+def test_unseen_text_is_not_confident(classifier):
+    assert classifier.predict(DIALOGUE, "quantum penguins").confidence < 0.8
+
+
+def test_untrained_targets_have_no_confidence(classifier):
+    assert classifier.predict(DIALOGUE, "thanks", [("character2", "trust")]).confidence == 0.0
+
+
+def test_states_with_few_examples_get_no_classifier():
+    classifier = LocalStateClassifier.train(synthetic_records(TARGETS, 20), min_examples=50)
+    assert not classifier.covers(TARGETS)
+
+
+def test_saved_classifier_predicts_the_same(classifier, tmp_path):
+    path = str(tmp_path / "classifier.json")
+    classifier.save(path)
+    loaded = LocalStateClassifier.load(path)
+    for record in synthetic_records(TARGETS, 50, seed=2):
+        assert loaded.predict(record["dialogue"], record["user_response"]) == classifier.predict(record["dialogue"], record["user_response"])
+
+
+def test_unknown_classifier_versions_are_rejected(classifier, tmp_path):
+    path = tmp_path / "classifier.json"
+    classifier.save(str(path))
+    data = json.loads(path.read_text())
+    data["v"] = 99
+    path.write_text(json.dumps(data))
+    with pytest.raises(ValueError):
+        LocalStateClassifier.load(str(path))
+
+
+def test_analysis_log_round_trip_skips_malformed_lines(tmp_path):
+    path = str(tmp_path / "analyses.jsonl")
+    with AnalysisLog(path) as log:
+        log.write(DIALOGUE, "thanks", {"user": {"confidence": 5}})
+        log._file.write('{"v": 1, "dialogue": [\n')
+        asyncio.run(log.awrite(DIALOGUE, "awful", {"user": {"confidence": -5}}))
+    assert log.closed
+    # Records written after closing are dropped, not raised
+    log.write(DIALOGUE, "late", {})
+    records = list(read_analysis_log(path))
+    assert [record["user_response"] for record in records] == ["thanks", "awful"]
+
+
+def analyzer_targets(story_state):
+    return ConversationAnalyzer(story_state)._local_targets()
+
+
+def test_analyzer_answers_confident_turns_locally(engine, tmp_path):
+    targets = analyzer_targets(engine.story_state)
+    log = AnalysisLog(str(tmp_path / "analyses.jsonl"))
+    classifier = LocalStateClassifier.train(synthetic_records(targets, 300))
+    classifier.threshold = calibrate_threshold(classifier, synthetic_records(targets, 100, seed=1))
+    assert classifier.threshold is not None
+    analyzer = ConversationAnalyzer(engine.story_state, local_classifier=classifier, analysis_log=log)
+    before = LOCAL_ANALYSES.get(outcome="local")
+
+    analysis = asyncio.run(analyzer.analyze_conversation(DIALOGUE, "thanks, what a wonderful evening"))
+    char_id, state_name = targets[0]
+    assert getattr(getattr(analysis, f"{char_id}_changes"), state_name).value == 5
+    assert LOCAL_ANALYSES.get(outcome="local") == before + 1
+
+    # Unfamiliar turns go to the LLM, whose analysis becomes training data
+    asyncio.run(analyzer.analyze_conversation(DIALOGUE, "quantum penguins"))
+    log.close()
+    records = list(read_analysis_log(log.path))
+    assert [record["user_response"] for record in records] == ["quantum penguins"]
+    assert {(entity, state) for entity, states in records[0]["changes"].items() for state in states} == set(targets)
+
+
+def test_uncalibrated_classifiers_are_not_trusted(engine):
+    targets = analyzer_targets(engine.story_state)
+    analyzer = ConversationAnalyzer(engine.story_state, local_classifier=LocalStateClassifier.train(synthetic_records(targets, 300)))
+    assert analyzer.predict_locally(DIALOGUE, "thanks, what a wonderful evening") is None
+    analyzer.confidence_threshold = 0.5
+    assert analyzer.predict_locally(DIALOGUE, "thanks, what a wonderful evening") is not None
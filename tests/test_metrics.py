@@ -0,0 +1,78 @@
+import pytest
+import metrics
+from metrics import MetricsRegistry, PhaseStats, TurnStats, render_metrics, span
+
+
+def test_counter_and_gauge_render_one_line_per_label_set():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests")
+    requests.inc(model="a")
+    requests.inc(2, model="b")
+    requests.inc(0.5, model="a")
+    registry.gauge("sessions", "Sessions").set(3)
+    assert registry.render() == "\n".join([
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{model="a"} 1.5',
+        'requests_total{model="b"} 2',
+        "# HELP sessions Sessions",
+        "# TYPE sessions gauge",
+        "sessions 3",
+    ]) + "\n"
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    seconds = registry.histogram("call_seconds", "Calls", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        seconds.observe(value, model="a")
+    assert registry.render().splitlines()[2:] == [
+        'call_seconds_bucket{model="a",le="0.1"} 2',
+        'call_seconds_bucket{model="a",le="1"} 3',
+        'call_seconds_bucket{model="a",le="+Inf"} 4',
+        'call_seconds_sum{model="a"} 2.65',
+        'call_seconds_count{model="a"} 4',
+    ]
+
+
+def test_labels_are_sorted_and_escaped():
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors").inc(reason='say "hi"\\\n', model="a")
+    assert registry.render().splitlines()[2] == 'errors_total{model="a",reason="say \\"hi\\"\\\\\\n"} 1'
+
+
+def test_metric_names_keep_their_kind():
+    registry = MetricsRegistry()
+    assert registry.counter("calls", "Calls") is registry.counter("calls", "Calls")
+    with pytest.raises(ValueError):
+        registry.gauge("calls", "Calls")
+
+
+def test_spans_are_exported_and_recorded_on_the_session():
+    stats = TurnStats()
+    with span("test_metrics_phase", stats):
+        with span("test_metrics_inner"):
+            metrics.record_llm_usage("test-metrics-model", 10, 5, requests=2, seconds=0.2, cost=0.01)
+    with pytest.raises(RuntimeError):
+        with span("test_metrics_phase", stats):
+            raise RuntimeError("failed")
+
+    assert stats.phases["test_metrics_phase"].count == 2
+    assert stats.phases["test_metrics_inner"].count == 1
+    assert stats.errors == 1 and stats.retries == 1
+    assert stats.to_dict()["models"]["test-metrics-model"]["tokens"] == {"prompt": 10, "response": 5}
+
+    text = render_metrics()
+    assert 'game_phase_duration_seconds_count{phase="test_metrics_phase"} 2' in text
+    assert 'game_phase_errors_total{phase="test_metrics_phase"} 1' in text
+    assert 'game_llm_tokens_total{kind="prompt",model="test-metrics-model"} 10' in text
+    assert 'game_llm_retries_total{model="test-metrics-model",reason="invalid_output"} 1' in text
+
+
+def test_phase_percentiles_use_the_nearest_rank():
+    stats = PhaseStats(sample_size=100)
+    for millis in range(1, 101):
+        stats.add(millis / 1000)
+    summary = stats.to_dict()
+    assert summary["count"] == 100 and summary["p50_ms"] == 50.0 and summary["p99_ms"] == 99.0
+    assert summary["max_ms"] == 100.0 and summary["mean_ms"] == 50.5
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+import pytest
+from pydantic import BaseModel
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+from llm_scheduler import LLMScheduler, SchedulerConfig
+from metrics import LLM_FALLBACKS
+from model_routing import DEFAULT_MODEL_NAME, ModelRoute, RoutingConfig
+from pydantic_LLM import LLMClientRegistry, LLMInterface
+
+
+class Answer(BaseModel):
+    text: str
+
+
+def scripted_model(calls, name, fail=False, delay=0.0):
+    """Model answering with its own name, after a delay, or failing with a permanent error"""
+    async def respond(messages, info):
+        calls.append(name)
+        await asyncio.sleep(delay)
+        if fail:
+            raise ModelHTTPError(400, name)
+        return ModelResponse(parts=[ToolCallPart(info.result_tools[0].name, {"text": name})])
+
+    async def stream(messages, info):
+        calls.append(name)
+        await asyncio.sleep(delay)
+        if fail:
+            raise ModelHTTPError(400, name)
+        yield {0: DeltaToolCall(name=info.result_tools[0].name, json_args=json.dumps({"text": name}))}
+
+    return FunctionModel(respond, stream_function=stream)
+
+
+def interface(calls, models, latency_slo=None, task="generation", **scheduler_settings):
+    registry = LLMClientRegistry()
+    for name, settings in models.items():
+        registry.register_model(name, scripted_model(calls, name, **settings))
+    primary, *fallbacks = models
+    return LLMInterface(Answer, model_name=primary, fallback_models=fallbacks, latency_slo=latency_slo, task=task,
+                        registry=registry, cache=None, scheduler=LLMScheduler(SchedulerConfig(max_retries=0, **scheduler_settings)))
+
+
+def generate(llm):
+    return asyncio.run(llm.generate_response("Hello", None, use_cache=False)).data.text
+
+
+def stream(llm):
+    async def collect():
+        return [item async for item in llm.stream_response("Hello", None, use_cache=False)]
+
+    return asyncio.run(collect())[-1]["text"]
+
+
+def test_routes_are_read_from_the_config():
+    routing = RoutingConfig.from_config({
+        "routes": {"analysis": {"models": ["small", "large"], "latency_slo": 2.5}, "generation": {"models": "large"}},
+        "prices": {"large": {"prompt": 1.0, "response": 2.0}},
+    })
+    assert routing.route("analysis") == ModelRoute("analysis", ("small", "large"), 2.5)
+    assert routing.route("generation").models == ("large",)
+    assert routing.route("unknown").models == (DEFAULT_MODEL_NAME,)
+    assert routing.models() == ["large", "small"]
+    assert routing.cost("large", 1_000_000, 500_000) == 2.0
+    assert routing.cost("small", 1_000_000, 500_000) == 0.0
+
+
+def test_primary_answers_when_healthy():
+    calls = []
+    assert generate(interface(calls, {"primary": {}, "fallback": {}})) == "primary"
+    assert calls == ["primary"]
+
+
+@pytest.mark.parametrize("call", [generate, stream])
+def test_failed_primary_falls_back(call):
+    calls = []
+    before = LLM_FALLBACKS.get(task="analysis", model="primary", reason="error")
+    assert call(interface(calls, {"primary": {"fail": True}, "fallback": {}}, task="analysis")) == "fallback"
+    assert calls == ["primary", "fallback"]
+    assert LLM_FALLBACKS.get(task="analysis", model="primary", reason="error") == before + 1
+
+
+def test_slow_primary_falls_back_at_the_slo():
+    calls = []
+    before = LLM_FALLBACKS.get(task="analysis", model="primary", reason="slo")
+    started = time.monotonic()
+    llm = interface(calls, {"primary": {"delay": 5}, "fallback": {}}, latency_slo=0.1, task="analysis")
+    assert generate(llm) == "fallback"
+    assert time.monotonic() - started < 1
+    assert LLM_FALLBACKS.get(task="analysis", model="primary", reason="slo") == before + 1
+
+
+def test_scheduler_deadline_applies_below_a_longer_slo():
+    calls = []
+    started = time.monotonic()
+    llm = interface(calls, {"primary": {"delay": 5}, "fallback": {}}, latency_slo=5, deadline=0.1)
+    assert generate(llm) == "fallback"
+    assert time.monotonic() - started < 1
+
+
+def test_stream_falls_back_when_the_primary_queues_past_the_slo():
+    calls = []
+    llm = interface(calls, {"primary": {}, "fallback": {}}, latency_slo=0.1, max_concurrency_per_model=1)
+
+    async def collect():
+        # Another call holds the only slot of the primary
+        async with llm.scheduler.slot("primary"):
+            return [item async for item in llm.stream_response("Hello", None, use_cache=False)]
+
+    assert asyncio.run(collect())[-1]["text"] == "fallback"
+    assert calls == ["fallback"]
+
+
+def test_last_model_is_not_cut_off_by_the_slo():
+    calls = []
+    assert generate(interface(calls, {"only": {"delay": 0.2}}, latency_slo=0.05)) == "only"
+
+
+def test_errors_of_the_last_model_are_raised():
+    calls = []
+    with pytest.raises(ModelHTTPError):
+        generate(interface(calls, {"primary": {"fail": True}, "fallback": {"fail": True}}))
+    assert calls == ["primary", "fallback"]
@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from pydantic_ai.exceptions import ModelHTTPError
+from game_engine import GameEngine
+from opening_pool import OpeningPool
+
+
+@pytest.fixture
+def pool(template):
+    return OpeningPool(engine_factory=lambda: GameEngine(print_output=False, template=template), size=2,
+                       retry_delay=0.01, max_retry_delay=0.04)
+
+
+def failing_generation(pool, errors, sleeps):
+    """Make the pool's first generations raise errors and record the retry delays"""
+    generate = pool.engine.generate_opening
+    calls = []
+
+    async def generate_opening(start_node):
+        calls.append(start_node)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return await generate(start_node)
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    pool.engine.generate_opening = generate_opening
+    return calls, sleep
+
+
+async def filled(pool, start_node="arrival"):
+    for _ in range(200):
+        if pool.stats()["ready"][start_node] == pool.size:
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+def test_taken_openings_are_replaced(pool):
+    async def scenario():
+        assert pool.take("arrival") is None
+        pool.start()
+        assert await filled(pool)
+        opening = pool.take("arrival", pool.engine.story_hash)
+        assert opening is not None and opening.dialogue
+        assert await filled(pool)
+        await pool.stop()
+
+    asyncio.run(scenario())
+    assert (pool.hits, pool.misses) == (1, 1)
+
+
+def test_openings_of_another_story_are_not_handed_out(pool):
+    async def scenario():
+        pool.start()
+        assert await filled(pool)
+        assert pool.take("arrival", "another story") is None
+        await pool.stop()
+
+    asyncio.run(scenario())
+    assert pool.stats()["ready"]["arrival"] == pool.size
+
+
+def test_sessions_start_from_a_pooled_opening(template):
+    from game_server import SessionManager
+
+    def engine_factory(character_ids=None):
+        return GameEngine(character_ids, print_output=False, template=template)
+
+    async def scenario():
+        pool = OpeningPool(engine_factory=engine_factory, size=1)
+        manager = SessionManager(engine_factory, opening_pool=pool)
+        pool.start()
+        assert await filled(pool)
+        ready = pool.openings[(template.story_hash, "arrival")][0]
+        session = await manager.create_session()
+        await manager.stop()
+        return ready, session
+
+    ready, session = asyncio.run(scenario())
+    assert session.engine.current_dialogue == ready.dialogue
+
+
+def test_transient_errors_are_retried_with_backoff(pool, monkeypatch):
+    sleeps = []
+    calls, sleep = failing_generation(pool, [ModelHTTPError(503, "m")] * 4, sleeps)
+    monkeypatch.setattr("opening_pool.asyncio.sleep", sleep)
+    pool.size = 1
+
+    async def scenario():
+        pool.start()
+        await asyncio.gather(*pool._tasks)
+
+    asyncio.run(scenario())
+    assert sleeps == [0.01, 0.02, 0.04, 0.04]
+    assert len(calls) == 5 and pool.stats()["ready"]["arrival"] == 1 and pool.error is None
+
+
+def test_permanent_errors_stop_the_pool(pool):
+    sleeps = []
+    calls, _ = failing_generation(pool, [ModelHTTPError(401, "m")] * 10, sleeps)
+
+    async def scenario():
+        pool.start()
+        await asyncio.gather(*pool._tasks)
+        assert pool.take("arrival") is None
+        assert not pool._tasks
+        await pool.stop()
+
+    asyncio.run(scenario())
+    # Both openings of the pool were started before the first failure
+    assert len(calls) <= pool.size and not sleeps
+    assert pool.stats()["error"] is not None and pool.stats()["ready"]["arrival"] == 0
@@ -0,0 +1,97 @@
+import pytest
+from prompt_assembler import (
+    PromptAssembler, PromptSection, build_prompt_assembler, estimate_tokens, get_tokenizer, truncate_text
+)
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def words(count, word="word"):
+    return " ".join([word] * count)
+
+
+def sections():
+    return [
+        PromptSection("instructions", words(10, "rule"), header="Rules:\n", footer="\n"),
+        PromptSection("background", words(40, "lore"), priority=1, footer="\n"),
+        PromptSection("history", words(40, "said"), priority=2, keep_end=True, footer="\n"),
+        PromptSection("dialogue", words(20, "line"), priority=2),
+    ]
+
+
+def test_prompt_within_budget_is_not_trimmed():
+    prompt = PromptAssembler(max_tokens=1000, tokenizer=count_words).assemble(sections())
+    assert prompt.trimmed == [] and not prompt.over_budget
+    assert prompt.text == "".join(section.render() for section in sections())
+    assert prompt.total_tokens == sum(prompt.section_tokens.values())
+
+
+def test_highest_priority_sections_are_trimmed_first():
+    prompt = PromptAssembler(max_tokens=90, tokenizer=count_words).assemble(sections())
+    assert prompt.trimmed == ["history", "dialogue"]
+    assert prompt.total_tokens <= 90 and not prompt.over_budget
+    # Lower priorities and the untrimmable instructions are kept whole
+    assert prompt.section_tokens["background"] == 40
+    assert prompt.section_tokens["instructions"] == 11
+    # Sections of the same priority share the cut in proportion to their size
+    assert prompt.section_tokens["history"] > prompt.section_tokens["dialogue"]
+
+
+def test_trimming_moves_to_the_next_priority_when_needed():
+    prompt = PromptAssembler(max_tokens=30, tokenizer=count_words).assemble(sections())
+    assert prompt.trimmed == ["history", "dialogue", "background"]
+    assert prompt.total_tokens <= 30
+    assert prompt.text.startswith("Rules:\n" + words(10, "rule") + "\n")
+
+
+def test_trimmed_history_keeps_its_end():
+    history = PromptSection("history", " ".join(f"w{number}" for number in range(50)), priority=1, keep_end=True)
+    prompt = PromptAssembler(max_tokens=10, tokenizer=count_words).assemble([history])
+    assert prompt.text.startswith("... ") and prompt.text.endswith("w49")
+
+
+def test_shrink_function_replaces_truncation():
+    budgets = []
+
+    def shrink(max_tokens):
+        budgets.append(max_tokens)
+        return "short"
+
+    section = PromptSection("history", words(50), priority=1, shrink=shrink)
+    prompt = PromptAssembler(max_tokens=20, tokenizer=count_words).assemble([section])
+    assert prompt.text == "short" and budgets == [20]
+
+
+def test_prompt_over_budget_after_trimming_is_reported():
+    fixed = PromptSection("instructions", words(30))
+    prompt = PromptAssembler(max_tokens=10, tokenizer=count_words).assemble([fixed])
+    assert prompt.over_budget and prompt.trimmed == []
+
+
+def test_static_prefix_stops_at_the_first_dynamic_section():
+    prompt = PromptAssembler().assemble([
+        PromptSection("intro", "Intro. ", static=True),
+        PromptSection("background", "Lore. ", static=True),
+        PromptSection("dialogue", "Line. "),
+        PromptSection("outro", "Answer.", static=True),
+    ])
+    assert prompt.static_prefix == "Intro. Lore. "
+    assert prompt.text.startswith(prompt.static_prefix)
+
+
+def test_truncate_text_fits_the_budget():
+    text = words(100)
+    assert truncate_text(text, 1000) == text
+    assert estimate_tokens(truncate_text(text, 20)) <= 20
+    assert truncate_text(text, 5, count_words, keep_end=True) == "... " + words(4)
+
+
+def test_route_budget_is_the_smallest_of_its_models():
+    cfg = {"max_tokens": {"default": 500, "small": 100}}
+    assert build_prompt_assembler(cfg, ["large", "small"]).max_tokens == 100
+    assert build_prompt_assembler(cfg, "large").max_tokens == 500
+    assert build_prompt_assembler(None, "large").max_tokens is None
+    with pytest.raises(ValueError):
+        get_tokenizer("unknown")
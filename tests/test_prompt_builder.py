@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+import prompt_builder
+from prompt_builder import PROMPT_LAYOUT_CACHE_FRIENDLY, STATIC_FRAGMENTS_CACHE_SIZE, get_static_fragments
+from pydantic_LLM import LLMInterface
+
+
+def story_variant(number):
+    """Minimal story state of a story variant with its own background"""
+    config = SimpleNamespace(fingerprint=lambda: f"variant-{number}")
+    return SimpleNamespace(
+        config=config,
+        get_story_background=lambda: f"Story {number}",
+        get_character_background=lambda: {"character1": {"name": "Trip", "background": f"Trip of story {number}"}},
+    )
+
+
+def test_static_fragments_are_shared_by_sessions_of_a_story(template):
+    first, second = template.new_story_state(["character1"]), template.new_story_state(["character1"])
+    assert get_static_fragments(first) is get_static_fragments(second)
+
+
+def test_static_fragments_cache_keeps_the_recent_stories(monkeypatch):
+    monkeypatch.setattr(prompt_builder, "_static_fragments_cache", prompt_builder.OrderedDict())
+    kept = get_static_fragments(story_variant(0))
+    for number in range(1, STATIC_FRAGMENTS_CACHE_SIZE * 3):
+        get_static_fragments(story_variant(number))
+        # Recently used stories stay cached
+        assert get_static_fragments(story_variant(0)) is kept
+    assert len(prompt_builder._static_fragments_cache) == STATIC_FRAGMENTS_CACHE_SIZE
+    assert get_static_fragments(story_variant(1)).story_background == "Story 1"
+
+
+def test_cache_friendly_prefix_is_stable_across_turns(engine):
+    engine.prompt_builder.layout = PROMPT_LAYOUT_CACHE_FRIENDLY
+    prompts = [engine._build_conversation_prompt()]
+    for response in ["Hello, both of you.", "How was your trip?", "What is wrong?"]:
+        asyncio.run(engine.process_user_input(response))
+        prompts.append(engine._build_conversation_prompt())
+
+    prefix = prompts[0].static_prefix
+    assert prefix and all(prompt.static_prefix == prefix for prompt in prompts)
+    assert all(prompt.text.startswith(prefix) for prompt in prompts)
+    # Only the part after the prefix changes from turn to turn
+    assert len({prompt.text for prompt in prompts}) == len(prompts)
+
+
+def test_cache_prefix_is_sent_as_a_system_message():
+    user_prompt, messages = LLMInterface._split_cache_prefix("Static. Dynamic.", "Static. ")
+    assert user_prompt == "Dynamic."
+    assert messages[0].parts[0].content == "Static. "
+    # A prefix that is not the start of the prompt is ignored
+    assert LLMInterface._split_cache_prefix("Dynamic.", "Static. ") == ("Dynamic.", None)
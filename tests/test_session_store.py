@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from game_engine import GameEngine
+from game_server import SessionManager
+from session_store import (
+    FileSessionStore, SessionStore, build_session_store, decode_snapshot, encode_snapshot
+)
+
+
+def play(engine, *responses):
+    for response in responses:
+        asyncio.run(engine.process_user_input(response))
+
+
+def test_snapshot_round_trip(engine, template):
+    play(engine, "Hello, both of you.", "How was your trip?")
+    restored = GameEngine(print_output=False, template=template)
+    restored.restore(engine.snapshot())
+
+    for char_id, char_state in engine.story_state.character_states.items():
+        assert dict(restored.story_state.character_states[char_id].state_values) == dict(char_state.state_values)
+    assert dict(restored.user_state.state_values) == dict(engine.user_state.state_values)
+    assert restored.story_state.current_node_id == engine.story_state.current_node_id
+    assert restored.story_state.node_history == engine.story_state.node_history
+    assert restored.conversation_history.to_dict() == engine.conversation_history.to_dict()
+    assert restored.current_dialogue == engine.current_dialogue
+    assert restored.situation_summary == engine.situation_summary
+    # The restored game sends the same next prompt
+    assert restored._build_conversation_prompt().text == engine._build_conversation_prompt().text
+
+
+def test_snapshot_encodings_decode_the_same(engine):
+    assert decode_snapshot(engine.snapshot(compress=True)) == decode_snapshot(engine.snapshot(compress=False))
+
+
+def test_restore_rejects_another_story(engine, template):
+    snapshot = decode_snapshot(engine.snapshot())
+    snapshot["story"] = "another story"
+    with pytest.raises(ValueError):
+        GameEngine(print_output=False, template=template).restore(snapshot)
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda snapshot: snapshot["states"]["character1"].pop(),
+    lambda snapshot: snapshot["states"]["character1"].append(0),
+    lambda snapshot: snapshot["user"].append(0),
+    lambda snapshot: snapshot.update(node="nowhere"),
+    lambda snapshot: snapshot["path"].append("nowhere"),
+])
+def test_restore_rejects_snapshots_not_matching_the_story(engine, template, corrupt):
+    snapshot = decode_snapshot(engine.snapshot())
+    corrupt(snapshot)
+    restored = GameEngine(print_output=False, template=template)
+    before = restored.snapshot()
+    with pytest.raises(ValueError):
+        restored.restore(snapshot)
+    assert restored.snapshot() == before
+
+
+def test_decode_rejects_unknown_versions():
+    with pytest.raises(ValueError):
+        decode_snapshot(encode_snapshot({"v": -1}))
+    with pytest.raises(ValueError):
+        decode_snapshot(b"x{}")
+
+
+def test_engines_share_the_template_but_not_state(template):
+    first = GameEngine(print_output=False, template=template)
+    second = GameEngine(print_output=False, template=template)
+    assert first.story_state.config is second.story_state.config
+    first.story_state.character_states["character1"].update_state(tension=10)
+    assert dict(first.story_state.character_states["character1"].state_values) != \
+        dict(second.story_state.character_states["character1"].state_values)
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def store(request, tmp_path):
+    path = tmp_path / "sessions" if request.param == "file" else tmp_path / "sessions.db"
+    store = build_session_store(request.param, str(path))
+    yield store
+    store.close()
+
+
+def test_store_save_load_delete(store):
+    assert store.load("a") is None
+    store.save("a", b"one")
+    store.save("a", b"two")
+    store.save("b", b"three")
+    assert store.load("a") == b"two"
+    assert sorted(store.session_ids()) == ["a", "b"]
+    assert store.delete("a") and not store.delete("a")
+    assert store.session_ids() == ["b"]
+
+
+def test_file_store_rejects_unsafe_ids(tmp_path):
+    with pytest.raises(ValueError):
+        FileSessionStore(str(tmp_path)).save("../escape", b"")
+
+
+def test_store_backends_must_implement_every_method():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_evicted_session_is_restored_from_the_store(store):
+    async def scenario():
+        manager = SessionManager(store=store)
+        session = await manager.create_session()
+        await manager.process_input(session.session_id, "Hello, both of you.")
+        view = session.to_dict()
+        assert await manager.evict_session(session.session_id)
+        restored = await manager.get_session(session.session_id)
+        assert restored is not None and restored.engine is not session.engine
+        assert restored.to_dict() == view
+        await manager.stop()
+
+    asyncio.run(scenario())
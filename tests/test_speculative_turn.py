@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from game_engine import GameEngine
+
+
+@pytest.fixture
+def engine(template):
+    engine = GameEngine(print_output=False, speculative=True, template=template)
+    asyncio.run(engine.start_story())
+    return engine
+
+
+def script_turn(engine, change_states=None, fail_speculation=False):
+    """Replace the analysis with change_states and record the prompts of the conversation requests"""
+    prompts = []
+    request = engine._request_conversation
+
+    async def request_conversation(prompt):
+        prompts.append(prompt.text)
+        # Let the analysis finish first, so the speculation is still in flight when it is checked
+        await asyncio.sleep(0.01)
+        if fail_speculation and len(prompts) == 1:
+            raise RuntimeError("speculation failed")
+        return await request(prompt)
+
+    async def analyze_and_advance(user_response):
+        # The speculation starts while the analysis is in flight
+        await asyncio.sleep(0)
+        if change_states is not None:
+            change_states(engine)
+        return {}
+
+    engine._request_conversation = request_conversation
+    engine._analyze_and_advance = analyze_and_advance
+    return prompts
+
+
+def test_unchanged_prompt_keeps_the_speculative_conversation(engine):
+    prompts = script_turn(engine)
+    asyncio.run(engine.process_user_input("Hello, both of you."))
+    assert len(prompts) == 1 and "Hello, both of you." in prompts[0]
+    assert engine.speculation_stats == {"hits": 1, "misses": 0}
+
+
+@pytest.mark.parametrize("change_states", [
+    lambda engine: engine.story_state.character_states["character1"].update_state(tension=100),
+    lambda engine: setattr(engine.story_state, "current_node_id", "early_tension"),
+])
+def test_changed_prompt_regenerates_the_conversation(engine, change_states):
+    prompts = script_turn(engine, change_states)
+    asyncio.run(engine.process_user_input("Hello, both of you."))
+    assert len(prompts) == 2 and prompts[0] != prompts[1]
+    assert engine.speculation_stats == {"hits": 0, "misses": 1}
+
+
+def test_failed_speculation_is_regenerated(engine):
+    prompts = script_turn(engine, fail_speculation=True)
+    asyncio.run(engine.process_user_input("Hello, both of you."))
+    assert len(prompts) == 2 and prompts[0] == prompts[1]
+    assert engine.speculation_stats == {"hits": 0, "misses": 1}
+    assert engine.current_dialogue
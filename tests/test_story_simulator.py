@@ -0,0 +1,79 @@
+from collections import Counter
+import numpy as np
+from omegaconf import OmegaConf
+from story_simulator import ScriptedPolicy, build_story_simulator
+from story_template import StoryTemplate
+
+RUNS, TURNS = 200, 30
+
+
+def play_with_story_state(template, simulator, deltas):
+    """Play every run one by one through StoryState with the simulator's deltas"""
+    endings, unfinished, visits = Counter(), Counter(), Counter()
+    columns = list(simulator.columns)
+    for run in range(deltas.shape[1]):
+        story_state = template.new_story_state(["character1", "character2"])
+        story_state.start_story()
+        visits[story_state.current_node_id] += 1
+        for turn in range(deltas.shape[0]):
+            if not story_state.get_current_node().next_state:
+                break
+            for column, key in enumerate(columns):
+                entity, state_name = key.split(".")
+                if simulator.analysed[column]:
+                    story_state.entities[entity].update_state(**{state_name: int(deltas[turn, run, column])})
+            taken = len(story_state.node_history)
+            story_state.advance_story()
+            if len(story_state.node_history) > taken:
+                visits[story_state.current_node_id] += 1
+        finished = not story_state.get_current_node().next_state
+        (endings if finished else unfinished)[story_state.current_node_id] += 1
+    return endings, unfinished, visits
+
+
+def assert_simulator_matches_story_state(template):
+    simulator = build_story_simulator(template.cfg)
+    deltas = np.random.default_rng(3).integers(-15, 15, size=(TURNS, RUNS, len(simulator.columns)), endpoint=True)
+    result = simulator.simulate(RUNS, TURNS, policy=lambda turn, values, rng: deltas[turn][:len(values)], batch_size=RUNS)
+
+    endings, unfinished, visits = play_with_story_state(template, simulator, deltas)
+    assert result.endings == dict(endings)
+    assert result.unfinished == dict(unfinished)
+    assert {node_id: count for node_id, count in result.node_visits.items() if count} == dict(visits)
+    assert sum(result.endings.values()) + sum(result.unfinished.values()) == RUNS
+
+
+def test_simulator_matches_story_state(template):
+    assert_simulator_matches_story_state(template)
+
+
+def test_transitions_back_to_the_same_node_are_visits(template):
+    cfg = OmegaConf.create(OmegaConf.to_container(template.cfg, resolve=True))
+    # Runs stay in the small talk while the user is in the middle, every turn counting as a visit
+    cfg.story.story_state.initial_conversation.next_state.insert(0, {
+        "condition": ["user.player_role > 40", "user.player_role < 60"],
+        "next_node": "initial_conversation",
+    })
+    assert_simulator_matches_story_state(StoryTemplate.from_config(cfg))
+
+
+def test_results_do_not_depend_on_batch_size(template):
+    simulator = build_story_simulator(template.cfg)
+    deltas = np.random.default_rng(5).integers(-15, 15, size=(TURNS, len(simulator.columns)), endpoint=True)
+
+    def policy(turn, values, rng):
+        return np.tile(deltas[turn], (len(values), 1))
+
+    whole = simulator.simulate(300, TURNS, policy=policy, batch_size=300)
+    batched = simulator.simulate(300, TURNS, policy=policy, batch_size=64)
+    assert whole == batched
+
+
+def test_scripted_policy_drives_named_states(template):
+    simulator = build_story_simulator(template.cfg)
+    policy = ScriptedPolicy([{"character1.tension": 5}], simulator.columns, repeat=True)
+    values = np.tile(simulator.defaults, (2, 1))
+    deltas = policy(0, values, np.random.default_rng(0))
+    assert deltas.dtype.kind == "i"
+    assert deltas[0, simulator.columns["character1.tension"]] == 5
+    assert deltas.sum() == 10
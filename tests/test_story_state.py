@@ -0,0 +1,93 @@
+import random
+import re
+import pytest
+from story_state import compile_condition, compile_effect
+
+# Conditions were regex-parsed and evaluated on every check before they were compiled
+PATTERN = re.compile(r'([\w\.]+)\s*([<>=!+-]+)\s*(-?\d+)')
+COMPARISONS = {
+    "==": lambda a, b: a == b, "!=": lambda a, b: a != b,
+    ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+}
+
+
+def reference_evaluate(condition, entities):
+    """Evaluate a condition string the way StoryState did at runtime"""
+    match = PATTERN.match(str(condition))
+    if not match:
+        return False
+    name, op, value = match.groups()
+    parts = name.split(".")
+    if len(parts) != 2 or op not in COMPARISONS:
+        return False
+    entity, state_name = parts
+    if entity not in entities or state_name not in entities[entity].state_values:
+        return False
+    return COMPARISONS[op](entities[entity].state_values[state_name], int(value))
+
+
+def story_conditions(story_state):
+    return [
+        condition
+        for node in story_state.story_nodes.values()
+        for transition in node.next_state or []
+        for condition in transition.get("condition", []) or []
+    ]
+
+
+def randomize(story_state, rng):
+    for entity in story_state.entities.values():
+        for state_name in entity.state_values:
+            entity.state_values[state_name] = rng.randint(-5, 105)
+
+
+def test_compiled_conditions_match_runtime_evaluation(template):
+    story_state = template.new_story_state(["character1", "character2"])
+    conditions = story_conditions(story_state)
+    assert conditions
+    compiled = {}
+    for condition in conditions:
+        try:
+            compiled[condition] = compile_condition(condition)
+        except ValueError:
+            compiled[condition] = None
+
+    rng = random.Random(0)
+    for _ in range(300):
+        randomize(story_state, rng)
+        for condition in conditions:
+            holds = compiled[condition] is not None and compiled[condition].evaluate(story_state.entities)
+            assert holds == reference_evaluate(condition, story_state.entities), condition
+
+
+@pytest.mark.parametrize("condition", ["tension >= 5", "character1.tension >> 5", "villain.tension > 1"])
+def test_malformed_conditions_are_rejected(condition):
+    with pytest.raises(ValueError):
+        compile_condition(condition)
+
+
+def test_malformed_conditions_never_hold(template):
+    story_state = template.new_story_state(["character1", "character2"])
+    for node_id, node in story_state.story_nodes.items():
+        for transition, config in zip(node.transitions, node.next_state or []):
+            if config.get("condition") and not transition.conditions:
+                assert not transition.is_open(story_state.entities), node_id
+
+
+@pytest.mark.parametrize("effect, start, expected", [
+    ("user.player_role = 3", 50, 3),
+    ("user.player_role += 10", 50, 60),
+    ("user.player_role -= 80", 50, 0),
+    ("user.player_role += 80", 50, 100),
+])
+def test_effects_stay_within_bounds(template, effect, start, expected):
+    story_state = template.new_story_state(["character1"])
+    story_state.user_state.state_values["player_role"] = start
+    assert compile_effect(effect).apply(story_state.entities)
+    assert story_state.user_state.state_values["player_role"] == expected
+
+
+def test_division_by_zero_is_rejected():
+    with pytest.raises(ValueError):
+        compile_effect("user.player_role /= 0")
@@ -0,0 +1,50 @@
+import asyncio
+from game_engine import GameEngine
+from story_template import load_story_template
+
+
+def test_template_is_loaded_once_per_overrides(template):
+    assert load_story_template() is template
+
+
+def test_new_story_states_share_the_config_but_not_state(template):
+    first = template.new_story_state(["character1", "character2"])
+    second = template.new_story_state(["character1", "character2"])
+    assert first.story_nodes is second.story_nodes is template.story_config.story_state
+    assert first.character_states["character1"] is not second.character_states["character1"]
+    assert first.user_state is not second.user_state
+    assert first.character_states["character1"].schema is second.character_states["character1"].schema
+
+    defaults = dict(second.character_states["character1"].state_values)
+    first.character_states["character1"].update_state(tension=10)
+    assert dict(second.character_states["character1"].state_values) == defaults
+    assert dict(template.new_story_state(["character1"]).character_states["character1"].state_values) == defaults
+
+
+def test_advancing_one_story_leaves_the_others_in_place(template):
+    first = template.new_story_state(["character1", "character2"])
+    second = template.new_story_state(["character1", "character2"])
+    first.start_story()
+    second.start_story()
+    start = second.current_node_id
+
+    first.advance_story()
+    first.advance_story()
+    assert first.current_node_id != start and len(first.node_history) > 1
+    assert second.current_node_id == start and second.node_history == [start]
+    # Transition effects only change the state of the story they ran in
+    assert dict(second.user_state.state_values) == dict(template.new_story_state([]).user_state.state_values)
+
+
+def test_engines_of_a_template_play_independently(template):
+    first = GameEngine(print_output=False, template=template)
+    second = GameEngine(print_output=False, template=template)
+    asyncio.run(first.start_story())
+    asyncio.run(second.start_story())
+    before = second.snapshot()
+
+    asyncio.run(first.process_user_input("Hello, both of you."))
+    asyncio.run(first.process_user_input("How was your trip?"))
+    assert len(first.conversation_history) == 2
+    assert len(second.conversation_history) == 0
+    assert second.snapshot() == before
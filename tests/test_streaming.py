@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+from game_engine import ConversationOutput, GameEngine
+from pydantic_LLM import ANY_MODEL, LLMClientRegistry, LLMInterface
+
+# The structured output, split where a streaming model could pause
+CHUNKS = ('{"dialogue": ["Trip: Welcome!"', ', "Grace: Come in."', '], "situation_summary": "The evening starts."}')
+
+
+def scripted_stream(sent):
+    async def respond(messages, info):
+        raise AssertionError("Only streamed requests are expected")
+
+    async def stream(messages, info):
+        name = info.result_tools[0].name
+        for index, chunk in enumerate(CHUNKS):
+            sent.append(index)
+            yield {0: DeltaToolCall(name=name if index == 0 else None, json_args=chunk)}
+            await asyncio.sleep(0)
+
+    return FunctionModel(respond, stream_function=stream)
+
+
+def test_lines_are_emitted_as_soon_as_they_parse(engine):
+    sent = []
+    registry = LLMClientRegistry()
+    registry.register_model(ANY_MODEL, scripted_stream(sent))
+    engine.llm = LLMInterface(ConversationOutput, task="generation", registry=registry)
+
+    async def collect():
+        # The chunk the model had sent last when each item arrived
+        return [(chunk.kind, chunk.text, sent[-1]) async for chunk in engine.stream_conversation()]
+
+    received = asyncio.run(collect())
+    assert received == [
+        ("dialogue", "Trip: Welcome!", 0),
+        ("dialogue", "Grace: Come in.", 1),
+        ("situation_summary", "The evening starts.", 2),
+    ]
+    assert engine.current_dialogue == ["Trip: Welcome!", "Grace: Come in."]
+
+
+@pytest.mark.parametrize("mode", ["speculative", "fused_turn"])
+def test_streamed_turns_run_in_the_configured_mode(template, mode):
+    engine = GameEngine(print_output=False, template=template, **{mode: True})
+    asyncio.run(engine.start_story())
+
+    async def collect():
+        return [chunk async for chunk in engine.stream_user_input("Hello, both of you.")]
+
+    chunks = asyncio.run(collect())
+    assert [chunk.text for chunk in chunks] == [*engine.current_dialogue, engine.situation_summary]
+    assert [chunk.kind for chunk in chunks][-1] == "situation_summary"
+    stats = engine.speculation_stats if mode == "speculative" else engine.fused_stats
+    assert sum(stats.values()) == 1